@@ -0,0 +1,122 @@
+"""Extraction quality and LLM tokens of packed against unpacked prompts.
+
+Every chunk is extracted twice, once alone and once packed with its
+neighbours, the unpacked records are the reference.
+
+Usage:
+    python3 evaluation/extraction/compare_packing.py --input repodir --pack_tokens 1024
+"""
+import argparse
+import asyncio
+import json
+import os
+
+from loguru import logger
+
+from huixiangdou.primitive import LLM, ChineseRecursiveTextSplitter, FileOperation
+from huixiangdou.service import (extract_chunk_knowledge,
+                                 extract_packed_knowledge, pack_chunks)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--input',
+                        required=True,
+                        help='Directory of documents to extract.')
+    parser.add_argument('--config_path', default='config.ini')
+    parser.add_argument('--chunk_size', type=int, default=768)
+    parser.add_argument('--max_chunks', type=int, default=64)
+    parser.add_argument('--pack_tokens', type=int, default=1024)
+    parser.add_argument('--pack_size', type=int, default=8)
+    parser.add_argument('--output', default='packing_report.json')
+    return parser.parse_args()
+
+
+def load_chunks(args):
+    file_opr = FileOperation()
+    splitter = ChineseRecursiveTextSplitter(keep_separator=True,
+                                            is_separator_regex=True,
+                                            chunk_size=args.chunk_size,
+                                            chunk_overlap=32)
+    chunks = []
+    for file in file_opr.scan_dir(repo_dir=args.input):
+        if file._type not in ['md', 'text']:
+            continue
+        text, error = file_opr.read(file.origin)
+        if error is not None:
+            logger.warning(f'skip {file.origin}, {error}')
+            continue
+        chunks += splitter.create_chunks(texts=[text],
+                                         metadatas=[{
+                                             'source': file.origin
+                                         }])
+        if len(chunks) >= args.max_chunks:
+            break
+    return chunks[0:args.max_chunks]
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def used_tokens(llm: LLM) -> int:
+    return llm.sum_input_token_size
+
+
+async def compare(args):
+    llm = LLM(config_path=args.config_path)
+    chunks = load_chunks(args)
+    logger.info(f'{len(chunks)} chunks')
+
+    before = used_tokens(llm)
+    single = await asyncio.gather(
+        *[extract_chunk_knowledge(c, llm) for c in chunks])
+    single_tokens = used_tokens(llm) - before
+
+    before = used_tokens(llm)
+    packs = pack_chunks(chunks,
+                        max_tokens=args.pack_tokens,
+                        max_count=args.pack_size)
+    replies = await asyncio.gather(
+        *[extract_packed_knowledge(p, llm) for p in packs])
+    packed_tokens = used_tokens(llm) - before
+    packed = dict()
+    estimated = 0
+    for pack, (results, saved) in zip(packs, replies):
+        estimated += saved
+        for c, r in zip(pack, results):
+            packed[c._hash] = r
+
+    entity_scores = []
+    relation_scores = []
+    details = []
+    for c, (nodes, edges) in zip(chunks, single):
+        p_nodes, p_edges = packed[c._hash]
+        e = jaccard(set(nodes), set(p_nodes))
+        r = jaccard({tuple(sorted(k)) for k in edges},
+                    {tuple(sorted(k)) for k in p_edges})
+        entity_scores.append(e)
+        relation_scores.append(r)
+        details.append(
+            dict(chunk=c._hash,
+                 entities=[len(nodes), len(p_nodes)],
+                 relations=[len(edges), len(p_edges)],
+                 entity_jaccard=e,
+                 relation_jaccard=r))
+
+    report = dict(chunks=len(chunks),
+                  prompts=[len(chunks), len(packs)],
+                  input_tokens=[single_tokens, packed_tokens],
+                  estimated_saved=estimated,
+                  entity_jaccard=sum(entity_scores) / max(1, len(chunks)),
+                  relation_jaccard=sum(relation_scores) / max(1, len(chunks)),
+                  details=details)
+    with open(args.output, 'w', encoding='utf8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    logger.info({k: v for k, v in report.items() if k != 'details'})
+
+
+if __name__ == '__main__':
+    asyncio.run(compare(parse_args()))
@@ -1,4 +1,4 @@
-from huixiangdou.primitive import LLM, always_get_an_event_loop
+from huixiangdou.primitive import LLM, Priority, always_get_an_event_loop
 from huixiangdou.pipeline import ParallelPipeline
 from huixiangdou.service import RetrieveResource
 
@@ -97,7 +97,8 @@ for input_file in input_files:
                 continue
 
             prompt = template.format(gt=text2, output=text1)
-            response = loop.run_until_complete(resource.llm.chat(prompt))
+            response = loop.run_until_complete(
+                resource.llm.chat(prompt, priority=Priority.EVALUATION))
 
             rouge = Rouge()
             dt_jb = ' '.join(jieba.cut(text1)) 
@@ -1,4 +1,4 @@
-from huixiangdou.primitive import LLM, always_get_an_event_loop
+from huixiangdou.primitive import LLM, Priority, always_get_an_event_loop
 from huixiangdou.pipeline import ParallelPipeline
 from huixiangdou.service import RetrieveResource
 
@@ -131,7 +131,8 @@ for k,v in pairs.items():
         pdb.set_trace()
         continue
     prompt = template.format(query=k, answer1=v[0], answer2=v[1])
-    response = loop.run_until_complete(resource.llm.chat(prompt))
+    response = loop.run_until_complete(
+        resource.llm.chat(prompt, priority=Priority.EVALUATION))
     winner = extract_winner(text=response)
 
 rate = count_left / count_right
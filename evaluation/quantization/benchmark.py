@@ -0,0 +1,111 @@
+"""Recall loss against memory saved by quantized faiss indexes.
+
+Usage:
+    # random vectors
+    python3 evaluation/quantization/benchmark.py --ntotal 200000 --dim 1024
+    # stored chunk embeddings of a built knowledge base
+    python3 evaluation/quantization/benchmark.py --embedding_dir workdir/db_embedding
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+
+import faiss
+import numpy as np
+from loguru import logger
+
+from huixiangdou.primitive import DistanceStrategy, Faiss
+from huixiangdou.primitive.faiss import QUANTIZATIONS, RERANK_FACTOR
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--embedding_dir',
+                        default=None,
+                        help='`EmbeddingStore` folder, random vectors if unset')
+    parser.add_argument('--ntotal', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=1024)
+    parser.add_argument('--index_type',
+                        default='flat',
+                        choices=['flat', 'hnsw', 'ivf_flat'])
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--output', default='quantization_report.json')
+    return parser.parse_args()
+
+
+def load_features(args) -> np.ndarray:
+    if args.embedding_dir is None:
+        rng = np.random.default_rng(0)
+        return rng.standard_normal((args.ntotal, args.dim)).astype(np.float32)
+
+    conn = sqlite3.connect(os.path.join(args.embedding_dir, 'embeddings.sql'))
+    model, dim, rows = conn.execute(
+        'SELECT model, dim, rows FROM models ORDER BY rows DESC').fetchone()
+    conn.close()
+    digest = hashlib.md5(model.encode('utf8')).hexdigest()[0:16]
+    matrix = np.memmap(os.path.join(args.embedding_dir, f'{digest}.f16'),
+                       dtype=np.float16,
+                       mode='r',
+                       shape=(rows, dim))
+    logger.info(f'{rows} embeddings of {model}')
+    return np.asarray(matrix[0:args.ntotal], dtype=np.float32)
+
+
+def main():
+    args = parse_args()
+    features = load_features(args)
+    ntotal, dim = features.shape
+    strategy = DistanceStrategy.EUCLIDEAN_DISTANCE
+
+    results = []
+    for quantization in QUANTIZATIONS:
+        index = Faiss.build_index(features,
+                                  strategy,
+                                  index_type=args.index_type,
+                                  quantization=quantization)
+        index.add(features)
+        memory = Faiss.estimate_memory(args.index_type, ntotal, dim,
+                                       quantization)
+        refine = Faiss._refine(index)
+        # without re-ranking first, then with float32 re-ranking
+        factors = [1, RERANK_FACTOR] if refine is not None else [None]
+        for k_factor in factors:
+            if refine is not None:
+                refine.k_factor = k_factor
+            report = Faiss.benchmark_index(index,
+                                           features,
+                                           strategy,
+                                           k=args.k)
+            best = max(report['runs'], key=lambda x: x['recall'])
+            results.append({
+                'quantization': quantization,
+                'rerank': k_factor,
+                'memory_mb': round(memory / (1 << 20), 2),
+                'disk_mb': round(faiss.serialize_index(index).size / (1 << 20), 2),
+                'recall': best['recall'],
+                'latency_ms': best['latency_ms']
+            })
+
+    base = results[0]
+    print('quantization rerank memory_mb saved recall recall_loss latency_ms')
+    for r in results:
+        r['memory_saved'] = round(1 - r['memory_mb'] / base['memory_mb'], 4)
+        r['recall_loss'] = round(base['recall'] - r['recall'], 4)
+        print(r['quantization'], r['rerank'], r['memory_mb'],
+              r['memory_saved'], r['recall'], r['recall_loss'],
+              r['latency_ms'])
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'ntotal': ntotal,
+            'dim': dim,
+            'index_type': args.index_type,
+            'k': args.k,
+            'results': results
+        }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
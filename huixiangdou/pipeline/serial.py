@@ -35,7 +35,8 @@ class PreprocNode:
         #intention && topic analysis
         prompt = PROMPTS['extract_topic_intention'][sess.language].format(
             input_text=sess.query.text)
-        json_str = await self.resource.llm.chat(prompt=prompt)
+        # latency critical, hedge against a slow backend
+        json_str = await self.resource.llm.chat(prompt=prompt, hedge=True)
         sess.logger.info(f'{__file__} {json_str}')
         try:
             if json_str.startswith('```json'):
@@ -87,9 +88,10 @@ class ReduceGenerate:
         else:
             sess.stage = "2_rerank"
             yield sess
-            sess.fused_reply = Retriever.fuse(replies=sess.retrieve_replies,
-                                              query=sess.query,
-                                              resource=self.resource)
+            sess.fused_reply = await Retriever.afuse(
+                replies=sess.retrieve_replies,
+                query=sess.query,
+                resource=self.resource)
             prompt = sess.fused_reply.format_prompt(query=real_question,
                                                     language=sess.language)
 
@@ -239,9 +241,10 @@ class SerialPipeline:
             sess.retrieve_replies = [
                 await self.retriever_reason.explore(query=sess.query)
             ]
-            sess.fused_reply = Retriever.fuse(replies=sess.retrieve_replies,
-                                              query=sess.query,
-                                              resource=self.resource)
+            sess.fused_reply = await Retriever.afuse(
+                replies=sess.retrieve_replies,
+                query=sess.query,
+                resource=self.resource)
 
             success = await ppl.process(sess, mode='preceding')
             if success:
@@ -1,5 +1,6 @@
 """extract feature and search with user query."""
 import argparse
+import asyncio
 import json
 import os
 import shutil
@@ -7,6 +8,7 @@ import time
 from multiprocessing import Pool
 from typing import Dict, List, Tuple, Iterator
 import random
+import numpy as np
 import pytoml
 from loguru import logger
 from tqdm import tqdm
@@ -15,7 +17,18 @@ from ..primitive import (ChineseRecursiveTextSplitter, Chunk, Faiss, FileName,
                          FileOperation, RecursiveCharacterTextSplitter,
                          nested_split_markdown, split_python_code, BM25Okapi,
                          always_get_an_event_loop)
-from ..service import histogram, ChunkSQL, RetrieveResource, SharedRetrieverPool, parse_chunk_to_knowledge
+from ..service import histogram, ChunkSQL, ExtractionSQL, DescriptionSQL, RetrieveResource, SharedRetrieverPool, ChunkPacker, extract_packed_knowledge, stage_knowledge, flush_knowledge, extraction_prompt_version, extraction_model
+from ..service.nlu import SUMMARY_TOKENS
+
+# `flush_knowledge` argument and folder of each KAG vector store
+KAG_DBS = {
+    'entityDB': 'db_kag_entity',
+    'relationDB': 'db_kag_relation',
+    'entityDB_mix': 'db_kag_entity_mix',
+    'relationDB_mix': 'db_kag_relation_mix'
+}
+# entities and relations summarized and published per flush step
+FLUSH_BATCH = 4096
 
 
 def read_and_save(file: FileName):
@@ -56,6 +69,24 @@ class FeatureStore:
         self.chunk_size = chunk_size
         self.work_dir = work_dir
         self.file_opr = FileOperation()
+        # re-indexing only embeds content never seen before
+        self.embedder.use_store(os.path.join(work_dir, 'db_embedding'))
+
+        with open(resource.config_path, encoding='utf8') as f:
+            store_config = pytoml.load(f)['store']
+        # chunks extracted by LLM at once, pending chunks across files and
+        # chunks merged into the graph per checkpoint
+        self.build_concurrency = store_config.get('build_concurrency', 16)
+        self.build_queue = store_config.get('build_queue', 256)
+        self.build_merge_batch = store_config.get('build_merge_batch', 64)
+        # pack small chunks up to this many content tokens into one
+        # extraction prompt, 0 disables packing
+        self.build_pack_tokens = store_config.get('build_pack_tokens', 0)
+        self.build_pack_size = store_config.get('build_pack_size', 8)
+        # merged descriptions longer than this are summarized by LLM once,
+        # at the end of a build
+        self.build_summary_tokens = store_config.get('build_summary_tokens',
+                                                     SUMMARY_TOKENS)
 
         logger.info('init dense retrieval database with chunk_size {}'.format(
             chunk_size))
@@ -88,25 +119,62 @@ class FeatureStore:
             length += len(c.content_or_path)
         return chunks, length
 
-    async def build_bm25(self, files: Iterator[FileName]) -> None:
-        """Use BM25 for building code feature"""
-        # split by function, class and annotation, remove blank
-        # build bm25 pickle
+    def iter_code_chunks(self, files: Iterator[FileName],
+                         batch_size: int = 1024) -> Iterator[List[Chunk]]:
+        """Read and split code files lazily, yield batches of chunks."""
         fileopr = FileOperation()
-        chunks = []
-
+        batch = []
         for file in files:
             content, error = fileopr.read(file.origin)
             if error is not None:
                 continue
-            file_chunks = split_python_code(filepath=file.origin,
-                                            text=content,
-                                            metadata={'source': file.origin})
-            chunks += file_chunks
-
+            batch += split_python_code(filepath=file.origin,
+                                       text=content,
+                                       metadata={'source': file.origin})
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    async def build_bm25(self,
+                         files: Iterator[FileName],
+                         flush_every: int = 100000) -> None:
+        """Use BM25 for building code feature"""
+        # split by function, class and annotation, remove blank
+        # only new chunks are tokenized, chunks of removed code are deleted
         sparse_dir = os.path.join(self.work_dir, 'db_code')
+        chunkDB = ChunkSQL(file_dir=sparse_dir)
         bm25 = BM25Okapi()
-        bm25.save(chunks, sparse_dir)
+        tokenizer = bm25.tokenizer
+        if os.path.exists(os.path.join(sparse_dir, 'meta.json')):
+            bm25.load(sparse_dir, tokenizer=tokenizer, chunk_store=chunkDB)
+        else:
+            bm25.save([], sparse_dir, chunk_store=chunkDB)
+
+        # documents still present in code
+        seen = np.zeros(bm25.num_docs, dtype=bool)
+        appended = 0
+        for chunks in self.iter_code_chunks(files):
+            doc_ids = bm25.lookup([c._hash for c in chunks])
+            seen[doc_ids[(doc_ids >= 0) & (doc_ids < len(seen))]] = True
+            appended += bm25.append(chunks)
+            if appended >= flush_every:
+                # bound memory of pending postings
+                bm25.flush()
+                seen = np.concatenate(
+                    [seen, np.ones(bm25.num_docs - len(seen), dtype=bool)])
+                appended = 0
+
+        seen = np.concatenate(
+            [seen, np.ones(bm25.num_docs - len(seen), dtype=bool)])
+        removed = [h.decode('utf8') for h in bm25.hashes[~seen]]
+        bm25.delete(removed)
+        for _hash in removed:
+            chunkDB.delete(_hash)
+        bm25.flush()
+        logger.info(
+            f'bm25 {bm25.corpus_size} chunks, {len(removed)} removed')
         return None
 
     def split_to_chunks(self, file: FileName) -> Tuple[List[Chunk]]:
@@ -142,68 +210,226 @@ class FeatureStore:
         
     async def remove_knowledge(self) -> None:
         logger.warning('Remove knowledge graph and database')
-        shutil.rmtree(self.work_dir, ignore_errors=True)
+        # embeddings are keyed by content, LLM extractions by chunk and
+        # summaries by their input, keep them for the rebuild
+        keep = [
+            os.path.basename(self.embedder.store.file_dir), 'db_extraction',
+            'db_description'
+        ]
+        if os.path.exists(self.work_dir):
+            for name in os.listdir(self.work_dir):
+                if name in keep:
+                    continue
+                target = os.path.join(self.work_dir, name)
+                if os.path.isdir(target):
+                    shutil.rmtree(target, ignore_errors=True)
+                else:
+                    os.remove(target)
+        descriptions = DescriptionSQL(
+            file_dir=os.path.join(self.work_dir, 'db_description'))
+        descriptions.clear()
+        descriptions.close()
         self.graph_store.drop()
 
     async def build_knowledge(self, files: Iterator[FileName]) -> None:
-        """Split docs into chunks, build knowledge graph and base based on them."""
-        entityDB = Faiss.load_local(
-            os.path.join(self.work_dir, 'db_kag_entity'))
-        relationDB = Faiss.load_local(
-            os.path.join(self.work_dir, 'db_kag_relation'))
-
-        entityDB_mix = Faiss.load_local(
-            os.path.join(self.work_dir, 'db_kag_entity_mix'))
-        relationDB_mix = Faiss.load_local(
-            os.path.join(self.work_dir, 'db_kag_relation_mix'))
-
+        """Split docs into chunks, build knowledge graph and base based on them.
+
+        A producer splits files into one bounded queue shared by all files,
+        `build_concurrency` workers extract chunks with LLM and a merger
+        merges every `build_merge_batch` results into `db_description`, then
+        records its chunks in chunkDB, so an interrupted build resumes from
+        the last merge. Entities and relations whose descriptions changed are
+        summarized and published into graph and vector stores once at the
+        end, see `_flush`.
+
+        With `build_pack_tokens` > 0 the producer packs small chunks, each
+        pack costs one extraction prompt.
+
+        Extractions are saved in `db_extraction` as soon as LLM returns, the
+        producer sends chunks found there straight to the merger, so a
+        rebuild after a crash or `remove_knowledge` skips LLM extraction.
+        """
+        dbs = {
+            name: Faiss.load_local(os.path.join(self.work_dir, folder))
+            for name, folder in KAG_DBS.items()
+        }
         chunkDB = ChunkSQL(file_dir=os.path.join(self.work_dir, 'db_chunk'))
+        descriptions = DescriptionSQL(
+            file_dir=os.path.join(self.work_dir, 'db_description'))
+        artifacts = ExtractionSQL(
+            file_dir=os.path.join(self.work_dir, 'db_extraction'),
+            prompt_version=extraction_prompt_version(),
+            model=extraction_model(self.llm))
+
+        workers = max(1, self.build_concurrency)
+        chunk_queue = asyncio.Queue(maxsize=max(1, self.build_queue))
+        result_queue = asyncio.Queue(maxsize=max(1, self.build_queue))
+        pbar = tqdm(desc='build knowledge', unit='chunk')
+        start = time.time()
+        start_tokens = self.llm.sum_input_token_size + self.llm.sum_output_token_size
+        merged = 0
+        tokens_saved = 0
+        reused = 0
+
+        def tokens_per_second() -> float:
+            tokens = self.llm.sum_input_token_size + self.llm.sum_output_token_size - start_tokens
+            return tokens / max(time.time() - start, 1e-6)
+
+        async def produce():
+            nonlocal reused
+            seen = set()
+            packer = None
+            if self.build_pack_tokens > 0:
+                packer = ChunkPacker(max_tokens=self.build_pack_tokens,
+                                     max_count=self.build_pack_size)
+            try:
+                for file in files:
+                    if not file.state:
+                        logger.error(f'unknown file state {file}')
+                        continue
+                    try:
+                        raw_chunks = self.split_to_chunks(file)
+                    except Exception as e:
+                        logger.error(str(e))
+                        continue
+                    existed = chunkDB.exist_many(
+                        [c._hash for c in raw_chunks])
+                    raw_chunks = [
+                        c for c in raw_chunks
+                        if c._hash not in existed and c._hash not in seen
+                    ]
+                    cached = artifacts.get_many(raw_chunks)
+                    for c, result in zip(raw_chunks, cached):
+                        if c._hash in seen:
+                            continue
+                        seen.add(c._hash)
+                        if result is not None:
+                            reused += 1
+                            await result_queue.put((c, result))
+                            pbar.update(1)
+                            continue
+                        packs = packer.add(c) if packer else [[c]]
+                        for pack in packs:
+                            await chunk_queue.put(pack)
+                if packer:
+                    for pack in packer.flush():
+                        await chunk_queue.put(pack)
+            finally:
+                for _ in range(workers):
+                    await chunk_queue.put(None)
+
+        async def extract():
+            nonlocal tokens_saved
+            try:
+                while True:
+                    pack = await chunk_queue.get()
+                    if pack is None:
+                        break
+                    try:
+                        results, saved = await extract_packed_knowledge(
+                            chunks=pack, llm=self.llm)
+                    except Exception as e:
+                        # not checkpointed, the next build retries it
+                        logger.error(
+                            f'extract {[c._hash for c in pack]} failed, {e}')
+                        continue
+                    artifacts.put_many([(c, r)
+                                        for c, r in zip(pack, results)])
+                    tokens_saved += saved
+                    for chunk, result in zip(pack, results):
+                        await result_queue.put((chunk, result))
+                    pbar.update(len(pack))
+                    pbar.set_postfix(tokens_per_s=round(tokens_per_second()),
+                                     merged=merged)
+            finally:
+                await result_queue.put(None)
+
+        async def merge():
+            nonlocal merged
+            finished = 0
+            batch = []
+            while finished < workers:
+                item = await result_queue.get()
+                if item is None:
+                    finished += 1
+                else:
+                    batch.append(item)
+                if batch and (len(batch) >= self.build_merge_batch
+                              or finished == workers):
+                    # sqlite writes and token counting, keep workers running
+                    if await asyncio.to_thread(self._checkpoint, batch,
+                                               descriptions, chunkDB):
+                        merged += len(batch)
+                    batch = []
+
+        tasks = [
+            asyncio.ensure_future(task)
+            for task in [produce(), merge()] +
+            [extract() for _ in range(workers)]
+        ]
+        try:
+            await asyncio.gather(*tasks)
+            # also publishes rows left by an interrupted build
+            published = await self._flush(dbs, descriptions)
+        finally:
+            for task in tasks:
+                task.cancel()
+            pbar.close()
+            artifacts.close()
+            descriptions.close()
+        elapsed = max(time.time() - start, 1e-6)
+        logger.info(
+            f'build knowledge {merged} chunks in {int(elapsed)}s, {merged / elapsed:.2f} chunks/s, {tokens_per_second():.1f} tokens/s, {reused} chunks from saved extractions, packing saved {tokens_saved} input tokens, published {published} entities and relations'
+        )
+        return None
 
-        for file in tqdm(files, 'build knowledge'):
-            if not file.state:
-                logger.error(f'unknown file state {file}')
-                continue
-
-            raw_chunks = self.split_to_chunks(file)
-            chunks = []
-            for c in raw_chunks:
-                if not chunkDB.exist(c):
-                    chunks.append(c)
-            if len(chunks) < 1:
-                logger.info('skip')
-                continue
-
+    def _checkpoint(self, batch: List[Tuple[Chunk, Tuple[dict, dict]]],
+                    descriptions: DescriptionSQL, chunkDB: ChunkSQL) -> bool:
+        """Merge a batch into `descriptions`, then mark it done. Runs on a
+        worker thread."""
+        try:
+            stage_knowledge(results=[r for _, r in batch],
+                            descriptions=descriptions)
+        except Exception as e:
+            logger.error(f'merge {len(batch)} chunks failed, {e}')
+            return False
+        chunkDB.add([c for c, _ in batch])
+        return True
+
+    async def _flush(self, dbs: Dict[str, Faiss],
+                     descriptions: DescriptionSQL) -> int:
+        """Summarize and publish changed entities and relations by
+        `FLUSH_BATCH`, each step saves the vector stores before marking its
+        rows published."""
+        count = 0
+        while True:
             try:
-                await parse_chunk_to_knowledge(chunks=chunks,
-                                               llm=self.llm,
-                                               entityDB=entityDB,
-                                               relationDB=relationDB,
-                                               entityDB_mix=entityDB_mix,
-                                               relationDB_mix=relationDB_mix,
-                                               graph_store=self.graph_store)
-                chunkDB.add(chunks)
-            except Exception as e:
-                logger.error(str(e))
-                pass
-        # dump results
-        logger.info('Save db')
-        entityDB.save(folder_path=os.path.join(self.work_dir, 'db_kag_entity'),
-                      embedder=self.embedder)
-        relationDB.save(folder_path=os.path.join(self.work_dir,
-                                                 'db_kag_relation'),
-                        embedder=self.embedder)
-
-        entityDB_mix.save(folder_path=os.path.join(self.work_dir,
-                                                   'db_kag_entity_mix'),
-                          embedder=self.embedder)
-        relationDB_mix.save(folder_path=os.path.join(self.work_dir,
-                                                     'db_kag_relation_mix'),
+                published = await flush_knowledge(
+                    llm=self.llm,
+                    descriptions=descriptions,
+                    graph_store=self.graph_store,
+                    summary_tokens=self.build_summary_tokens,
+                    limit=FLUSH_BATCH,
+                    **dbs)
+                if not published:
+                    break
+                for name, db in dbs.items():
+                    db.save(folder_path=os.path.join(self.work_dir,
+                                                     KAG_DBS[name]),
                             embedder=self.embedder)
-        return None
+            except Exception as e:
+                # rows stay dirty, the next build publishes them
+                logger.error(f'publish knowledge failed, {e}')
+                break
+            for kind, items in published.items():
+                descriptions.mark_published(kind, items)
+                count += len(items)
+        return count
 
     async def build_dense(self, files: Iterator[FileName]) -> None:
         """Split docs into chunks, build knowledge graph and base based on them."""
-        denseDB = Faiss.load_local(os.path.join(self.work_dir, 'db_dense'))
+        dense_path = os.path.join(self.work_dir, 'db_dense')
+        denseDB = Faiss.load_local(dense_path)
         for file in tqdm(files, 'build dense'):
             if not file.state:
                 logger.error(f'unknown file state {file}')
@@ -212,7 +438,7 @@ class FeatureStore:
             raw_chunks = self.split_to_chunks(file)
             for c in raw_chunks:
                 denseDB.upsert(c)
-        denseDB.save_local()
+        denseDB.save(folder_path=dense_path, embedder=self.embedder)
 
     def analyze(self, chunks: List[Chunk]):
         """Output documents length mean, median and histogram."""
@@ -1,6 +1,7 @@
 """primitive module."""
 from .chunk import Chunk  # noqa E401
 from .embedder import Embedder  # noqa E401
+from .embedding_store import EmbeddingStore  # noqa E401
 from .faiss import Faiss  # noqa E401
 from .file_operation import FileName, FileOperation  # noqa E401
 from .reranker import Reranker  # noqa E401
@@ -15,8 +16,12 @@ from .splitter import (
     split_python_code)
 from .limitter import RPM, TPM
 from .bm250kapi import BM25Okapi
-from .knowledge import MemoryGraph, Direction, Edge, MemoryGraph, Graph, Vertex
+from .knowledge import MemoryGraph, Direction, Edge, MemoryGraph, Graph, Vertex, FrozenGraph
 from .llm import LLM, Backend
-from .token import encode_string, decode_tokens, judge_language
+from .cache import LLMCache
+from .scheduler import ConcurrencyScheduler, Priority
+from .token import (encode_string, decode_tokens, judge_language,
+                    count_tokens, count_tokens_batch, prime_token_count,
+                    encoder_available)
 from .utils import always_get_an_event_loop
-from .db import DB
\ No newline at end of file
+from .db import DB, select_in
\ No newline at end of file
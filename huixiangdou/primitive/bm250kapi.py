@@ -1,23 +1,60 @@
 #!/usr/bin/env python
 # heavily modified from https://github.com/dorianbrown/rank_bm25/blob/master/rank_bm25.py
-import math
+import json
 import numpy as np
 import pickle as pkl
 import os
 import jieba.analyse
 
+from collections import Counter
 from loguru import logger
-from typing import List, Union
+from typing import List, Tuple, Union
 from .chunk import Chunk
 """
 All of these algorithms have been taken from the paper:
 Trotmam et al, Improvements to BM25 and Language Models Examined
 
-Here we implement all the BM25 variations mentioned. 
+Here we implement all the BM25 variations mentioned.
 """
 
+# on-disk layout version, see `BM25Okapi.flush`
+FORMAT_VERSION = 2
+
+
+def _save_array(filedir: str, name: str, array: np.ndarray):
+    """Write to a temp file then rename, readers mapping the old file keep
+    their view."""
+    filepath = os.path.join(filedir, name)
+    tmp_path = filepath + '.tmp.npy'
+    np.save(tmp_path, array)
+    os.replace(tmp_path, filepath)
+
 
 class BM25Okapi:
+    """BM25 with a term-major CSR matrix of precomputed weights.
+
+    Row `t` of (`indptr`, `indices`, `weights`) holds the ids and BM25 weights
+    of documents containing term `t`, so scoring a query only touches the
+    postings of its terms.
+
+    The index is incremental. `append` tokenizes only the new chunks into an
+    in-memory delta, `delete` tombstones chunk hashes, and IDF, avgdl and
+    weights are recomputed lazily (vectorized, no re-tokenizing) before the
+    next query. `flush` compacts tombstones and writes a versioned columnar
+    directory which `load` memory-maps:
+
+        meta.json           version, parameters and corpus statistics
+        vocab.npy           utf8 terms concatenated in sorted byte order
+        vocab_offsets.npy   term `t` is vocab[offsets[t]:offsets[t+1]]
+        indptr.npy, indices.npy, tf.npy, weights.npy
+                            term-major CSR postings
+        idf.npy, doc_len.npy
+        hashes.npy          chunk hash of each document
+
+    Chunk bodies live in a chunk store with `add` and `get_many` (e.g.
+    `ChunkSQL`), or in `chunks.jsonl` + `chunk_offsets.npy` if no store is
+    given.
+    """
 
     def __init__(self, k1=1.5, b=0.75, epsilon=0.25):
         # BM25Okapi parameters
@@ -25,121 +62,440 @@ class BM25Okapi:
         self.b = b
         self.epsilon = epsilon
 
-        # dump to pickle
+        # option
+        self.tokenizer = jieba.analyse.extract_tags
+        self.chunk_store = None
+        self.filedir = None
+        self._reset()
+
+    def _reset(self):
         self.corpus_size = 0
         self.avgdl = 0
-        self.doc_freqs = []
-        self.idf = {}
-        self.doc_len = []
         self.average_idf = 0.0
-        self.chunks = []
 
-        # option
-        self.tokenizer = jieba.analyse.extract_tags
+        # sorted base vocabulary on disk, new terms in `delta_vocab`
+        self.vocab_blob = np.zeros(0, dtype=np.uint8)
+        self.vocab_offsets = np.zeros(1, dtype=np.int64)
+        self.delta_vocab = dict()
 
-    def _init(self, corpus):
-        nd = {}  # word -> number of documents with word
-        num_doc = 0
-        for document in corpus:
-            self.doc_len.append(len(document))
-            num_doc += len(document)
+        # term-major CSR
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.tf = np.zeros(0, dtype=np.float32)
+        self.weights = np.zeros(0, dtype=np.float32)
+        self.idf = np.zeros(0, dtype=np.float32)
 
-            frequencies = {}
-            for word in document:
-                if word not in frequencies:
-                    frequencies[word] = 0
-                frequencies[word] += 1
-            self.doc_freqs.append(frequencies)
+        # per document, including tombstoned ones until `flush`
+        self.doc_len = np.zeros(0, dtype=np.int32)
+        self.hashes = np.zeros(0, dtype='S1')
+        self.deleted = np.zeros(0, dtype=bool)
+        self._hash_order = None
 
-            for word, freq in frequencies.items():
-                try:
-                    nd[word] += 1
-                except KeyError:
-                    nd[word] = 1
+        # postings appended since last refresh
+        self.delta_rows = []
+        self.delta_cols = []
+        self.delta_tf = []
+        self.dirty = False
+
+        # chunk bodies without chunk store, flushed or pending
+        self.flushed_docs = 0
+        self.chunk_offsets = None
+        self.pending_chunks = []
 
-            self.corpus_size += 1
+    @property
+    def num_terms(self) -> int:
+        return len(self.vocab_offsets) - 1 + len(self.delta_vocab)
 
-        self.avgdl = num_doc / self.corpus_size
-        return nd
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_len)
 
-    def _tokenize_corpus(self, corpus):
-        tokenized_corpus = self.tokenizer(corpus)
-        return tokenized_corpus
+    def _tokenize(self, content: str) -> List[str]:
+        if self.tokenizer is not None:
+            # input str, output list of str
+            corpus = self.tokenizer(content)
+            if content not in corpus:
+                corpus.append(content)
+        else:
+            logger.warning('No tokenizer, use naive split')
+            corpus = content.split(' ')
+        return corpus
 
-    def save(self, chunks: List[Chunk], filedir: str):
-        # generate idf with corpus
-        self.chunks = chunks
+    def save(self, chunks: List[Chunk], filedir: str, chunk_store=None):
+        """Build index of `chunks` from scratch into `filedir`."""
+        self._reset()
+        self.chunk_store = chunk_store
+        self.append(chunks)
+        self.flush(filedir)
 
-        filtered_corpus = []
-        for c in chunks:
-            content = c.content_or_path
-            if self.tokenizer is not None:
-                # input str, output list of str
-                corpus = self.tokenizer(content)
-                if content not in corpus:
-                    corpus.append(content)
-            else:
-                logger.warning('No tokenizer, use naive split')
-                corpus = content.split(' ')
-            filtered_corpus.append(corpus)
+    def append(self, chunks: List[Chunk]) -> int:
+        """Add a batch of chunks, skip hashes already indexed. Returns the
+        number of new documents."""
+        doc_ids = self.lookup([c._hash for c in chunks])
+        new_chunks = []
+        batch_hashes = set()
+        for c, doc_id in zip(chunks, doc_ids):
+            if doc_id < 0 and c._hash not in batch_hashes:
+                batch_hashes.add(c._hash)
+                new_chunks.append(c)
+        if not new_chunks:
+            return 0
+
+        rows = []
+        cols = []
+        tfs = []
+        doc_len = []
+        base_terms = len(self.vocab_offsets) - 1
+        for i, c in enumerate(new_chunks):
+            words = self._tokenize(c.content_or_path)
+            doc_len.append(len(words))
+            for word, freq in Counter(words).items():
+                term_id = self._term_id(word)
+                if term_id is None:
+                    term_id = base_terms + len(self.delta_vocab)
+                    self.delta_vocab[word] = term_id
+                rows.append(term_id)
+                cols.append(self.num_docs + i)
+                tfs.append(freq)
+
+        self.delta_rows.append(np.array(rows, dtype=np.int64))
+        self.delta_cols.append(np.array(cols, dtype=np.int32))
+        self.delta_tf.append(np.array(tfs, dtype=np.float32))
+        self.doc_len = np.concatenate(
+            [self.doc_len, np.array(doc_len, dtype=np.int32)])
+        self.hashes = np.concatenate(
+            [self.hashes,
+             np.array([c._hash for c in new_chunks], dtype='S')])
+        self.deleted = np.concatenate(
+            [self.deleted, np.zeros(len(new_chunks), dtype=bool)])
+        self._hash_order = None
+        self.dirty = True
+
+        if self.chunk_store is not None:
+            self.chunk_store.add(new_chunks)
+        else:
+            self.pending_chunks += new_chunks
+        return len(new_chunks)
+
+    def lookup(self, hashes: List[str]) -> np.ndarray:
+        """Doc id of each chunk hash, -1 if not indexed or tombstoned."""
+        if len(hashes) < 1 or self.num_docs < 1:
+            return np.full(len(hashes), -1, dtype=np.int64)
+        if self._hash_order is None:
+            # live document first among equal hashes
+            self._hash_order = np.lexsort((self.deleted, self.hashes))
+        sorted_hashes = self.hashes[self._hash_order]
+        keys = np.array(hashes, dtype='S')
+        pos = np.searchsorted(sorted_hashes, keys)
+        pos = np.minimum(pos, len(sorted_hashes) - 1)
+        doc_ids = self._hash_order[pos].astype(np.int64)
+        found = (sorted_hashes[pos] == keys) & ~self.deleted[doc_ids]
+        doc_ids[~found] = -1
+        return doc_ids
+
+    def delete(self, hashes: List[str]) -> int:
+        """Tombstone chunk hashes, returns the number of deleted documents."""
+        doc_ids = self.lookup(hashes)
+        doc_ids = doc_ids[doc_ids >= 0]
+        if len(doc_ids) > 0:
+            self.deleted[doc_ids] = True
+            self._hash_order = None
+            self.dirty = True
+        return len(doc_ids)
+
+    def _refresh(self):
+        """Merge appended postings, drop tombstoned ones and recompute IDF,
+        avgdl and weights."""
+        if not self.dirty:
+            return
+        rows = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64),
+                         np.diff(self.indptr))
+        rows = np.concatenate([rows] + self.delta_rows)
+        cols = np.concatenate([np.asarray(self.indices, dtype=np.int32)] +
+                              self.delta_cols)
+        tf = np.concatenate([np.asarray(self.tf, dtype=np.float32)] +
+                            self.delta_tf)
+        live = ~self.deleted
+        keep = live[cols]
+        rows, cols, tf = rows[keep], cols[keep], tf[keep]
+
+        self.corpus_size = int(live.sum())
+        self.avgdl = float(self.doc_len[live].sum()) / max(1, self.corpus_size)
+        df = np.bincount(rows, minlength=self.num_terms)
+        idf, self.average_idf = self._calc_idf(df, self.corpus_size)
+        weights = self._calc_weights(idf=idf,
+                                     rows=rows,
+                                     cols=cols,
+                                     tf=tf,
+                                     doc_len=self.doc_len,
+                                     avgdl=self.avgdl)
+
+        # stable sort keeps doc ids ascending inside each row
+        order = np.argsort(rows, kind='stable')
+        self.indptr = np.zeros(self.num_terms + 1, dtype=np.int64)
+        np.cumsum(df, out=self.indptr[1:])
+        self.indices = cols[order]
+        self.tf = tf[order]
+        self.weights = weights[order]
+        self.idf = idf.astype(np.float32)
+
+        self.delta_rows = []
+        self.delta_cols = []
+        self.delta_tf = []
+        self.dirty = False
+
+    def _merged_vocab(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Insert `delta_vocab` into the sorted base vocabulary, return new
+        blob, offsets and old-to-new term id mapping."""
+        base_terms = len(self.vocab_offsets) - 1
+        delta = sorted((word.encode('utf8'), term_id)
+                       for word, term_id in self.delta_vocab.items())
+        # insert position of each new term among base terms
+        positions = np.array([self._term_position(word) for word, _ in delta],
+                             dtype=np.int64)
+        mapping = np.zeros(self.num_terms, dtype=np.int64)
+        mapping[:base_terms] = np.arange(base_terms) + np.searchsorted(
+            positions, np.arange(base_terms), side='right')
+        for rank, (_, term_id) in enumerate(delta):
+            mapping[term_id] = positions[rank] + rank
 
-        nd = self._init(filtered_corpus)
-        self._calc_idf(nd)
+        pieces = []
+        lengths = np.zeros(self.num_terms, dtype=np.int64)
+        base_lengths = np.diff(np.asarray(self.vocab_offsets))
+        lengths[mapping[:base_terms]] = base_lengths
+        start = 0
+        for rank, (word, term_id) in enumerate(delta):
+            end = int(self.vocab_offsets[positions[rank]])
+            pieces.append(self.vocab_blob[start:end].tobytes())
+            pieces.append(word)
+            lengths[mapping[term_id]] = len(word)
+            start = end
+        pieces.append(self.vocab_blob[start:].tobytes())
 
-        # dump to `filepath`
-        data = {
+        offsets = np.zeros(self.num_terms + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        blob = np.frombuffer(b''.join(pieces), dtype=np.uint8)
+        return blob, offsets, mapping
+
+    def flush(self, filedir: str = None):
+        """Compact tombstones, write columnar files and memory-map them."""
+        filedir = filedir or self.filedir
+        os.makedirs(filedir, exist_ok=True)
+        self._refresh()
+
+        live = ~self.deleted
+        new_doc_id = np.cumsum(live) - 1
+        blob, vocab_offsets, mapping = self._merged_vocab()
+        rows = mapping[np.repeat(np.arange(len(self.indptr) - 1),
+                                 np.diff(self.indptr))]
+        order = np.argsort(rows, kind='stable')
+        df = np.bincount(rows, minlength=self.num_terms)
+        indptr = np.zeros(self.num_terms + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+        idf = np.zeros(self.num_terms, dtype=np.float32)
+        idf[mapping] = self.idf
+
+        if self.chunk_store is None:
+            self._write_jsonl(filedir=filedir, live=live)
+
+        _save_array(filedir, 'vocab.npy', blob)
+        _save_array(filedir, 'vocab_offsets.npy', vocab_offsets)
+        _save_array(filedir, 'indptr.npy', indptr)
+        _save_array(filedir, 'indices.npy',
+                    new_doc_id[self.indices][order].astype(np.int32))
+        _save_array(filedir, 'tf.npy', np.asarray(self.tf)[order])
+        _save_array(filedir, 'weights.npy', np.asarray(self.weights)[order])
+        _save_array(filedir, 'idf.npy', idf)
+        _save_array(filedir, 'doc_len.npy', self.doc_len[live])
+        _save_array(filedir, 'hashes.npy', self.hashes[live])
+
+        # meta last, a directory without it is incomplete
+        meta = {
+            'version': FORMAT_VERSION,
+            'k1': self.k1,
+            'b': self.b,
+            'epsilon': self.epsilon,
             'corpus_size': self.corpus_size,
             'avgdl': self.avgdl,
-            'doc_freqs': self.doc_freqs,
-            'idf': self.idf,
-            'doc_len': self.doc_len,
             'average_idf': self.average_idf,
-            'chunks': chunks
+            'num_terms': self.num_terms
         }
-        logger.info('bm250kpi dump..')
-        # logger.info(data)
-
-        os.makedirs(filedir, exist_ok=True)
+        meta_path = os.path.join(filedir, 'meta.json')
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(meta_path + '.tmp', meta_path)
+        logger.info(
+            f'bm25 flush {self.corpus_size} documents {self.num_terms} terms')
+        self.load(filedir,
+                  tokenizer=self.tokenizer,
+                  chunk_store=self.chunk_store)
 
-        filepath = os.path.join(filedir, 'bm25.pkl')
-        with open(filepath, 'wb') as f:
-            pkl.dump(data, f)
+    def _write_jsonl(self, filedir: str, live: np.ndarray):
+        """Copy live flushed lines, then add pending chunks."""
+        src_path = os.path.join(self.filedir or filedir, 'chunks.jsonl')
+        dst_path = os.path.join(filedir, 'chunks.jsonl.tmp')
+        offsets = [0]
+        with open(dst_path, 'wb') as dst:
+            if self.flushed_docs > 0:
+                with open(src_path, 'rb') as src:
+                    for doc_id in np.where(live[:self.flushed_docs])[0]:
+                        src.seek(self.chunk_offsets[doc_id])
+                        line = src.read(self.chunk_offsets[doc_id + 1] -
+                                        self.chunk_offsets[doc_id])
+                        dst.write(line)
+                        offsets.append(offsets[-1] + len(line))
+            for doc_id, c in enumerate(self.pending_chunks,
+                                       start=self.flushed_docs):
+                if not live[doc_id]:
+                    continue
+                line = json.dumps(
+                    {
+                        '_hash': c._hash,
+                        'content_or_path': c.content_or_path,
+                        'metadata': c.metadata,
+                        'modal': c.modal
+                    },
+                    ensure_ascii=False).encode('utf8') + b'\n'
+                dst.write(line)
+                offsets.append(offsets[-1] + len(line))
+        os.replace(dst_path, os.path.join(filedir, 'chunks.jsonl'))
+        _save_array(filedir, 'chunk_offsets.npy',
+                    np.array(offsets, dtype=np.int64))
 
-    def load(self, filedir: str, tokenizer=None):
+    def load(self, filedir: str, tokenizer=None, chunk_store=None):
+        """Memory-map index in `filedir`, fall back to legacy `bm25.pkl`."""
+        self._reset()
         self.tokenizer = tokenizer
+        self.chunk_store = chunk_store
+        self.filedir = filedir
+        meta_path = os.path.join(filedir, 'meta.json')
+        if not os.path.exists(meta_path):
+            self._load_legacy(filedir)
+            return
+
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta['version'] != FORMAT_VERSION:
+            raise ValueError(
+                f'unsupported bm25 format {meta["version"]}, rebuild it')
+        self.k1 = meta['k1']
+        self.b = meta['b']
+        self.epsilon = meta['epsilon']
+        self.corpus_size = meta['corpus_size']
+        self.avgdl = meta['avgdl']
+        self.average_idf = meta['average_idf']
+
+        def mmap(name: str):
+            return np.load(os.path.join(filedir, name), mmap_mode='r')
+
+        self.vocab_blob = mmap('vocab.npy')
+        self.vocab_offsets = mmap('vocab_offsets.npy')
+        self.indptr = mmap('indptr.npy')
+        self.indices = mmap('indices.npy')
+        self.tf = mmap('tf.npy')
+        self.weights = mmap('weights.npy')
+        self.idf = mmap('idf.npy')
+        self.doc_len = mmap('doc_len.npy')
+        self.hashes = mmap('hashes.npy')
+        self.deleted = np.zeros(len(self.doc_len), dtype=bool)
+        self.flushed_docs = len(self.doc_len)
+        if chunk_store is None and os.path.exists(
+                os.path.join(filedir, 'chunk_offsets.npy')):
+            self.chunk_offsets = mmap('chunk_offsets.npy')
+
+    def _load_legacy(self, filedir: str):
+        """Load pickle written by old versions as pending documents, `flush`
+        converts it to the columnar format."""
         filepath = os.path.join(filedir, 'bm25.pkl')
+        logger.warning(f'{filepath} is legacy format, flush it for mmap')
         with open(filepath, 'rb') as f:
             data = pkl.load(f)
-        self.corpus_size = data['corpus_size']
-        self.avgdl = data['avgdl']
-        self.doc_freqs = data['doc_freqs']
-        self.idf = data['idf']
-        self.doc_len = data['doc_len']
-        self.average_idf = data['average_idf']
-        self.chunks = data['chunks']
-
-    def _calc_idf(self, nd):
+
+        self.delta_vocab = {
+            word: i
+            for i, word in enumerate(data['idf'].keys())
+        }
+        rows = []
+        cols = []
+        tfs = []
+        for doc_id, frequencies in enumerate(data['doc_freqs']):
+            for word, freq in frequencies.items():
+                rows.append(self.delta_vocab[word])
+                cols.append(doc_id)
+                tfs.append(freq)
+        self.delta_rows = [np.array(rows, dtype=np.int64)]
+        self.delta_cols = [np.array(cols, dtype=np.int32)]
+        self.delta_tf = [np.array(tfs, dtype=np.float32)]
+        self.doc_len = np.array(data['doc_len'], dtype=np.int32)
+        self.hashes = np.array([c._hash for c in data['chunks']], dtype='S')
+        self.deleted = np.zeros(len(self.doc_len), dtype=bool)
+        # chunk bodies come from the pickle
+        self.chunk_store = None
+        self.pending_chunks = data['chunks']
+        self.dirty = True
+        self._refresh()
+
+    def _calc_idf(self, df: np.ndarray,
+                  corpus_size: int) -> Tuple[np.ndarray, float]:
         """
-        Calculates frequencies of terms in documents and in corpus.
+        Calculates idf of terms with document frequency `df`.
         This algorithm sets a floor on the idf values to eps * average_idf
         """
-        # collect idf sum to calculate an average idf for epsilon value
-        idf_sum = 0
-        # collect words with negative idf to set them a special epsilon value.
+        df = df.astype(np.float64)
+        idf = np.log(corpus_size - df + 0.5) - np.log(df + 0.5)
+        # terms only in tombstoned documents do not count
+        present = df > 0
+        average_idf = float(idf[present].mean()) if present.any() else 0.0
         # idf can be negative if word is contained in more than half of documents
-        negative_idfs = []
-        for word, freq in nd.items():
-            idf = math.log(self.corpus_size - freq + 0.5) - math.log(freq +
-                                                                     0.5)
-            self.idf[word] = idf
-            idf_sum += idf
-            if idf < 0:
-                negative_idfs.append(word)
-        self.average_idf = idf_sum / len(self.idf)
-
-        eps = self.epsilon * self.average_idf
-        for word in negative_idfs:
-            self.idf[word] = eps
+        idf[idf < 0] = self.epsilon * average_idf
+        return idf, average_idf
+
+    def _calc_weights(self, idf: np.ndarray, rows: np.ndarray,
+                      cols: np.ndarray, tf: np.ndarray, doc_len: np.ndarray,
+                      avgdl: float) -> np.ndarray:
+        norm = self.k1 * (1 - self.b + self.b * np.asarray(
+            doc_len, dtype=np.float32) / max(avgdl, 1e-6))
+        weights = idf[rows] * (tf * (self.k1 + 1) / (tf + norm[cols]))
+        return weights.astype(np.float32)
+
+    def _base_word(self, term_id: int) -> bytes:
+        return self.vocab_blob[self.vocab_offsets[term_id]:self.
+                               vocab_offsets[term_id + 1]].tobytes()
+
+    def _term_position(self, key: bytes) -> int:
+        """Binary search in sorted base vocabulary, leftmost position."""
+        lo, hi = 0, len(self.vocab_offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._base_word(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _term_id(self, term: str) -> Union[int, None]:
+        key = term.encode('utf8')
+        pos = self._term_position(key)
+        if pos < len(self.vocab_offsets) - 1 and self._base_word(pos) == key:
+            return pos
+        return self.delta_vocab.get(term)
+
+    def _postings(self, query: List) -> Tuple[np.ndarray, np.ndarray]:
+        """Concatenated (doc ids, weights) of query terms, repeated terms
+        count repeatedly."""
+        self._refresh()
+        doc_ids = []
+        weights = []
+        for q, count in Counter(query).items():
+            term_id = self._term_id(q)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            doc_ids.append(self.indices[start:end])
+            weights.append(self.weights[start:end] * count)
+        if not doc_ids:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        return np.concatenate(doc_ids), np.concatenate(weights)
 
     def get_scores(self, query: List):
         """
@@ -151,31 +507,51 @@ class BM25Okapi:
         """
         if type(query) is not list:
             raise ValueError('query must be list, tokenize it byself.')
-        score = np.zeros(self.corpus_size)
-        doc_len = np.array(self.doc_len)
-        for q in query:
-            q_freq = np.array([(doc.get(q) or 0) for doc in self.doc_freqs])
-            score += (self.idf.get(q)
-                      or 0) * (q_freq * (self.k1 + 1) /
-                               (q_freq + self.k1 *
-                                (1 - self.b + self.b * doc_len / self.avgdl)))
-        return score
+        doc_ids, weights = self._postings(query)
+        # sparse row-sum of the query terms
+        return np.bincount(doc_ids, weights=weights, minlength=self.num_docs)
 
     def get_batch_scores(self, query, doc_ids):
         """
         Calculate bm25 scores between query and subset of all docs
         """
-        assert all(di < len(self.doc_freqs) for di in doc_ids)
-        score = np.zeros(len(doc_ids))
-        doc_len = np.array(self.doc_len)[doc_ids]
-        for q in query:
-            q_freq = np.array([(self.doc_freqs[di].get(q) or 0)
-                               for di in doc_ids])
-            score += (self.idf.get(q)
-                      or 0) * (q_freq * (self.k1 + 1) /
-                               (q_freq + self.k1 *
-                                (1 - self.b + self.b * doc_len / self.avgdl)))
-        return score.tolist()
+        assert all(di < self.num_docs for di in doc_ids)
+        scores = self.get_scores(query)
+        return scores[np.array(doc_ids, dtype=np.int64)].tolist()
+
+    def top_k(self, query: List, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top `k` (doc ids, scores) in descending order, only documents
+        sharing a term with the query are scored."""
+        doc_ids, weights = self._postings(query)
+        if len(doc_ids) < 1:
+            return doc_ids, weights
+        candidates, inverse = np.unique(doc_ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+        if len(scores) > k:
+            part = np.argpartition(-scores, k - 1)[:k]
+        else:
+            part = np.arange(len(scores))
+        part = part[np.argsort(-scores[part], kind='stable')]
+        return candidates[part], scores[part]
+
+    def get_chunks(self, doc_ids: List[int]) -> List[Chunk]:
+        """Fetch chunk bodies of documents on demand."""
+        if self.chunk_store is not None:
+            hashes = [self.hashes[i].decode('utf8') for i in doc_ids]
+            chunks = self.chunk_store.get_many(hashes)
+            return [c for c in chunks if c is not None]
+
+        chunks = []
+        for i in doc_ids:
+            if i >= self.flushed_docs:
+                chunks.append(self.pending_chunks[i - self.flushed_docs])
+                continue
+            with open(os.path.join(self.filedir, 'chunks.jsonl'), 'rb') as f:
+                f.seek(self.chunk_offsets[i])
+                line = f.read(self.chunk_offsets[i + 1] -
+                              self.chunk_offsets[i])
+            chunks.append(Chunk(**json.loads(line)))
+        return chunks
 
     def get_top_n(self, query: Union[List, str], n=5):
         if type(query) is str:
@@ -186,10 +562,9 @@ class BM25Okapi:
         else:
             queries = query
 
-        scores = self.get_scores(queries)
-        top_n = np.argsort(scores)[::-1][:n]
-        logger.info('{} {}'.format(scores, top_n))
-        if abs(scores[top_n[0]]) < 1e-5:
+        doc_ids, scores = self.top_k(queries, k=n)
+        logger.info('{} {}'.format(scores, doc_ids))
+        if len(doc_ids) < 1 or abs(scores[0]) < 1e-5:
             # not match, quit
             return []
-        return [self.chunks[i] for i in top_n]
+        return self.get_chunks(doc_ids.tolist())
@@ -0,0 +1,141 @@
+"""LLM response cache."""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Union
+
+from loguru import logger
+
+
+class LLMCache:
+    """Two-tier LLM response cache.
+
+    The key is a full sha256 digest of the whole request (messages, model and
+    sampling params), so different system prompts, histories or `max_tokens`
+    never share an answer.
+
+    Tier 1 is an in-process LRU, tier 2 is a sqlite table on a persistent
+    WAL-mode connection. Rows expire after `ttl` seconds and the oldest rows
+    are dropped once the table exceeds `max_disk_items`.
+    """
+
+    def __init__(self,
+                 file_path: str = '.cache_llm_v2',
+                 max_memory_items: int = 4096,
+                 max_disk_items: int = 200000,
+                 ttl: float = 7 * 24 * 3600,
+                 evict_interval: int = 256):
+        self.file_path = file_path
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.ttl = ttl
+        self.evict_interval = evict_interval
+
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.file_path,
+                                    check_same_thread=False,
+                                    isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS chat (
+                _hash TEXT PRIMARY KEY,
+                response TEXT,
+                backend TEXT,
+                created REAL
+            )
+        ''')
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS chat_created ON chat (created)')
+
+        # counters
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.adds = 0
+        self.get_seconds = 0.0
+
+    @staticmethod
+    def key(**request) -> str:
+        """Digest of a full chat request."""
+        content = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(content.encode('utf8')).hexdigest()
+
+    def _remember(self, _hash: str, response: str, created: float):
+        self.memory[_hash] = (response, created)
+        self.memory.move_to_end(_hash)
+        while len(self.memory) > self.max_memory_items:
+            self.memory.popitem(last=False)
+
+    def get(self, _hash: str) -> Union[str, None]:
+        """Get response by request digest, None if miss or expired."""
+        start = time.perf_counter()
+        try:
+            with self.lock:
+                now = time.time()
+                if _hash in self.memory:
+                    response, created = self.memory[_hash]
+                    if now - created <= self.ttl:
+                        self.memory.move_to_end(_hash)
+                        self.memory_hits += 1
+                        return response
+                    self.memory.pop(_hash)
+
+                r = self.conn.execute(
+                    'SELECT response, created FROM chat WHERE _hash = ?',
+                    (_hash, )).fetchone()
+                if r and now - r[1] <= self.ttl:
+                    self._remember(_hash, r[0], r[1])
+                    self.disk_hits += 1
+                    return r[0]
+                self.misses += 1
+                return None
+        finally:
+            self.get_seconds += time.perf_counter() - start
+
+    def add(self, _hash: str, response: str, backend: str):
+        if response is None:
+            return
+        with self.lock:
+            now = time.time()
+            self._remember(_hash, response, now)
+            self.conn.execute(
+                'INSERT OR REPLACE INTO chat (_hash, response, backend, created) VALUES (?, ?, ?, ?)',
+                (_hash, response, backend, now))
+            self.adds += 1
+            if self.adds % self.evict_interval == 0:
+                self._evict()
+
+    def _evict(self):
+        """Drop expired rows, then the oldest ones beyond `max_disk_items`."""
+        try:
+            self.conn.execute('DELETE FROM chat WHERE created < ?',
+                              (time.time() - self.ttl, ))
+            count = self.conn.execute('SELECT count(*) FROM chat').fetchone()[0]
+            overflow = count - self.max_disk_items
+            if overflow > 0:
+                self.conn.execute(
+                    'DELETE FROM chat WHERE _hash IN (SELECT _hash FROM chat ORDER BY created LIMIT ?)',
+                    (overflow, ))
+        except sqlite3.Error as e:
+            logger.warning(f'LLMCache evict failed {e}')
+
+    def stats(self) -> Dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': hits / max(1, lookups),
+            'avg_get_ms': 1000 * self.get_seconds / max(1, lookups),
+            'memory_items': len(self.memory)
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
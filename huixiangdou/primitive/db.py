@@ -1,4 +1,28 @@
 import sqlite3
+from typing import List
+
+# keep below SQLITE_MAX_VARIABLE_NUMBER of old sqlite builds
+BATCH_SIZE = 500
+
+
+def select_in(conn: sqlite3.Connection,
+              sql: str,
+              values: List,
+              params: List = []) -> List[tuple]:
+    """Rows of `sql` for distinct `values`, one query per `BATCH_SIZE`.
+
+    `{}` in `sql` is replaced by the `IN (...)` placeholders, `params` bind
+    before the values.
+    """
+    rows = []
+    unique = list(set(values))
+    for i in range(0, len(unique), BATCH_SIZE):
+        batch = unique[i:i + BATCH_SIZE]
+        placeholders = ','.join('?' * len(batch))
+        rows += conn.execute(sql.format(placeholders),
+                             list(params) + batch).fetchall()
+    return rows
+
 
 class DB:
     def __init__(self, filename):
@@ -1,20 +1,33 @@
 #
+import asyncio
+import hashlib
 import os
 import pdb
 import requests
 import json
+import threading
+from collections import OrderedDict
 
-from typing import Any, List
+from typing import Any, List, Optional, Union
 
 import numpy as np
 from loguru import logger
 from .query import DistanceStrategy
 from .limitter import RPM, TPM
 from .chunk import Chunk
+from .inference import InferencePool, HTTPSessionPool
+from .embedding_store import EmbeddingStore
 
 
 class Embedder:
-    """Wrap text2vec (multimodal) model."""
+    """Wrap text2vec (multimodal) model.
+
+    Query embeddings are kept in a content-hash LRU. `aembed_query` coalesces
+    text queries arriving within `embedding_batch_window` seconds into one
+    forward pass, `distance_many` embeds a keyword and all candidates at once.
+    `a*` methods run local models in a dedicated thread pool and call the
+    remote API with a keep-alive aiohttp session, sync methods stay as is.
+    """
     client: Any
     _type: str
 
@@ -25,6 +38,25 @@ class Embedder:
 
         model_path = model_config['embedding_model_path']
         self._type = self.model_type(model_path=model_path)
+        self.model_id = '{}@{}'.format(self._type, model_path)
+
+        self.max_cache_items = int(
+            model_config.get('embedding_cache_size', 4096))
+        self.batch_window = float(
+            model_config.get('embedding_batch_window', 0.005))
+        self.max_batch_size = int(model_config.get('embedding_batch_size', 32))
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.pending = []
+        self.flush_handle = None
+        # forward passes run here, `a*` methods await them off the event loop
+        self.pool = InferencePool(
+            max_workers=int(model_config.get('inference_workers', 1)),
+            max_queue=int(model_config.get('inference_queue', 64)),
+            name='embedder')
+        self.http = HTTPSessionPool()
+        # persistent chunk embeddings, see `use_store`
+        self.store = None
         if 'bce' in self._type:
             from sentence_transformers import SentenceTransformer
             self.client = SentenceTransformer(
@@ -91,16 +123,188 @@ class Embedder:
             return len(text) // 2
 
     def distance(self, text1: str, text2: str) -> float:
-        emb1 = self.embed_query(text=text1)
-        emb2 = self.embed_query(text=text2)
+        return self.distance_many(text1, [text2])[0]
+
+    def distance_many(self, query: str, texts: List[str]) -> np.ndarray:
+        """Distance between `query` and each of `texts`, shape (len(texts),)"""
+        if not texts:
+            return np.zeros(0, dtype=np.float32)
+        embs = self.embed_texts([query] + list(texts))
 
         if self.distance_strategy == DistanceStrategy.EUCLIDEAN_DISTANCE:
-            distance = np.linalg.norm(emb1 - emb2)
-            return distance
+            return np.linalg.norm(embs[1:] - embs[0:1], axis=1)
         raise ValueError('Unsupported distance strategy')
 
+    def _cache_key(self, text: str = None, path: str = None) -> str:
+        h = hashlib.blake2b(digest_size=16)
+        for part in (self.model_id, text, path):
+            h.update(b'\x00' if part is None else b'\x01' + str(part).encode('utf8'))
+        return h.hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[np.ndarray]:
+        with self.cache_lock:
+            emb = self.cache.get(key)
+            if emb is not None:
+                self.cache.move_to_end(key)
+            return emb
+
+    def _cache_put(self, key: str, emb: np.ndarray):
+        if self.max_cache_items < 1:
+            return
+        emb = emb.reshape(-1).astype(np.float32)
+        emb.setflags(write=False)
+        with self.cache_lock:
+            self.cache[key] = emb
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_cache_items:
+                self.cache.popitem(last=False)
+
     def embed_query(self, text: str = None, path: str = None) -> np.ndarray:
         """Embed input text or image as feature, output np.ndarray with np.float32"""
+        key = self._cache_key(text=text, path=path)
+        emb = self._cache_get(key)
+        if emb is None:
+            emb = self._embed_query(text=text, path=path)
+            self._cache_put(key, emb)
+            return emb.reshape(1, -1).astype(np.float32)
+        return emb.reshape(1, -1).copy()
+
+    def _lookup(self, texts: List[str]):
+        keys = [self._cache_key(text=text) for text in texts]
+        embs = [self._cache_get(key) for key in keys]
+        missing = dict()
+        for index, emb in enumerate(embs):
+            if emb is None:
+                missing.setdefault(texts[index], []).append(index)
+        return keys, embs, missing
+
+    def _fill(self, keys: List[str], embs: List, missing: dict,
+              features: np.ndarray) -> np.ndarray:
+        for feature, indexes in zip(features, missing.values()):
+            self._cache_put(keys[indexes[0]], feature)
+            for index in indexes:
+                embs[index] = feature
+        return np.stack(embs).astype(np.float32)
+
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        """Embed texts with cache, missing ones in one batch. Output shape (len(texts), dim)"""
+        keys, embs, missing = self._lookup(texts)
+        features = []
+        if missing:
+            features = self.embed_query_batch_text(
+                chunks=[Chunk(content_or_path=text) for text in missing])
+        return self._fill(keys, embs, missing, features)
+
+    async def aembed_texts(self, texts: List[str]) -> np.ndarray:
+        """Async `embed_texts`, never blocks the event loop."""
+        keys, embs, missing = self._lookup(texts)
+        features = []
+        if missing and 'siliconcloud' in self._type:
+            features = await self._aembed_remote(list(missing))
+        elif missing:
+            features = await self.pool.run(
+                self.embed_query_batch_text,
+                chunks=[Chunk(content_or_path=text) for text in missing])
+        return self._fill(keys, embs, missing, features)
+
+    async def adistance_many(self, query: str,
+                             texts: List[str]) -> np.ndarray:
+        """Async `distance_many`."""
+        if not texts:
+            return np.zeros(0, dtype=np.float32)
+        embs = await self.aembed_texts([query] + list(texts))
+        return np.linalg.norm(embs[1:] - embs[0:1], axis=1)
+
+    async def aembed_query(self,
+                           text: str = None,
+                           path: str = None) -> np.ndarray:
+        """Async `embed_query`, concurrent text queries share one forward pass."""
+        key = self._cache_key(text=text, path=path)
+        emb = self._cache_get(key)
+        if emb is not None:
+            return emb.reshape(1, -1).copy()
+
+        if path is not None or text is None:
+            return await self.pool.run(self.embed_query, text, path)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((text, future))
+        if len(self.pending) >= self.max_batch_size:
+            self._flush_pending()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.batch_window,
+                                                self._flush_pending)
+        return await future
+
+    def _flush_pending(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+
+        texts = [text for text, _ in batch]
+        task = asyncio.ensure_future(self.aembed_texts(texts))
+
+        def resolve(task):
+            try:
+                embs = task.result()
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            for (_, future), emb in zip(batch, embs):
+                if not future.done():
+                    future.set_result(emb.reshape(1, -1))
+
+        task.add_done_callback(resolve)
+
+    def _remote_request(self, text: Union[str, List[str]]):
+        url = "https://api.siliconflow.cn/v1/embeddings"
+
+        payload = {
+            "model": "netease-youdao/bce-embedding-base_v1",
+            # Since siliconcloud API return 50400 for long input, we have to truncate it.
+            "input": text,
+            "encoding_format": "float"
+        }
+        headers = {
+            "accept": "application/json",
+            "content-type": "application/json",
+            "authorization": self.client['api_token']
+        }
+        return url, payload, headers
+
+    @staticmethod
+    def _parse_remote(json_obj: dict) -> np.ndarray:
+        data = sorted(json_obj['data'], key=lambda item: item['index'])
+        emb_list = [item['embedding'] for item in data]
+        return np.array(emb_list).astype(np.float32).reshape(len(data), -1)
+
+    async def _aembed_remote(self, texts: List[str]) -> np.ndarray:
+        """Embed texts with multi-input requests sent concurrently."""
+
+        async def post(batch: List[str]):
+            await self.client['api_rpm'].wait(silent=True)
+            await self.client['api_tpm'].wait(
+                silent=True, token_count=sum(len(t) for t in batch))
+            url, payload, headers = self._remote_request(batch)
+            json_obj = await self.http.post_json(url, payload, headers)
+            return self._parse_remote(json_obj)
+
+        order = self._length_order(texts)
+        batches = [
+            order[i:i + self.max_batch_size]
+            for i in range(0, len(order), self.max_batch_size)
+        ]
+        results = await asyncio.gather(
+            *[post([texts[j] for j in batch]) for batch in batches])
+        return self._restore(len(texts), batches, results)
+
+    def _embed_query(self, text: str = None, path: str = None) -> np.ndarray:
         if 'bge' in self._type:
             import torch
             with torch.no_grad():
@@ -117,58 +321,135 @@ class Embedder:
             #     assert abs(norm - 1) < 0.001
             return emb
         else:
-            self.client['api_rpm'].wait(silent=True)
-            self.client['api_tpm'].wait(silent=True, token_count=len(text))
+            self.client['api_rpm'].wait_sync(silent=True)
+            self.client['api_tpm'].wait_sync(silent=True, token_count=len(text))
 
             # siliconcloud bce API
             if text is None:
                 raise ValueError('This api only support text')
 
-            url = "https://api.siliconflow.cn/v1/embeddings"
+            url, payload, headers = self._remote_request(text)
+            response = requests.post(url, json=payload, headers=headers)
+            return self._parse_remote(json.loads(response.text))
 
-            payload = {
-                "model": "netease-youdao/bce-embedding-base_v1",
-                # Since siliconcloud API return 50400 for long input, we have to truncate it.
-                "input": text,
-                "encoding_format": "float"
-            }
-            headers = {
-                "accept": "application/json",
-                "content-type": "application/json",
-                "authorization": self.client['api_token']
-            }
+    def _length_order(self, texts: List[str]) -> List[int]:
+        """Indexes of `texts`, longest first, so each batch pads little."""
+        if 'siliconcloud' in self._type:
+            lengths = [len(t) for t in texts]
+        else:
+            lengths = [
+                len(ids) for ids in self.client.tokenizer(
+                    texts, padding=False, truncation=False)['input_ids']
+            ]
+        return sorted(range(len(texts)), key=lambda i: -lengths[i])
 
-            response = requests.post(url, json=payload, headers=headers)
-            json_obj = json.loads(response.text)
-            emb_list = json_obj['data'][0]['embedding']
-            emb = np.array(emb_list).astype(np.float32).reshape(1, -1)
-            return emb
+    @staticmethod
+    def _restore(size: int, batches: List[List[int]],
+                 results: List[np.ndarray]) -> np.ndarray:
+        """Put batched features back to input order."""
+        features = [None] * size
+        for batch, embs in zip(batches, results):
+            for index, emb in zip(batch, embs):
+                features[index] = emb
+        return np.stack(features).astype(np.float32)
 
-    def embed_query_batch_text(self, chunks: List[Chunk] = []) -> np.ndarray:
-        """Embed input text or image as feature, output np.ndarray with np.float32"""
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
         if 'bge' in self._type:
             import torch
             with torch.no_grad():
-                features = []
-                for c in chunks:
-                    feature = self.client.encode(text=c.content_or_path)
-                    features.append(feature.cpu().numpy())
-                return np.concatenate(features).reshape(len(chunks),
-                                                        -1).astype(np.float32)
+                # tokenizer pads the batch to its longest text
+                feature = self.client.encode(text=texts)
+                return feature.cpu().numpy().reshape(len(texts), -1)
 
-        elif 'bce' in self._type:
-            texts = []
-            for c in chunks:
-                texts.append(c.content_or_path)
+        self.client['api_rpm'].wait_sync(silent=True)
+        self.client['api_tpm'].wait_sync(silent=True,
+                                         token_count=sum(len(t) for t in texts))
+        url, payload, headers = self._remote_request(texts)
+        response = requests.post(url, json=payload, headers=headers)
+        return self._parse_remote(json.loads(response.text))
+
+    def use_store(self, file_dir: str):
+        """Keep chunk embeddings of this model under `file_dir`."""
+        self.store = EmbeddingStore(file_dir=file_dir, model_id=self.model_id)
+
+    def embed_chunks(self,
+                     chunks: List[Chunk],
+                     batch_size: int = None) -> List[Optional[np.ndarray]]:
+        """Embed chunks in input order, reusing stored embeddings.
+
+        Returns one float32 vector per chunk, None if the chunk failed.
+        """
+        features = [None] * len(chunks)
+        keys = [EmbeddingStore.content_hash(c) for c in chunks]
+        if self.store is not None:
+            features = self.store.get_many(keys)
+
+        texts = [
+            i for i, c in enumerate(chunks)
+            if features[i] is None and c.modal in ('text', 'fasta')
+        ]
+        others = [
+            i for i, c in enumerate(chunks)
+            if features[i] is None and c.modal not in ('text', 'fasta')
+        ]
+        if self.store is not None and len(chunks) > 0:
+            logger.info('embedding store hit {}/{}'.format(
+                len(chunks) - len(texts) - len(others), len(chunks)))
+
+        if texts:
+            try:
+                embs = self.embed_query_batch_text(
+                    chunks=[chunks[i] for i in texts], batch_size=batch_size)
+                for i, emb in zip(texts, embs):
+                    features[i] = emb
+            except Exception as e:
+                logger.error(f'batch embedding failed, try one by one {e}')
+                others = texts + others
+
+        for i in others:
+            c = chunks[i]
+            try:
+                if c.modal == 'image':
+                    emb = self.embed_query(path=c.content_or_path)
+                elif c.modal in ('text', 'fasta'):
+                    emb = self.embed_query(text=c.content_or_path)
+                else:
+                    raise ValueError(f'Unimplemented chunk type: {c.modal}')
+                features[i] = emb.reshape(-1)
+            except Exception as e:
+                logger.error(f'Error extracting feature: {e}')
+
+        if self.store is not None:
+            done = [i for i in texts + others if features[i] is not None]
+            if done:
+                self.store.put_many([keys[i] for i in done],
+                                    np.stack([features[i] for i in done]))
+        return features
+
+    def embed_query_batch_text(self,
+                               chunks: List[Chunk] = [],
+                               batch_size: int = None) -> np.ndarray:
+        """Embed input text as feature, output np.ndarray with np.float32.
+
+        Texts are sorted by token length and encoded `batch_size` at a time,
+        the output keeps input order.
+        """
+        texts = [c.content_or_path for c in chunks]
+        batch_size = batch_size or self.max_batch_size
+
+        if 'bce' in self._type:
+            # SentenceTransformer sorts by length itself
             emb = self.client.encode(texts,
+                                     batch_size=batch_size,
                                      show_progress_bar=False,
                                      normalize_embeddings=True)
             return emb.astype(np.float32)
 
-        else:
-            features = []
-            for c in chunks:
-                feature = self.embed_query(text=c.content_or_path)
-                features.append(feature)
-            return np.concatenate(features).reshape(len(chunks),
-                                                    -1).astype(np.float32)
+        order = self._length_order(texts)
+        batches = [
+            order[i:i + batch_size] for i in range(0, len(order), batch_size)
+        ]
+        results = [
+            self._encode_batch([texts[j] for j in batch]) for batch in batches
+        ]
+        return self._restore(len(texts), batches, results)
@@ -0,0 +1,146 @@
+"""Persistent chunk embedding store."""
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import List, Optional
+
+import numpy as np
+from loguru import logger
+
+from .chunk import Chunk
+from .db import select_in
+
+
+class EmbeddingStore:
+    """Embeddings keyed by (model id, content hash).
+
+    Each model owns an append-only float16 matrix file read with `np.memmap`,
+    a sqlite table maps content hash to row number. The row count in sqlite
+    is authoritative, a crash between writing the matrix and committing
+    only leaves unused bytes which the next append overwrites.
+    """
+
+    def __init__(self, file_dir: str, model_id: str):
+        os.makedirs(file_dir, exist_ok=True)
+        self.file_dir = file_dir
+        self.model_id = model_id
+        digest = hashlib.md5(model_id.encode('utf8')).hexdigest()[0:16]
+        self.matrix_path = os.path.join(file_dir, f'{digest}.f16')
+        self.lock = threading.RLock()
+        self.matrix = None
+
+        self.conn = sqlite3.connect(os.path.join(file_dir, 'embeddings.sql'),
+                                    check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS models (
+                model TEXT PRIMARY KEY,
+                dim INTEGER,
+                rows INTEGER
+            )
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT,
+                content_hash TEXT,
+                row INTEGER,
+                PRIMARY KEY (model, content_hash)
+            )
+        ''')
+        self.conn.commit()
+
+        r = self.conn.execute('SELECT dim, rows FROM models WHERE model = ?',
+                              (model_id, )).fetchone()
+        self.dim, self.rows = r if r else (0, 0)
+
+    @staticmethod
+    def content_hash(chunk: Chunk) -> str:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(chunk.modal.encode('utf8'))
+        h.update(b'\x00')
+        h.update(chunk.content_or_path.encode('utf8'))
+        return h.hexdigest()
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def _view(self) -> np.ndarray:
+        if self.matrix is None or self.matrix.shape[0] != self.rows:
+            self.matrix = np.memmap(self.matrix_path,
+                                    dtype=np.float16,
+                                    mode='r',
+                                    shape=(self.rows, self.dim))
+        return self.matrix
+
+    def _rows(self, keys: List[str]) -> dict:
+        return dict(
+            select_in(
+                self.conn,
+                'SELECT content_hash, row FROM embeddings WHERE model = ? AND content_hash IN ({})',
+                keys,
+                params=[self.model_id]))
+
+    def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """float32 embedding for each key, None if never stored."""
+        with self.lock:
+            if self.rows < 1:
+                return [None] * len(keys)
+            found = self._rows(keys)
+            matrix = self._view()
+            return [
+                np.asarray(matrix[found[key]], dtype=np.float32)
+                if key in found else None for key in keys
+            ]
+
+    def put_many(self, keys: List[str], features: np.ndarray):
+        """Append embeddings of keys not stored yet."""
+        features = np.asarray(features).reshape(len(keys), -1)
+        with self.lock:
+            if self.dim == 0:
+                self.dim = features.shape[1]
+            if features.shape[1] != self.dim:
+                logger.error(
+                    f'embedding dim {features.shape[1]} != {self.dim}, skip cache'
+                )
+                return
+
+            found = self._rows(keys)
+            new_rows = dict()
+            for key, feature in zip(keys, features):
+                if key not in found and key not in new_rows:
+                    new_rows[key] = feature
+            if not new_rows:
+                return
+
+            block = np.stack(list(new_rows.values())).astype(np.float16)
+            mode = 'r+b' if os.path.exists(self.matrix_path) else 'wb'
+            with open(self.matrix_path, mode) as f:
+                f.seek(self.rows * self.dim * 2)
+                f.write(block.tobytes())
+                f.truncate()
+
+            start = self.rows
+            self.conn.executemany(
+                'INSERT INTO embeddings (model, content_hash, row) VALUES (?, ?, ?)',
+                [(self.model_id, key, start + i)
+                 for i, key in enumerate(new_rows)])
+            self.rows = start + len(new_rows)
+            self.conn.execute(
+                'INSERT OR REPLACE INTO models (model, dim, rows) VALUES (?, ?, ?)',
+                (self.model_id, self.dim, self.rows))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.matrix = None
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -1,21 +1,29 @@
 from __future__ import annotations
 
+import asyncio
 import time
+import json
 import logging
 import os
 import pdb
 import pickle
+import sqlite3
+import threading
+import weakref
+from collections import OrderedDict
 from pathlib import Path
-from typing import (Any, Callable, Dict, Iterable, List, Optional, Sized,
-                    Tuple, Union)
+from typing import (Any, Callable, Dict, Iterable, List, Optional, Set,
+                    Sized, Tuple, Union)
 
 import numpy as np
 from loguru import logger
 from tqdm import tqdm
 
 from .embedder import Embedder
+from .embedding_store import EmbeddingStore
 from .query import Query, DistanceStrategy
 from .chunk import Chunk
+from .db import select_in
 try:
     import faiss
 except ImportError:
@@ -24,8 +32,207 @@ except ImportError:
         'Please install it with `pip install faiss-gpu` (for CUDA supported GPU) '
         'or `pip install faiss-cpu` (depending on Python version).')
 
+# chunks per `embed_chunks` call is `HUIXIANGDOU_BATCHSIZE * SORT_WINDOW`
+SORT_WINDOW = 16
+
+# `HUIXIANGDOU_INDEX_TYPE` picks one of them, default `auto`
+INDEX_TYPES = ('flat', 'hnsw', 'ivf_flat', 'ivf_pq', 'opq')
+# `auto` uses exact search below this size
+EXACT_LIMIT = 10000
+# bytes, override with `HUIXIANGDOU_INDEX_MEMORY` in MB
+DEFAULT_MEMORY_BUDGET = 2 << 30
+# `HUIXIANGDOU_INDEX_REPORT=1` writes recall/latency of each base build to
+# `index_report.json`, it costs an exact search of `REPORT_QUERIES` queries
+REPORT_QUERIES = 200
+HNSW_M = 32
+# `HUIXIANGDOU_INDEX_QUANT` stores vectors of flat, hnsw and ivf_flat as
+# float16 or int8 scalar quantized codes
+QUANTIZATIONS = ('none', 'fp16', 'int8')
+# quantized indexes re-rank `RERANK_FACTOR * k` candidates with float32
+RERANK_FACTOR = 4
+# store layout version, see `Faiss.save`
+FORMAT_VERSION = 2
+# merge delta segments into the base once they hold this many vectors, or
+# `DELTA_RATIO` of the base, or there are more than `MAX_DELTAS` of them
+DELTA_MIN = 4096
+DELTA_RATIO = 0.1
+MAX_DELTAS = 16
+# rebuild the base when this ratio of it is tombstones it can not remove
+TOMBSTONE_RATIO = 0.2
+# chunks kept in memory by a store loaded from disk
+CHUNK_CACHE_SIZE = 4096
+
+
+class ChunkTable:
+    """Chunks of one faiss store keyed by vector id.
+
+    Deleted rows are kept with `deleted = 1` as tombstones until the index
+    drops their vectors. Search results read chunks by id, so a loaded store
+    never holds the whole table in memory. Chunks are identified by `digest`,
+    the full content hash, since `Chunk._hash` is too short to be unique.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(file_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY,
+                _hash TEXT,
+                content TEXT,
+                metadata TEXT,
+                modal TEXT,
+                deleted INTEGER DEFAULT 0,
+                digest TEXT
+            )
+        ''')
+        # migrate tables created before `digest`
+        columns = [
+            r[1] for r in self.conn.execute('PRAGMA table_info(chunks)')
+        ]
+        if 'digest' not in columns:
+            self.conn.execute('ALTER TABLE chunks ADD COLUMN digest TEXT')
+            rows = self.conn.execute(
+                'SELECT id, content, modal FROM chunks').fetchall()
+            self.conn.executemany(
+                'UPDATE chunks SET digest = ? WHERE id = ?',
+                [(EmbeddingStore.content_hash(
+                    Chunk(content_or_path=content, modal=modal)), _id)
+                 for _id, content, modal in rows])
+        self.conn.execute('DROP INDEX IF EXISTS chunks_hash')
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS chunks_digest ON chunks (digest)')
+        self.conn.commit()
+
+    @staticmethod
+    def _to_chunk(r) -> Chunk:
+        return Chunk(_hash=r[1],
+                     content_or_path=r[2],
+                     metadata=json.loads(r[3]),
+                     modal=r[4])
+
+    def add(self, rows: List[Tuple[int, Chunk]], deleted: bool = False):
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO chunks (id, _hash, content, metadata, modal, deleted, digest) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(_id, c._hash, c.content_or_path,
+                  json.dumps(c.metadata, ensure_ascii=False, default=str), c.modal,
+                  int(deleted), EmbeddingStore.content_hash(c))
+                 for _id, c in rows])
+            self.conn.commit()
+
+    def mark_deleted(self, ids: List[int]):
+        with self.lock:
+            self.conn.executemany('UPDATE chunks SET deleted = 1 WHERE id = ?',
+                                  [(_id, ) for _id in ids])
+            self.conn.commit()
+
+    def purge(self, ids: List[int]):
+        """Drop tombstones whose vectors left the index."""
+        with self.lock:
+            self.conn.executemany('DELETE FROM chunks WHERE id = ?',
+                                  [(_id, ) for _id in ids])
+            self.conn.commit()
+
+    def items(self) -> List[Tuple[int, Chunk]]:
+        """All live chunks in id order."""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT id, _hash, content, metadata, modal FROM chunks WHERE deleted = 0 ORDER BY id'
+            ).fetchall()
+        return [(r[0], self._to_chunk(r)) for r in rows]
+
+    def get_many(self, ids: List[int]) -> Dict[int, Chunk]:
+        """Live chunks of `ids`, missing ones are left out."""
+        with self.lock:
+            rows = select_in(
+                self.conn,
+                'SELECT id, _hash, content, metadata, modal FROM chunks WHERE deleted = 0 AND id IN ({})',
+                ids)
+        return {r[0]: self._to_chunk(r) for r in rows}
+
+    def find(self, digest: str) -> Optional[int]:
+        """Id of the live chunk with content `digest`."""
+        with self.lock:
+            r = self.conn.execute(
+                'SELECT id FROM chunks WHERE deleted = 0 AND digest = ? LIMIT 1',
+                (digest, )).fetchone()
+        return r[0] if r else None
+
+    def tombstones(self) -> Set[int]:
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT id FROM chunks WHERE deleted = 1').fetchall()
+        return set(r[0] for r in rows)
+
+    def stat(self) -> Tuple[int, int]:
+        """Live row count and max id, -1 for an empty table."""
+        with self.lock:
+            count, max_id = self.conn.execute(
+                'SELECT SUM(deleted = 0), MAX(id) FROM chunks').fetchone()
+        return count or 0, -1 if max_id is None else max_id
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+
+class Segment:
+    """One faiss index file of a store.
+
+    `mapped` segments take chunk ids with `add_with_ids`, legacy indexes
+    return positions, which are the ids given to their chunks on load.
+    """
+
+    def __init__(self,
+                 name: str,
+                 index: Any,
+                 mapped: bool = True,
+                 mmap: bool = False):
+        self.name = name
+        self.index = index
+        self.mapped = mapped
+        # read-only mapping of the file, reopened before modification
+        self.mmap = mmap
+        self.id_map = None
+
+    def labels(self) -> np.ndarray:
+        """Id of each position in an `IndexIDMap2`, cached."""
+        if self.id_map is None:
+            self.id_map = faiss.vector_to_array(self.index.id_map)
+        return self.id_map
+
 
 class Faiss():
+    """Vector store on faiss.
+
+    A saved store is a folder with
+      meta.json       format version, distance strategy, next id, segments
+      chunks.sql      `ChunkTable`, the chunk of each vector id
+      base.faiss      index from `build_index`, created by the first save
+      delta_*.faiss   flat `IndexIDMap2` segments appended by later saves
+
+    `upsert` and `delete` are buffered. `save` embeds only new chunks into a
+    new delta segment and writes only changed rows, so it costs time
+    proportional to the change. Deltas are merged into the base once they
+    grow, tombstones are filtered at search time and removed from the base
+    when its index type supports it. Folders in the old
+    `chunks_and_strategy.pkl` format load as one legacy segment and are
+    migrated by the next save.
+
+    `load_local` memory-maps index files and reads chunks from `chunks.sql`
+    only when a search returns them, `load` shares one such instance per
+    folder between retrievers.
+    """
+
+    # read-only instances of `load`, by folder and meta.json mtime
+    shared = weakref.WeakValueDictionary()
+    shared_lock = threading.Lock()
 
     def __init__(
             self,
@@ -34,61 +241,270 @@ class Faiss():
             strategy: DistanceStrategy = DistanceStrategy.EUCLIDEAN_DISTANCE,
             k: int = 30):
         """Initialize with necessary components."""
-        self.chunks = []
-        self.hash2index = dict()
-        self.strategy = strategy
-        for c in chunks:
-            self.upsert(c)
         self.k = k
         self.strategy = strategy
-        self.index = index
-        self.offset = len(self.chunks)
+        self.folder_path = None
+        self.table = None
+        self.segments = []
+        # every live chunk without a table, otherwise an LRU cache of it
+        self.id2chunk = OrderedDict()
+        self.digest2id = dict()
+        self.cache_lock = threading.Lock()
+        self.size = 0
+        self.tombstones = set()
+        self.removed = set()
+        self.pending = []
+        self.pending_digests = set()
+        self.next_id = 0
+        self.delta_seq = 0
+        self.selector = dict()
+
+        if index is not None:
+            # positions of `index` are the ids of `chunks`
+            self.segments.append(Segment('base.faiss', index, mapped=False))
+            for c in chunks:
+                self._adopt(self.next_id, c)
+                self.next_id += 1
+        else:
+            for c in chunks:
+                self.upsert(c)
+
+    @property
+    def index(self):
+        """The base index."""
+        return self.segments[0].index if self.segments else None
+
+    @property
+    def chunks(self) -> List[Chunk]:
+        """Indexed chunks in insertion order."""
+        return [c for _, c in self._live_items()]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _live_items(self) -> List[Tuple[int, Chunk]]:
+        if self.table is not None:
+            return self.table.items()
+        return sorted(self.id2chunk.items())
+
+    def _cache(self, _id: int, c: Chunk):
+        with self.cache_lock:
+            self.id2chunk[_id] = c
+            if self.table is not None:
+                self.id2chunk.move_to_end(_id)
+                while len(self.id2chunk) > CHUNK_CACHE_SIZE:
+                    self.id2chunk.popitem(last=False)
+
+    def _adopt(self, _id: int, c: Chunk):
+        self._cache(_id, c)
+        self.digest2id[EmbeddingStore.content_hash(c)] = _id
+        self.size += 1
+
+    def _get_chunks(self, ids: List[int]) -> Dict[int, Chunk]:
+        """Live chunks of `ids`, read from the table on cache miss."""
+        found = dict()
+        missing = []
+        for _id in ids:
+            if _id in self.tombstones:
+                continue
+            c = self.id2chunk.get(_id)
+            if c is None:
+                missing.append(_id)
+            else:
+                found[_id] = c
+        if missing and self.table is not None:
+            for _id, c in self.table.get_many(missing).items():
+                self._cache(_id, c)
+                found[_id] = c
+        return found
+
+    def _find(self, digest: str) -> Optional[int]:
+        """Id of the live chunk with content `digest`."""
+        _id = self.digest2id.get(digest)
+        if _id is None and self.table is not None:
+            _id = self.table.find(digest)
+        if _id is None or _id in self.tombstones:
+            return None
+        return _id
 
     def upsert(self, c: Chunk):
-        if c._hash in self.hash2index:
+        """Add a chunk unless its content exists, it is indexed by `save`."""
+        digest = EmbeddingStore.content_hash(c)
+        if digest in self.pending_digests or self._find(digest) is not None:
             return
-        self.hash2index[c._hash] = len(self.chunks)
-        self.chunks.append(c)
+        self.pending.append(c)
+        self.pending_digests.add(digest)
+
+    def get(self, c: Chunk) -> Optional[Chunk]:
+        """Stored or pending chunk with the same content as `c`."""
+        digest = EmbeddingStore.content_hash(c)
+        if digest in self.pending_digests:
+            for p in self.pending:
+                if EmbeddingStore.content_hash(p) == digest:
+                    return p
+        _id = self._find(digest)
+        if _id is None:
+            return None
+        return self._get_chunks([_id]).get(_id)
+
+    def delete(self, c: Chunk) -> bool:
+        """Delete the chunk with the same content as `c`, its vector becomes
+        a tombstone."""
+        digest = EmbeddingStore.content_hash(c)
+        if digest in self.pending_digests:
+            self.pending_digests.discard(digest)
+            self.pending = [
+                p for p in self.pending
+                if EmbeddingStore.content_hash(p) != digest
+            ]
+            return True
+        _id = self._find(digest)
+        if _id is None:
+            return False
+        self.digest2id.pop(digest, None)
+        with self.cache_lock:
+            self.id2chunk.pop(_id, None)
+        self.size -= 1
+        self.tombstones.add(_id)
+        self.removed.add(_id)
+        self.selector = dict()
+        return True
+
+    def relevance(self, scores: np.ndarray) -> np.ndarray:
+        """Convert faiss distances to relevance, higher is more similar."""
+        if self.strategy == DistanceStrategy.EUCLIDEAN_DISTANCE:
+            return DistanceStrategy.euclidean_relevance_score_fn(scores)
+        elif self.strategy == DistanceStrategy.MAX_INNER_PRODUCT:
+            return DistanceStrategy.max_inner_product_relevance_score_fn(
+                scores)
+        raise ValueError('self.strategy unset')
+
+    def _dead_selector(self, segment: Segment = None):
+        """faiss selector which skips tombstones, cached until they change.
+
+        With `segment`, it selects positions in the index inside its
+        `IndexIDMap2` instead of ids.
+        """
+        key = segment.name if segment is not None else None
+        if key not in self.selector:
+            dead = np.fromiter(self.tombstones,
+                               dtype=np.int64,
+                               count=len(self.tombstones))
+            if segment is not None:
+                dead = np.flatnonzero(np.isin(segment.labels(), dead))
+            dead = faiss.IDSelectorBatch(dead)
+            # keep `dead` referenced, `IDSelectorNot` holds a raw pointer
+            self.selector[key] = (dead, faiss.IDSelectorNot(dead))
+        return self.selector[key][1]
+
+    def _search_segment(self, segment: Segment, embeddings: np.ndarray,
+                        k: int, nprobe: int, ef_search: int):
+        index = segment.index
+        if self.tombstones and segment.mapped and self._refine(
+                index) is not None:
+            # `IndexIDMap` drops nested parameters when it translates a
+            # selector, so search the refine index by position
+            inner = faiss.downcast_index(index.index)
+            params = self.search_params(inner,
+                                        nprobe=nprobe,
+                                        ef_search=ef_search,
+                                        sel=self._dead_selector(segment))
+            scores, positions = inner.search(embeddings, k, params=params)
+            return scores, np.where(positions < 0, -1,
+                                    segment.labels()[positions])
+
+        sel = self._dead_selector() if self.tombstones else None
+        params = self.search_params(index,
+                                    nprobe=nprobe,
+                                    ef_search=ef_search,
+                                    sel=sel)
+        return index.search(embeddings, k, params=params)
 
-    def search(self, embedding: np.ndarray) -> List[Tuple[Chunk, float]]:
+    def search_batch(self,
+                     embeddings: np.ndarray,
+                     k: int = None,
+                     nprobe: int = None,
+                     ef_search: int = None) -> List[List[Tuple[Chunk, float]]]:
+        """Search N queries with one faiss call per segment.
+
+        Args:
+            embeddings: (N, dim) query embeddings.
+            k: Number of chunks for each query, default `self.k`.
+
+        Returns:
+            For each query, chunks with relevance score in descending order.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if embeddings.ndim == 1:
+            embeddings = embeddings.reshape(1, -1)
+        k = k or self.k
+
+        all_scores = []
+        all_ids = []
+        for segment in self.segments:
+            if segment.index.ntotal < 1:
+                continue
+            scores, ids = self._search_segment(segment, embeddings, k,
+                                               nprobe, ef_search)
+            all_scores.append(scores)
+            all_ids.append(ids)
+        if not all_ids:
+            return [[] for _ in range(len(embeddings))]
+
+        ids = np.hstack(all_ids)
+        # -1 means no enough chunks are returned.
+        rel_scores = np.where(
+            ids < 0, -np.inf,
+            self.relevance(np.hstack(all_scores).astype(np.float64)))
+        if len(all_ids) > 1:
+            order = np.argsort(-rel_scores, axis=1, kind='stable')
+            ids = np.take_along_axis(ids, order, axis=1)
+            rel_scores = np.take_along_axis(rel_scores, order, axis=1)
+
+        rows = []
+        for row_ids, row_scores in zip(ids.tolist(), rel_scores.tolist()):
+            row = dict()
+            for _id, score in zip(row_ids, row_scores):
+                if _id >= 0 and _id not in row and _id not in self.tombstones:
+                    row[_id] = score
+                    if len(row) >= k:
+                        break
+            rows.append(row)
+        # one table read for the whole batch
+        id2chunk = self._get_chunks(
+            sorted(set(_id for row in rows for _id in row)))
+
+        ret = []
+        for row in rows:
+            ret.append([(id2chunk[_id], score) for _id, score in row.items()
+                        if _id in id2chunk])
+        return ret
+
+    def search(self,
+               embedding: np.ndarray,
+               nprobe: int = None,
+               ef_search: int = None) -> List[Tuple[Chunk, float]]:
         """Return chunks most similar to query.
 
         Args:
             embedding: Embedding vector to look up chunk similar to.
-            k: Number of Documents to return. Defaults to 30.
+            nprobe: IVF lists to visit, None for the index default.
+            ef_search: HNSW search width, None for the index default.
 
         Returns:
             List of chunks most similar to the query text and L2 distance
             in float for each. High score represents more similarity.
         """
-        embedding = embedding.astype(np.float32)
-        scores, indices = self.index.search(embedding, self.k)
-        pairs = []
-        for j, i in enumerate(indices[0]):
-            if i == -1:
-                # no enough chunks are returned.
-                continue
-            chunk = self.chunks[i]
-            score = scores[0][j]
-
-            if self.strategy == DistanceStrategy.EUCLIDEAN_DISTANCE:
-                rel_score = DistanceStrategy.euclidean_relevance_score_fn(
-                    score)
-            elif self.strategy == DistanceStrategy.MAX_INNER_PRODUCT:
-                rel_score = DistanceStrategy.max_inner_product_relevance_score_fn(
-                    score)
-            else:
-                raise ValueError('self.strategy unset')
-            pairs.append((chunk, rel_score))
-
-        if len(pairs) >= 2:
-            assert pairs[0][1] >= pairs[1][1]
-        return pairs
+        return self.search_batch(embeddings=embedding[0:1],
+                                 nprobe=nprobe,
+                                 ef_search=ef_search)[0]
 
     def similarity_search(self,
                           embedder: Embedder,
                           query: Query,
-                          threshold: float = -1) -> List:
+                          threshold: float = -1,
+                          nprobe: int = None,
+                          ef_search: int = None) -> List:
         """Return chunks most similar to query.
 
         Args:
@@ -108,9 +524,65 @@ class Faiss():
                 return []
 
         np_feature = embedder.embed_query(text=query.text, path=query.image)
-        pairs = self.search(embedding=np_feature)
-        # ret = list(filter(lambda x: x[1] >= threshold, pairs))
+        pairs = self.search(embedding=np_feature,
+                            nprobe=nprobe,
+                            ef_search=ef_search)
+        return self._threshold(pairs, threshold)
+
+    async def asimilarity_search(self,
+                                 embedder: Embedder,
+                                 query: Query,
+                                 threshold: float = -1,
+                                 nprobe: int = None,
+                                 ef_search: int = None) -> List:
+        """Async `similarity_search`, embedding runs off the event loop."""
+        if query.text is None and query.image is None:
+            raise ValueError(f'Input query is None')
+
+        if query.text is None and query.image is not None:
+            if not embedder.support_image:
+                logger.info('Embedder not support image')
+                return []
+
+        np_feature = await embedder.aembed_query(text=query.text,
+                                                 path=query.image)
+        pairs = self.search(embedding=np_feature,
+                            nprobe=nprobe,
+                            ef_search=ef_search)
+        return self._threshold(pairs, threshold)
+
+    async def asimilarity_search_batch(self,
+                                       embedder: Embedder,
+                                       queries: List[Query],
+                                       threshold: float = -1,
+                                       nprobe: int = None,
+                                       ef_search: int = None) -> List[List]:
+        """`asimilarity_search` for many queries, one faiss call."""
+        valid = []
+        for i, q in enumerate(queries):
+            if q.text is None and q.image is None:
+                raise ValueError(f'Input query is None')
+            if q.text is not None or embedder.support_image:
+                valid.append(i)
+        ret = [[] for _ in queries]
+        if not valid:
+            return ret
+
+        # concurrent embedding requests share one forward pass
+        features = await asyncio.gather(*[
+            embedder.aembed_query(text=queries[i].text,
+                                  path=queries[i].image) for i in valid
+        ])
+        batch = self.search_batch(embeddings=np.concatenate(features),
+                                  nprobe=nprobe,
+                                  ef_search=ef_search)
+        for i, pairs in zip(valid, batch):
+            ret[i] = self._threshold(pairs, threshold)
+        return ret
 
+    @staticmethod
+    def _threshold(pairs: List, threshold: float) -> List:
+        # ret = list(filter(lambda x: x[1] >= threshold, pairs))
         highest_score = -1.0
         ret = []
         for pair in pairs:
@@ -145,76 +617,257 @@ class Faiss():
         return block_text, block_image, block_fasta
 
     @classmethod
-    def build_index_pq(self, np_feature: np.ndarray,
-                    distance_strategy: DistanceStrategy):
-        dimension = np_feature.shape[-1]
-        ef_construction = 64
-        efSearch = 128
-        M = 32 # Number of neighbors
-        m = 16 # Number of subquantizers
-
+    def metric(cls, distance_strategy: DistanceStrategy) -> int:
         if distance_strategy == DistanceStrategy.EUCLIDEAN_DISTANCE:
-            index = faiss.IndexHNSWPQ(dimension, m, M)  
-            index.metric_type = faiss.METRIC_L2  # Set metric for Euclidean distance
+            return faiss.METRIC_L2
         elif distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT:
-            index = faiss.IndexHNSWPQ(dimension, m, M)  
-            index.metric_type = faiss.METRIC_IP  # Set metric for inner product
-        else:
-            raise ValueError('Unknown distance {}'.format(distance_strategy))
-        index.hnsw.efSearch = efSearch
-        index.hnsw.efConstruction = ef_construction
+            return faiss.METRIC_INNER_PRODUCT
+        raise ValueError('Unknown distance {}'.format(distance_strategy))
 
-        return index
-    
     @classmethod
-    def build_index(self, np_feature: np.ndarray,
-                    distance_strategy: DistanceStrategy):
-        dimension = np_feature.shape[-1]
-        ef_construction = 64
-        efSearch = 128
-        M = 32 # Number of neighbors
+    def estimate_memory(cls,
+                        index_type: str,
+                        ntotal: int,
+                        dimension: int,
+                        quantization: str = 'none') -> int:
+        """Rough resident index size in bytes.
 
-        if distance_strategy == DistanceStrategy.EUCLIDEAN_DISTANCE:
-            index = faiss.IndexHNSWFlat(dimension, M)
-            index.metric_type = faiss.METRIC_L2
-        elif distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT:
-            index = faiss.IndexHNSWFlat(dimension, M)
-            index.metric_type = faiss.METRIC_IP
-        else:
-            raise ValueError('Unknown distance {}'.format(distance_strategy))
-        index.hnsw.efSearch = efSearch
-        index.hnsw.efConstruction = ef_construction
+        float32 vectors kept for re-ranking are memory-mapped on load and
+        not counted.
+        """
+        code_size = dimension * {'none': 4, 'fp16': 2, 'int8': 1}[quantization]
+        if index_type == 'flat':
+            return ntotal * code_size
+        if index_type == 'hnsw':
+            return ntotal * (code_size + HNSW_M * 2 * 4)
+        if index_type == 'ivf_flat':
+            return ntotal * (code_size + 8)
+        if index_type in ('ivf_pq', 'opq'):
+            return ntotal * (cls.pq_size(dimension) + 8) + dimension**2 * 4
+        raise ValueError(f'Unknown index type {index_type}')
 
-        return index
+    @classmethod
+    def choose_index_type(cls,
+                          ntotal: int,
+                          dimension: int,
+                          memory_budget: int,
+                          quantization: str = 'none') -> str:
+        """Pick index type from corpus size and memory budget in bytes."""
+        if ntotal < EXACT_LIMIT:
+            # brute force is fast enough and exact
+            return 'flat'
+        for index_type in ('hnsw', 'ivf_flat'):
+            if cls.estimate_memory(index_type, ntotal, dimension,
+                                   quantization) <= memory_budget:
+                return index_type
+        return 'opq' if dimension >= 256 else 'ivf_pq'
 
     @classmethod
-    def save_local(self,
-                   folder_path: str,
-                   chunks: List[Chunk],
-                   embedder: Embedder,
-                   offset: int = 0) -> None:
-        """Save FAISS index and store to disk.
+    def pq_size(cls, dimension: int) -> int:
+        """Number of PQ sub-quantizers, about 4 dims each."""
+        for m in (64, 48, 32, 24, 16, 12, 8, 4, 2):
+            if dimension % m == 0 and m <= max(1, dimension // 4):
+                return m
+        return 1
+
+    @classmethod
+    def factory_string(cls,
+                       index_type: str,
+                       ntotal: int,
+                       dimension: int,
+                       quantization: str = 'none') -> str:
+        """faiss.index_factory description of `index_type`."""
+        nlist = max(1, min(int(4 * ntotal**0.5), ntotal // 39))
+        m = cls.pq_size(dimension)
+        # 8 bit codebooks need 256 * 39 training points
+        nbits = 8 if ntotal >= 256 * 39 else 4
+        if quantization != 'none' and index_type in ('flat', 'hnsw',
+                                                     'ivf_flat'):
+            codec = 'SQfp16' if quantization == 'fp16' else 'SQ8'
+            # RFlat re-ranks the candidates with float32 vectors
+            if index_type == 'flat':
+                return f'{codec},RFlat'
+            if index_type == 'hnsw':
+                return f'HNSW{HNSW_M}_{codec},RFlat'
+            return f'IVF{nlist},{codec},RFlat'
+        if index_type == 'flat':
+            return 'Flat'
+        if index_type == 'hnsw':
+            return f'HNSW{HNSW_M}'
+        if index_type == 'ivf_flat':
+            return f'IVF{nlist},Flat'
+        if index_type == 'ivf_pq':
+            return f'IVF{nlist},PQ{m}x{nbits}'
+        if index_type == 'opq':
+            return f'OPQ{m},IVF{nlist},PQ{m}x{nbits}'
+        raise ValueError(f'Unknown index type {index_type}')
+
+    @classmethod
+    def build_index(cls,
+                    np_feature: np.ndarray,
+                    distance_strategy: DistanceStrategy,
+                    index_type: str = 'auto',
+                    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                    quantization: str = 'none'):
+        """Create an empty index, trained on `np_feature` if it needs it.
 
         Args:
-            folder_path: folder path to save.
-            chunks: chunks to save.
-            embedder: embedding function.
+            index_type: one of `INDEX_TYPES` or `auto`.
+            memory_budget: bytes the index may use, for `auto`.
+            quantization: one of `QUANTIZATIONS`, PQ types ignore it.
         """
+        ntotal, dimension = np_feature.shape[0], np_feature.shape[-1]
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f'Unknown quantization {quantization}')
+        if index_type == 'auto':
+            index_type = cls.choose_index_type(ntotal, dimension,
+                                               memory_budget, quantization)
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f'Unknown index type {index_type}')
+        if index_type in ('ivf_flat', 'ivf_pq', 'opq') and ntotal < 16 * 39:
+            logger.warning(
+                f'{ntotal} vectors too few to train {index_type}, use flat')
+            index_type = 'flat'
 
-        if len(chunks) < offset:
-            raise ValueError(
-                f'init offset {offset} while dump size {len(chunks)}')
-        save_chunks = chunks[offset:]
-        if len(save_chunks) < 1:
-            return
+        description = cls.factory_string(index_type, ntotal, dimension,
+                                         quantization)
+        logger.info(f'build faiss index {description} for {ntotal} vectors')
+        index = faiss.index_factory(dimension, description,
+                                    cls.metric(distance_strategy))
 
-        path = Path(folder_path)
-        path.mkdir(exist_ok=True, parents=True)
+        hnsw = cls._hnsw(index)
+        if hnsw is not None:
+            hnsw.hnsw.efConstruction = 64
+            hnsw.hnsw.efSearch = 128
+        refine = cls._refine(index)
+        if refine is not None:
+            refine.k_factor = RERANK_FACTOR
+        if not index.is_trained:
+            index.train(np_feature.astype(np.float32))
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            ivf.nprobe = max(1, min(ivf.nlist, ivf.nlist // 8))
+        return index
+
+    @classmethod
+    def _unwrap(cls, index):
+        """Index inside an `IndexIDMap`, or `index` itself."""
+        index = faiss.downcast_index(index)
+        if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+            index = faiss.downcast_index(index.index)
+        return index
+
+    @classmethod
+    def _refine(cls, index):
+        """`IndexRefine` re-ranking the base index, or None."""
+        index = cls._unwrap(index)
+        if isinstance(index, faiss.IndexRefine):
+            return index
+        return None
+
+    @classmethod
+    def _hnsw(cls, index):
+        index = cls._unwrap(index)
+        refine = cls._refine(index)
+        if refine is not None:
+            index = faiss.downcast_index(refine.base_index)
+        if isinstance(index, faiss.IndexHNSW):
+            return index
+        return None
+
+    @classmethod
+    def search_params(cls,
+                      index,
+                      nprobe: int = None,
+                      ef_search: int = None,
+                      sel=None):
+        """Per-query search parameters, None for index defaults.
+
+        `sel` is an optional `IDSelector` on chunk ids.
+        """
+        inner = cls._unwrap(index)
+        refine = cls._refine(inner)
+        if refine is not None:
+            inner = faiss.downcast_index(refine.base_index)
+        pretransform = isinstance(inner, faiss.IndexPreTransform)
+        ivf = faiss.try_extract_index_ivf(inner)
+        hnsw = cls._hnsw(inner)
+
+        params = None
+        if ivf is not None and (nprobe is not None or sel is not None):
+            # parameters replace the index defaults entirely
+            params = faiss.SearchParametersIVF(nprobe=nprobe or ivf.nprobe)
+        elif hnsw is not None and (ef_search is not None or sel is not None):
+            params = faiss.SearchParametersHNSW(
+                efSearch=ef_search or hnsw.hnsw.efSearch)
+        elif sel is not None:
+            params = faiss.SearchParameters()
+        if params is not None and sel is not None:
+            params.sel = sel
+
+        if params is not None and pretransform:
+            params = faiss.SearchParametersPreTransform(index_params=params)
+        if params is not None and refine is not None:
+            params = faiss.IndexRefineSearchParameters(
+                k_factor=refine.k_factor, base_index_params=params)
+        return params
+
+    @classmethod
+    def benchmark_index(cls,
+                        index,
+                        np_feature: np.ndarray,
+                        distance_strategy: DistanceStrategy,
+                        k: int = 10,
+                        max_queries: int = REPORT_QUERIES,
+                        ids: np.ndarray = None) -> Dict:
+        """Recall@k and latency of `index` against exact search.
+
+        `ids` are the labels of `np_feature` rows, default their positions.
+        """
+        np_feature = np.ascontiguousarray(np_feature, dtype=np.float32)
+        k = min(k, np_feature.shape[0])
+        rng = np.random.default_rng(0)
+        queries = np_feature[rng.choice(np_feature.shape[0],
+                                        size=min(max_queries,
+                                                 np_feature.shape[0]),
+                                        replace=False)]
+
+        # blocked brute force over the features, no second copy in an index
+        _, truth = faiss.knn(queries,
+                             np_feature,
+                             k,
+                             metric=cls.metric(distance_strategy))
+        if ids is not None:
+            truth = np.asarray(ids)[truth]
+
+        sweeps = [dict()]
+        ivf = faiss.try_extract_index_ivf(cls._unwrap(index))
+        if ivf is not None:
+            sweeps = [{
+                'nprobe': n
+            } for n in sorted({1, 4, 16, 64, ivf.nprobe}) if n <= ivf.nlist]
+        elif cls._hnsw(index) is not None:
+            sweeps = [{'ef_search': n} for n in (16, 64, 128, 256)]
+
+        runs = []
+        for sweep in sweeps:
+            params = cls.search_params(index, **sweep)
+            start = time.time()
+            _, indices = index.search(queries, k, params=params)
+            latency = (time.time() - start) / len(queries)
+            hits = sum(
+                len(set(row) & set(expect))
+                for row, expect in zip(indices.tolist(), truth.tolist()))
+            runs.append(
+                dict(sweep,
+                     recall=hits / truth.size,
+                     latency_ms=round(latency * 1000, 4)))
+        return {'ntotal': int(index.ntotal), 'k': k, 'runs': runs}
 
-        index_path = os.path.join(path, 'embedding.faiss')
-        index = None
-        if os.path.exists(index_path):
-            index = faiss.read_index(index_path)
+    @classmethod
+    def _embed(cls, chunks: List[Chunk],
+               embedder: Embedder) -> Tuple[np.ndarray, List[int]]:
+        """Features of `chunks` and positions of chunks that got one."""
         batchsize = 1
         # max neighbours for each node
         try:
@@ -228,202 +881,371 @@ class Faiss():
         except Exception as e:
             logger.error(str(e))
             batchsize = 1
-        
-        if len(save_chunks) >256:
-            if batchsize == 1:
-                # 存储所有 np_feature
-                all_features = []
-                for chunk in tqdm(save_chunks, desc='chunks'):
-                    np_feature = None
-                    try:
-                        if chunk.modal == 'text':
-                            np_feature = embedder.embed_query(text=chunk.content_or_path)
-                        elif chunk.modal == 'image':
-                            np_feature = embedder.embed_query(path=chunk.content_or_path)
-                        elif chunk.modal == 'fasta':
-                            np_feature = embedder.embed_query(text=chunk.content_or_path)
-                        else:
-                            raise ValueError(f'Unimplemented chunk type: {chunk.modal}')
-                    except Exception as e:
-                        logger.error(f'Error extracting feature: {e}')
-                        continue  # 继续下一个数据
-
-                    if np_feature is None:
-                        logger.error('np_feature is None')
-                        continue               
-                    all_features.append(np_feature)
-
-                all_features = np.vstack(all_features).astype('float32')  # 转成 (N, D) 矩阵
-                if index is None:
-                    index = self.build_index_pq(
-                        np_feature=all_features,
-                        distance_strategy=embedder.distance_strategy)
-                    # **步骤 3：训练索引**
-                    index.train(all_features)  # 先训练索引
-                # **步骤 4：添加数据**
-                index.add(all_features)
+
+        # embedder sorts each window by length, pads per batch and reuses
+        # stored embeddings of unchanged content
+        window = batchsize * SORT_WINDOW
+        kept = []
+        all_features = []
+        for i in tqdm(range(0, len(chunks), window), desc='embedding'):
+            features = embedder.embed_chunks(chunks=chunks[i:i + window],
+                                             batch_size=batchsize)
+            for j, feature in enumerate(features):
+                if feature is None:
+                    continue
+                kept.append(i + j)
+                all_features.append(feature)
+
+        if not all_features:
+            return None, kept
+        return np.vstack(all_features).astype(np.float32), kept
+
+    @classmethod
+    def _write_index(cls, index, file_path: Path):
+        tmp_path = str(file_path) + '.tmp'
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, file_path)
+
+    def _build_base(self, path: Path, features: np.ndarray, ids: np.ndarray,
+                    embedder: Embedder) -> Segment:
+        index_type = os.getenv('HUIXIANGDOU_INDEX_TYPE', 'auto')
+        memory_budget = DEFAULT_MEMORY_BUDGET
+        if os.getenv('HUIXIANGDOU_INDEX_MEMORY'):
+            memory_budget = int(
+                os.getenv('HUIXIANGDOU_INDEX_MEMORY')) * (1 << 20)
+        inner = self.build_index(
+            np_feature=features,
+            distance_strategy=embedder.distance_strategy,
+            index_type=index_type,
+            memory_budget=memory_budget,
+            quantization=os.getenv('HUIXIANGDOU_INDEX_QUANT', 'none'))
+        index = inner
+        if not isinstance(faiss.downcast_index(inner),
+                          (faiss.IndexIVF, faiss.IndexPreTransform)):
+            # IVF keeps ids itself and `IndexIDMap.remove_ids` would
+            # misalign them
+            index = faiss.IndexIDMap2(inner)
+        index.add_with_ids(features, ids)
+
+        if os.getenv('HUIXIANGDOU_INDEX_REPORT'):
+            report = self.benchmark_index(
+                index=index,
+                np_feature=features,
+                ids=ids,
+                distance_strategy=embedder.distance_strategy)
+            logger.info(f'faiss index recall/latency {report}')
+            with open(path / 'index_report.json', 'w') as f:
+                json.dump(report, f, indent=2)
+
+        segment = Segment('base.faiss', index)
+        self._write_index(index, path / segment.name)
+        return segment
+
+    def _add_delta(self, path: Path, features: np.ndarray, ids: np.ndarray,
+                   embedder: Embedder) -> Segment:
+        index = faiss.IndexIDMap2(
+            faiss.IndexFlat(features.shape[-1],
+                            self.metric(embedder.distance_strategy)))
+        index.add_with_ids(features, ids)
+        segment = Segment('delta_{:06d}.faiss'.format(self.delta_seq), index)
+        self.delta_seq += 1
+        self._write_index(index, path / segment.name)
+        return segment
+
+    def _bind(self, path: Path):
+        """Write the whole store into `path`, later saves are incremental."""
+        # without meta.json a half written folder is not loaded as a store
+        if (path / 'meta.json').exists():
+            os.remove(path / 'meta.json')
+        live = self._live_items()
+        if self.table is not None:
+            self.table.close()
+        for name in os.listdir(path):
+            if name.startswith('chunks.sql'):
+                os.remove(path / name)
+        self.table = ChunkTable(str(path / 'chunks.sql'))
+        self.table.add(live)
+        # vectors of tombstones are still in the segments
+        self.table.add([(_id, Chunk()) for _id in sorted(self.tombstones)],
+                       deleted=True)
+        self.removed = set()
+
+        for i, segment in enumerate(self.segments):
+            if i == 0:
+                segment.name = 'base.faiss'
+            self._write_index(segment.index, path / segment.name)
+        names = set(s.name for s in self.segments)
+        for name in os.listdir(path):
+            # legacy files go after meta.json is written
+            if name.endswith('.faiss') and name not in names and (
+                    name != 'embedding.faiss'):
+                os.remove(path / name)
+        self.folder_path = str(path)
+
+    @classmethod
+    def _read_index(cls, file_path: Path, mmap: bool) -> Tuple[Any, bool]:
+        """Index and whether it is memory-mapped."""
+        if mmap:
+            try:
+                return faiss.read_index(
+                    str(file_path),
+                    faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY), True
+            except RuntimeError as e:
+                logger.warning(f'mmap {file_path} failed, read it. {e}')
+        return faiss.read_index(str(file_path)), False
+
+    def _writable(self, path: Path, segment: Segment):
+        if segment.mmap:
+            segment.index, segment.mmap = self._read_index(
+                path / segment.name, mmap=False)
+
+    def _purge(self, ids: Set[int]):
+        self.table.purge(sorted(ids))
+        self.tombstones -= ids
+        self.selector = dict()
+
+    def _rebuild(self, path: Path, embedder: Embedder):
+        """Build a new base from live chunks, stored embeddings make it cheap."""
+        live = self._live_items()
+        features, kept = self._embed([c for _, c in live], embedder)
+        dropped = set(range(len(live))) - set(kept)
+        for i in dropped:
+            _id, c = live[i]
+            with self.cache_lock:
+                self.id2chunk.pop(_id, None)
+            self.digest2id.pop(EmbeddingStore.content_hash(c), None)
+            self.size -= 1
+            self.tombstones.add(_id)
+
+        self.segments = []
+        if features is not None:
+            ids = np.array([live[i][0] for i in kept], dtype=np.int64)
+            self.segments.append(
+                self._build_base(path, features, ids, embedder))
+        self._write_meta(path)
+        for name in os.listdir(path):
+            if name.startswith('delta_') and name.endswith('.faiss'):
+                os.remove(path / name)
+        self._purge(set(self.tombstones))
+
+    def _compact(self, path: Path, embedder: Embedder):
+        """Merge deltas into the base and drop tombstones, if worth it."""
+        if not self.segments:
+            return
+        base = self.segments[0]
+        deltas = self.segments[1:]
+        delta_total = sum(d.index.ntotal for d in deltas)
+        merge = len(deltas) > MAX_DELTAS or delta_total > max(
+            DELTA_MIN, DELTA_RATIO * base.index.ntotal)
+        dead = len(self.tombstones) > TOMBSTONE_RATIO * max(
+            1, self.size + len(self.tombstones))
+        if not merge and not dead:
+            return
+        if not base.mapped:
+            # legacy base returns positions, it can not take new ids
+            logger.info('rebuild legacy faiss base')
+            return self._rebuild(path, embedder)
+
+        for segment in self.segments:
+            self._writable(path, segment)
+            segment.id_map = None
+        self.selector = dict()
+        if merge:
+            for delta in deltas:
+                ids = faiss.vector_to_array(delta.index.id_map)
+                features = faiss.downcast_index(
+                    delta.index.index).reconstruct_n(0, delta.index.ntotal)
+                alive = np.array([_id not in self.tombstones for _id in ids],
+                                 dtype=bool)
+                base.index.add_with_ids(features[alive], ids[alive])
+
+        if merge:
+            self.segments = [base]
+        removed = False
+        if self.tombstones:
+            dead_ids = np.array(sorted(self.tombstones), dtype=np.int64)
+            try:
+                for segment in self.segments:
+                    segment.index.remove_ids(dead_ids)
+                removed = True
+            except RuntimeError:
+                # e.g. HNSW, tombstones stay filtered until a rebuild
+                if dead:
+                    logger.info('rebuild faiss base to drop tombstones')
+                    return self._rebuild(path, embedder)
+
+        for segment in self.segments:
+            self._write_index(segment.index, path / segment.name)
+        self._write_meta(path)
+        if merge:
+            for delta in deltas:
+                os.remove(path / delta.name)
+        if removed:
+            self._purge(set(self.tombstones))
+
+    def _write_meta(self, path: Path):
+        meta = {
+            'version': FORMAT_VERSION,
+            'strategy': str(self.strategy),
+            'next_id': self.next_id,
+            'delta_seq': self.delta_seq,
+            'segments': [{
+                'name': s.name,
+                'mapped': s.mapped
+            } for s in self.segments]
+        }
+        tmp_path = path / 'meta.json.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_path, path / 'meta.json')
+
+    def save(self, folder_path: str, embedder: Embedder) -> None:
+        """Persist changes since the last load or save.
+
+        New chunks are embedded into one new segment, deleted ids are marked
+        in the chunk table. Saving to another folder writes everything.
+        """
+        path = Path(folder_path)
+        path.mkdir(exist_ok=True, parents=True)
+        if self.table is None or self.folder_path != str(path):
+            self._bind(path)
+        self.strategy = embedder.distance_strategy
+
+        if self.pending:
+            features, kept = self._embed(self.pending, embedder)
+            if features is None:
+                logger.error(
+                    'No valid features extracted, skipping index building.')
             else:
-                # batching
-                block_text, block_image, block_fasta = self.split_by_batchsize(
-                    chunks=save_chunks, batchsize=batchsize)
-                all_features = []
-                # 处理文本
-                for subchunks in tqdm(block_text, desc='batching_build_text'):
-                    try:
-                        np_features = embedder.embed_query_batch_text(chunks=subchunks)
-                        if np_features is not None:
-                            all_features.append(np_features)
-                    except Exception as e:
-                        logger.error(f'Error processing text batch: {e}')
-
-                # 处理FASTA
-                for subchunks in tqdm(block_fasta, desc='batching_build_fasta'):
-                    try:
-                        np_features = embedder.embed_query_batch_text(chunks=subchunks)
-                        if np_features is not None:
-                            all_features.append(np_features)
-                    except Exception as e:
-                        logger.error(f'Error processing fasta batch: {e}')
-
-                # 处理图像
-                for subchunks in tqdm(block_image, desc='batching_build_image'):
-                    for chunk in subchunks:
-                        try:
-                            np_feature = embedder.embed_query(path=chunk.content_or_path)
-                            if np_feature is not None:
-                                all_features.append(np_feature)
-                        except Exception as e:
-                            logger.error(f'Error processing image batch: {e}')
-
-                # 统一转换数据格式
-                if all_features:
-                    all_features = np.vstack(all_features).astype('float32')
-
-                    if index is None:
-                        index = self.build_index_pq(
-                            np_feature=all_features,
-                            distance_strategy=embedder.distance_strategy)
-
-                        index.train(all_features)  # 训练索引
-                    index.add(all_features)    # 添加数据
+                ids = np.arange(self.next_id,
+                                self.next_id + len(kept),
+                                dtype=np.int64)
+                self.next_id += len(kept)
+                if self.segments:
+                    segment = self._add_delta(path, features, ids, embedder)
                 else:
-                    logger.error('No valid features extracted, skipping index building.')
-        else:
-            if batchsize == 1:
-                for chunk in tqdm(save_chunks, desc='chunks'):
-                    np_feature = None
-                    try:
-                        if chunk.modal == 'text':
-                            np_feature = embedder.embed_query(text=chunk.content_or_path)
-                        elif chunk.modal == 'image':
-                            np_feature = embedder.embed_query(path=chunk.content_or_path)
-                        elif chunk.modal == 'fasta':
-                            np_feature = embedder.embed_query(text=chunk.content_or_path)
-                        else:
-                            raise ValueError(f'Unimplemented chunk type: {chunk.modal}')
-                    except Exception as e:
-                        logger.error(f'Error extracting feature: {e}')
-                        continue  # 继续下一个数据
-
-                    if np_feature is None:
-                        logger.error('np_feature is None')
-                        continue               
-                    if index is None:
-                        index = self.build_index(
-                            np_feature=np_feature,
-                            distance_strategy=embedder.distance_strategy)
-                    index.add(np_feature)
-            else:
-                # batching
-                block_text, block_image, block_fasta = self.split_by_batchsize(
-                    chunks=save_chunks, batchsize=batchsize)
-                # 处理文本
-                for subchunks in tqdm(block_text, desc='batching_build_text'):
-                    try:
-                        np_features = embedder.embed_query_batch_text(chunks=subchunks)
-                        if index is None:
-                            index = self.build_index(
-                                np_feature=np_features,
-                                distance_strategy=embedder.distance_strategy)
-                        index.add(np_features)
-                    except Exception as e:
-                        logger.error(f'Error processing text batch: {e}')
-
-                # 处理FASTA
-                for subchunks in tqdm(block_fasta, desc='batching_build_fasta'):
-                    try:
-                        np_features = embedder.embed_query_batch_text(chunks=subchunks)
-                        if index is None:
-                            index = self.build_index(
-                                np_feature=np_features,
-                                distance_strategy=embedder.distance_strategy)
-                        index.add(np_features)
-                    except Exception as e:
-                        logger.error(f'Error processing fasta batch: {e}')
-
-                # 处理图像
-                for subchunks in tqdm(block_image, desc='batching_build_image'):
-                    for chunk in subchunks:
-                        try:
-                            np_feature = embedder.embed_query(path=chunk.content_or_path)
-                            if index is None:
-                                index = self.build_index(
-                                    np_feature=np_feature,
-                                    distance_strategy=embedder.distance_strategy)
-                            index.add(np_feature)
-                        except Exception as e:
-                            logger.error(f'Error processing image batch: {e}')
-        
-
-        # save index separately since it is not picklable
-        faiss.write_index(index, index_path)
-
-        # save chunks
-        data = {'chunks': chunks, 'strategy': str(embedder.distance_strategy)}
-        with open(path / 'chunks_and_strategy.pkl', 'wb') as f:
-            pickle.dump(data, f)
+                    segment = self._build_base(path, features, ids, embedder)
+                self.segments.append(segment)
 
-    def save(self, folder_path: str, embedder: Embedder) -> None:
-        self.save_local(folder_path=folder_path,
-                        chunks=self.chunks,
-                        embedder=embedder,
-                        offset=self.offset)
+                rows = [(int(_id), self.pending[i])
+                        for _id, i in zip(ids, kept)]
+                self.table.add(rows)
+                for _id, c in rows:
+                    self._adopt(_id, c)
+            self.pending = []
+            self.pending_digests = set()
+
+        if self.removed:
+            self.table.mark_deleted(sorted(self.removed))
+            self.removed = set()
+
+        self._write_meta(path)
+        self._compact(path, embedder)
+        for name in ('embedding.faiss', 'chunks_and_strategy.pkl'):
+            if os.path.exists(path / name):
+                os.remove(path / name)
 
     @classmethod
-    def load_local(cls, folder_path: str) -> FAISS:
-        """Load FAISS index and chunks from disk.
+    def save_local(cls,
+                   folder_path: str,
+                   chunks: List[Chunk],
+                   embedder: Embedder,
+                   offset: int = 0) -> None:
+        """Add `chunks[offset:]` to the store in `folder_path`.
 
         Args:
-            folder_path: folder path to load index and chunks from index.faiss
-            index_name: for saving with a specific index file name
+            folder_path: folder path to save.
+            chunks: chunks to save.
+            embedder: embedding function.
         """
-        if not os.path.exists(folder_path):
-            return cls()
+        if len(chunks) < offset:
+            raise ValueError(
+                f'init offset {offset} while dump size {len(chunks)}')
+        store = cls.load_local(folder_path)
+        for c in chunks[offset:]:
+            store.upsert(c)
+        store.save(folder_path=folder_path, embedder=embedder)
+
+    @classmethod
+    def _parse_strategy(cls, strategy_str: str) -> DistanceStrategy:
+        if 'EUCLIDEAN_DISTANCE' in strategy_str:
+            return DistanceStrategy.EUCLIDEAN_DISTANCE
+        elif 'MAX_INNER_PRODUCT' in strategy_str:
+            return DistanceStrategy.MAX_INNER_PRODUCT
+        raise ValueError('Unknown strategy type {}'.format(strategy_str))
+
+    @classmethod
+    def load_local(cls, folder_path: str, mmap: bool = True) -> Faiss:
+        """Load FAISS segments from disk, chunks are read on demand.
 
+        Args:
+            folder_path: folder written by `save`, or by the old pickle format
+            mmap: map index files read-only instead of reading them
+        """
         path = Path(folder_path)
-        # load index separately since it is not picklable
+        if not (path / 'meta.json').exists():
+            if (path / 'chunks_and_strategy.pkl').exists():
+                return cls._load_legacy(path)
+            return cls()
 
         t1 = time.time()
-        index = faiss.read_index(str(path / f'embedding.faiss'))
-        strategy = DistanceStrategy.UNKNOWN
+        with open(path / 'meta.json') as f:
+            meta = json.load(f)
+        if meta['version'] > FORMAT_VERSION:
+            raise ValueError(f'Unknown faiss store version {meta["version"]}')
+        store = cls(strategy=cls._parse_strategy(meta['strategy']))
+        for s in meta['segments']:
+            index, mapped = cls._read_index(path / s['name'], mmap=mmap)
+            store.segments.append(
+                Segment(s['name'], index, s['mapped'], mmap=mapped))
         t2 = time.time()
 
-        # load docstore
-        with open(path / f'chunks_and_strategy.pkl', 'rb') as f:
-            data = pickle.load(f)
-            chunks = data['chunks']
-            strategy_str = data['strategy']
+        store.table = ChunkTable(str(path / 'chunks.sql'))
+        store.tombstones = store.table.tombstones()
+        store.size, max_id = store.table.stat()
+        # rows may be ahead of meta.json after a crash, never reuse them
+        store.next_id = max(meta['next_id'], max_id + 1)
+        store.delta_seq = meta['delta_seq']
+        store.folder_path = str(path)
+        t3 = time.time()
+        logger.info(
+            f'Load faiss, {store.size} chunks in {len(store.segments)} segments, read index timecost {int(t2-t1)}, read chunks timecost {int(t3-t2)}'
+        )
+        return store
 
-            if 'EUCLIDEAN_DISTANCE' in strategy_str:
-                strategy = DistanceStrategy.EUCLIDEAN_DISTANCE
-            elif 'MAX_INNER_PRODUCT' in strategy_str:
-                strategy = DistanceStrategy.MAX_INNER_PRODUCT
-            else:
-                raise ValueError(
-                    'Unknown strategy type {}'.format(strategy_str))
+    @classmethod
+    def load(cls, folder_path: str) -> Faiss:
+        """`load_local` instance shared by callers of the same folder.
 
+        Retrievers only search, so they share one memory-mapped store until
+        a `save` rewrites meta.json. Use `load_local` for a store to modify.
+        """
+        path = os.path.realpath(folder_path)
+        stamp = tuple(
+            os.stat(os.path.join(path, name)).st_mtime_ns
+            for name in ('meta.json', 'chunks_and_strategy.pkl')
+            if os.path.exists(os.path.join(path, name)))
+        key = (path, stamp)
+        with cls.shared_lock:
+            store = cls.shared.get(key)
+            if store is None:
+                store = cls.load_local(path)
+                cls.shared[key] = store
+        return store
+
+    @classmethod
+    def _load_legacy(cls, path: Path) -> Faiss:
+        """`embedding.faiss` and `chunks_and_strategy.pkl`, migrated by `save`."""
+        t1 = time.time()
+        index = faiss.read_index(str(path / 'embedding.faiss'))
+        t2 = time.time()
+        with open(path / 'chunks_and_strategy.pkl', 'rb') as f:
+            data = pickle.load(f)
         t3 = time.time()
         logger.info(
-            f'Load faiss, ntotal {index.ntotal}, read index timecost {int(t2-t1)}, read pkl timecost {int(t3-t2)}'
+            f'Load legacy faiss, ntotal {index.ntotal}, read index timecost {int(t2-t1)}, read pkl timecost {int(t3-t2)}'
         )
-        return cls(index, chunks, strategy)
+        store = cls(index, data['chunks'],
+                    cls._parse_strategy(data['strategy']))
+        store.folder_path = str(path)
+        return store
@@ -0,0 +1,85 @@
+"""Run blocking model inference off the event loop."""
+import asyncio
+import json
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+import aiohttp
+from loguru import logger
+
+
+class InferencePool:
+    """Dedicated worker threads for forward passes with a bounded queue.
+
+    torch and onnxruntime release the GIL while computing, so threads keep
+    one copy of the weights and still let the event loop serve other
+    requests. At most `max_queue` calls wait or run at once per event loop,
+    later callers are suspended instead of piling up in the executor.
+    """
+
+    def __init__(self,
+                 max_workers: int = 1,
+                 max_queue: int = 64,
+                 name: str = 'inference'):
+        self.name = name
+        self.max_queue = max(1, max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers),
+                                           thread_name_prefix=name)
+        # asyncio.Semaphore binds to the first loop using it
+        self.semaphores = weakref.WeakKeyDictionary()
+        self.queued = 0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self.semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_queue)
+            self.semaphores[loop] = semaphore
+        return semaphore
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Await `func(*args, **kwargs)` executed in a worker thread."""
+        self.queued += 1
+        try:
+            async with self._semaphore():
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    self.executor, lambda: func(*args, **kwargs))
+        finally:
+            self.queued -= 1
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class HTTPSessionPool:
+    """Keep-alive aiohttp session for remote model APIs, one per event loop."""
+
+    def __init__(self, limit: int = 64, timeout: float = 120):
+        self.limit = limit
+        self.timeout = timeout
+        self.sessions = weakref.WeakKeyDictionary()
+
+    def get(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        session = self.sessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self.sessions[loop] = session
+        return session
+
+    async def post_json(self, url: str, payload: dict, headers: dict) -> dict:
+        async with self.get().post(url, json=payload,
+                                   headers=headers) as response:
+            text = await response.text()
+            if response.status != 200:
+                logger.error(f'{url} {response.status} {text}')
+            return json.loads(text)
+
+    async def close(self):
+        for session in list(self.sessions.values()):
+            if not session.closed:
+                await session.close()
@@ -3,7 +3,9 @@ import itertools
 import json
 import logging
 import re
+import weakref
 import networkx as nx
+import numpy as np
 from abc import ABC, abstractmethod
 from collections import defaultdict
 from enum import Enum
@@ -506,12 +508,12 @@ class MemoryGraph(Graph):
         subgraph = MemoryGraph()
 
         for vid in vids:
-            await self.__search(vid, direct, depth, fan, limit, 0, set(),
+            await self._search(vid, direct, depth, fan, limit, 0, set(),
                                 subgraph)
 
         return subgraph
 
-    async def __search(
+    async def _search(
         self,
         vid: str,
         direct: Direction,
@@ -533,7 +535,7 @@ class MemoryGraph(Graph):
 
         # visit edges
         nids = set()
-        async for edge in self.get_neighbor_edges(vid, direct, fan):
+        for edge in await self.get_neighbor_edges(vid, direct, fan):
             if limit and _subgraph.edge_count >= limit:
                 return
 
@@ -545,7 +547,7 @@ class MemoryGraph(Graph):
 
         # next hop
         for nid in nids:
-            await self.__search(nid, direct, depth, fan, limit, _depth + 1,
+            await self._search(nid, direct, depth, fan, limit, _depth + 1,
                                 _visited, _subgraph)
 
     async def edge_degree(self, sid: str, tid: str) -> int:
@@ -588,3 +590,345 @@ class MemoryGraph(Graph):
             raise ValueError(f"Invalid direction: {direction}")
 
         return itertools.islice(es, limit) if limit else es
+
+    def freeze(self) -> "FrozenGraph":
+        """Read-only compact copy, see `FrozenGraph`."""
+        return FrozenGraph(vertices=self.vertices(), edges=self.edges())
+
+
+class FrozenGraph(Graph):
+    """Read-only graph for full-graph workloads.
+
+    Vertex ids are interned to int32, adjacency is CSR in both directions
+    and properties are columnar, so millions of edges cost a few arrays
+    instead of one `Edge` and props dict each. `Vertex` and `Edge` objects
+    are materialized on access, an edge keeps its identity while referenced.
+    Mutations raise `TypeError`, `thaw()` to a `MemoryGraph` to modify.
+    """
+
+    def __init__(self,
+                 vertices: Iterator[Vertex] = (),
+                 edges: Iterator[Edge] = ()):
+        """Build from vertices and edges with `MemoryGraph` semantics:
+        vertices upsert by id and edge endpoints create missing vertices."""
+        vids = []
+        index = dict()
+        names = []
+        vertex_props = []
+        id_only = []
+
+        def intern(vid: str) -> int:
+            i = index.get(vid)
+            if i is None:
+                i = len(vids)
+                index[vid] = i
+                vids.append(vid)
+                names.append(None)
+                vertex_props.append(None)
+                id_only.append(True)
+            return i
+
+        for v in vertices:
+            i = intern(v.vid)
+            if isinstance(v, IdVertex):
+                continue
+            if id_only[i]:
+                names[i] = v._name
+                vertex_props[i] = dict(v.props)
+                id_only[i] = False
+            else:
+                vertex_props[i].update(v.props)
+
+        src = []
+        dst = []
+        edge_names = []
+        edge_props = []
+        seen = set()
+        for e in edges:
+            if id(e) in seen:
+                continue
+            seen.add(id(e))
+            src.append(intern(e.sid))
+            dst.append(intern(e.tid))
+            edge_names.append(e.name)
+            edge_props.append(e.props)
+
+        self._vids = np.array(vids, dtype=object)
+        self._index = index
+        self._names = np.array(names, dtype=object)
+        self._id_only = np.array(id_only, dtype=bool)
+        self._vertex_columns = self._columns(vertex_props)
+
+        # edge ids follow source order, the out CSR indexes them directly
+        src = np.array(src, dtype=np.int32)
+        dst = np.array(dst, dtype=np.int32)
+        order = np.argsort(src, kind='stable')
+        self._src = src[order]
+        self._dst = dst[order]
+        self._edge_names = np.array(edge_names, dtype=object)[order]
+        self._edge_columns = self._columns([edge_props[i] for i in order])
+        self._out_ptr = self._pointers(self._src)
+        self._in_eids = np.argsort(self._dst, kind='stable').astype(np.int64)
+        self._in_ptr = self._pointers(self._dst)
+
+        # `node_degree` of MemoryGraph counts distinct neighbors
+        pairs = np.unique(np.stack([self._src, self._dst], axis=1), axis=0) \
+            if len(self._src) else np.zeros((0, 2), dtype=np.int32)
+        n = len(self._vids)
+        self._out_degree = np.bincount(pairs[:, 0], minlength=n)
+        self._in_degree = np.bincount(pairs[:, 1], minlength=n)
+        self._edge_cache = weakref.WeakValueDictionary()
+
+    @staticmethod
+    def _columns(rows: List[Optional[dict]]) -> Dict[str, tuple]:
+        """(values, present mask) of each property key."""
+        keys = []
+        for row in rows:
+            for k in row or ():
+                if k not in keys:
+                    keys.append(k)
+        columns = dict()
+        for k in keys:
+            values = np.empty(len(rows), dtype=object)
+            present = np.zeros(len(rows), dtype=bool)
+            for i, row in enumerate(rows):
+                if row and k in row:
+                    values[i] = row[k]
+                    present[i] = True
+            columns[k] = (values, present)
+        return columns
+
+    def _pointers(self, ends: np.ndarray) -> np.ndarray:
+        ptr = np.zeros(len(self._vids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ends, minlength=len(self._vids)), out=ptr[1:])
+        return ptr
+
+    @staticmethod
+    def _props(columns: Dict[str, tuple], i: int) -> dict:
+        return {k: v[i] for k, (v, present) in columns.items() if present[i]}
+
+    def _vertex(self, i: int) -> Vertex:
+        if self._id_only[i]:
+            return IdVertex(self._vids[i])
+        return Vertex(self._vids[i], self._names[i],
+                      **self._props(self._vertex_columns, i))
+
+    def _edge(self, eid: int) -> Edge:
+        eid = int(eid)
+        edge = self._edge_cache.get(eid)
+        if edge is None:
+            edge = Edge(self._vids[self._src[eid]], self._vids[self._dst[eid]],
+                        self._edge_names[eid],
+                        **self._props(self._edge_columns, eid))
+            self._edge_cache[eid] = edge
+        return edge
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('FrozenGraph is read-only, `thaw()` it first')
+
+    upsert_vertex = _readonly
+    upsert_node = _readonly
+    append_edge = _readonly
+    upsert_edge = _readonly
+    del_vertices = _readonly
+    del_edges = _readonly
+    del_neighbor_edges = _readonly
+    truncate = _readonly
+
+    def thaw(self) -> MemoryGraph:
+        """Mutable `MemoryGraph` copy."""
+        graph = MemoryGraph()
+        for v in self.vertices():
+            graph.upsert_vertex(v)
+        for e in self.edges():
+            graph.append_edge(e)
+        return graph
+
+    @property
+    def vertex_count(self):
+        return len(self._vids)
+
+    @property
+    def edge_count(self):
+        return len(self._src)
+
+    def vid_index(self, vids: List[str]) -> np.ndarray:
+        """Interned ids of known vids, unknown ones are dropped."""
+        return np.array([self._index[v] for v in vids if v in self._index],
+                        dtype=np.int64)
+
+    def has_vertex(self, vid: str) -> bool:
+        return vid in self._index
+
+    def get_vertex(self, vid: str) -> Vertex:
+        i = self._index.get(vid)
+        return None if i is None else self._vertex(i)
+
+    def has_node(self, vid: str) -> bool:
+        return self.has_vertex(vid)
+
+    def get_node(self, vid: str) -> Vertex:
+        return self.get_vertex(vid)
+
+    def vertices(self) -> Iterator[Vertex]:
+        return (self._vertex(i) for i in range(len(self._vids)))
+
+    def edges(self) -> Iterator[Edge]:
+        return (self._edge(eid) for eid in range(len(self._src)))
+
+    def _out_eids(self, i: int) -> np.ndarray:
+        return np.arange(self._out_ptr[i], self._out_ptr[i + 1])
+
+    def _in_eids_of(self, i: int) -> np.ndarray:
+        return self._in_eids[self._in_ptr[i]:self._in_ptr[i + 1]]
+
+    def has_edge(self, sid: str, tid: str) -> bool:
+        return len(self._between(sid, tid)) > 0
+
+    def _between(self, sid: str, tid: str) -> np.ndarray:
+        s = self._index.get(sid)
+        t = self._index.get(tid)
+        if s is None or t is None:
+            return np.zeros(0, dtype=np.int64)
+        eids = self._out_eids(s)
+        return eids[self._dst[eids] == t]
+
+    def get_edge(self, sid: str, tid: str) -> Optional[Set[Edge]]:
+        """Edges from `sid` to `tid`, None if there is none."""
+        eids = self._between(sid, tid)
+        if len(eids) < 1:
+            return None
+        return set(self._edge(eid) for eid in eids)
+
+    def degrees(self, direction: Direction = Direction.BOTH) -> np.ndarray:
+        """Distinct neighbor count of every vertex, by interned id."""
+        if direction == Direction.OUT:
+            return self._out_degree
+        if direction == Direction.IN:
+            return self._in_degree
+        return self._out_degree + self._in_degree
+
+    async def node_degree(self, vid: str) -> int:
+        i = self._index.get(vid)
+        if i is None:
+            return 0
+        return int(self._out_degree[i] + self._in_degree[i])
+
+    async def edge_degree(self, sid: str, tid: str) -> int:
+        return await self.node_degree(vid=sid) + await self.node_degree(vid=tid
+                                                                        )
+
+    @staticmethod
+    def _gather(ptr: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """Concatenate CSR rows `ids` without a Python loop."""
+        starts = ptr[ids]
+        counts = ptr[ids + 1] - starts
+        total = int(counts.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.int64)
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        return offsets + np.arange(total)
+
+    def expand_ids(self,
+                   ids: np.ndarray,
+                   direction: Direction = Direction.BOTH) -> np.ndarray:
+        """Distinct neighbors of interned `ids`, in one vectorized pass."""
+        ids = np.asarray(ids, dtype=np.int64)
+        neighbors = []
+        if direction in [Direction.OUT, Direction.BOTH]:
+            neighbors.append(self._dst[self._gather(self._out_ptr, ids)])
+        if direction in [Direction.IN, Direction.BOTH]:
+            eids = self._in_eids[self._gather(self._in_ptr, ids)]
+            neighbors.append(self._src[eids])
+        return np.unique(np.concatenate(neighbors)).astype(np.int64)
+
+    def expand(self,
+               vids: List[str],
+               direction: Direction = Direction.BOTH,
+               depth: int = 1) -> List[str]:
+        """Vids within `depth` hops of `vids`, excluding them."""
+        start = np.unique(self.vid_index(vids))
+        visited = start
+        frontier = start
+        for _ in range(depth):
+            if len(frontier) < 1:
+                break
+            frontier = np.setdiff1d(self.expand_ids(frontier, direction),
+                                    visited)
+            visited = np.union1d(visited, frontier)
+        return list(self._vids[np.setdiff1d(visited, start)])
+
+    async def get_neighbor_edges(
+        self,
+        vid: str,
+        direction: Direction = Direction.OUT,
+        limit: Optional[int] = None,
+    ) -> Iterator[Edge]:
+        """Get edges connected to a vertex by direction."""
+        i = self._index.get(vid)
+        if i is None:
+            eids = np.zeros(0, dtype=np.int64)
+        elif direction == Direction.OUT:
+            eids = self._out_eids(i)
+        elif direction == Direction.IN:
+            eids = self._in_eids_of(i)
+        elif direction == Direction.BOTH:
+            # interleave like `MemoryGraph`, self loops only once
+            oes = self._out_eids(i)
+            ies = self._in_eids_of(i)
+            n = min(len(oes), len(ies))
+            eids = np.concatenate(
+                [np.stack([oes[:n], ies[:n]], axis=1).reshape(-1),
+                 oes[n:], ies[n:]]).astype(np.int64)
+            _, first = np.unique(eids, return_index=True)
+            eids = eids[np.sort(first)]
+        else:
+            raise ValueError(f"Invalid direction: {direction}")
+        if limit:
+            eids = eids[:limit]
+        return (self._edge(eid) for eid in eids)
+
+    async def search(
+        self,
+        vids: List[str],
+        direct: Direction = Direction.OUT,
+        depth: Optional[int] = None,
+        fan: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> MemoryGraph:
+        """Same traversal as `MemoryGraph.search`."""
+        return await MemoryGraph.search(self, vids, direct, depth, fan, limit)
+
+    _search = MemoryGraph._search
+
+    def schema(self) -> Dict[str, Any]:
+        """Return schema."""
+        return {
+            "schema": [
+                {
+                    "type": "VERTEX",
+                    "properties": [{
+                        "name": k
+                    } for k in self._vertex_columns],
+                },
+                {
+                    "type": "EDGE",
+                    "properties": [{
+                        "name": k
+                    } for k in self._edge_columns],
+                },
+            ]
+        }
+
+    def format(self) -> str:
+        """Format graph to string."""
+        concise = np.array([f"({n or v})"
+                            for n, v in zip(self._names, self._vids)],
+                           dtype=object)
+        vs_str = "\n".join(v.format() for v in self.vertices())
+        es_str = "\n".join(f"{concise[self._src[eid]]}"
+                           f"{self._edge(eid).format()}"
+                           f"{concise[self._dst[eid]]}"
+                           for eid in range(len(self._src)))
+        return (f"Entities:\n{vs_str}\n\n"
+                f"Relationships:\n{es_str}" if (vs_str or es_str) else "")
@@ -1,87 +1,206 @@
+import os
+import struct
+import threading
 import time
-from datetime import datetime, timedelta
+from contextlib import contextmanager
 from loguru import logger
 import asyncio
 
+try:
+    import fcntl
+except ImportError:
+    # windows, shared state is not supported
+    fcntl = None
+
+
+class _LocalState:
+    """Bucket state inside current process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = None
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            state = list(self.state) if self.state is not None else None
+            holder = [state]
+            yield holder
+            self.state = holder[0]
+
+
+class _FileState:
+    """Bucket state shared by processes with a locked local file."""
+    FORMAT = '<dd'
+
+    def __init__(self, path: str):
+        if fcntl is None:
+            raise RuntimeError('shared limiter state requires fcntl')
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    @contextmanager
+    def transaction(self):
+        size = struct.calcsize(self.FORMAT)
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                data = os.pread(self.fd, size, 0)
+                state = list(struct.unpack(self.FORMAT,
+                                           data)) if len(data) == size else None
+                holder = [state]
+                yield holder
+                if holder[0] is not None:
+                    os.pwrite(self.fd, struct.pack(self.FORMAT, *holder[0]), 0)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def __del__(self):
+        try:
+            os.close(self.fd)
+        except Exception:
+            pass
+
+
+class Reservation:
+    """Tokens taken from a bucket ahead of time.
+
+    Callers sleep `delay` seconds before using them (`await wait()`) and call
+    `settle` with the real usage once known, the difference is refunded or
+    charged to the bucket. Cancelling `wait` refunds the whole amount.
+    """
+
+    def __init__(self, bucket: 'TokenBucket', amount: float, delay: float):
+        self.bucket = bucket
+        self.amount = amount
+        self.delay = delay
+        self.settled = False
+
+    async def wait(self):
+        if self.delay > 0:
+            try:
+                await asyncio.sleep(self.delay)
+            except asyncio.CancelledError:
+                # cancelled before the call was sent, e.g. a losing hedge
+                self.settle(0)
+                raise
+
+    def settle(self, actual: float):
+        if self.settled:
+            return
+        self.settled = True
+        if actual != self.amount:
+            self.bucket.refund(self.amount - actual)
+
+
+class TokenBucket:
+    """Token bucket holds `capacity` tokens and refills `capacity` tokens per
+    `period` seconds smoothly.
+
+    `reserve` never blocks, it takes tokens immediately (balance may become
+    negative) and returns how long the caller must sleep. Since balance is
+    updated in call order, waiters are served FIFO and wake up one by one
+    instead of all at the top of the minute.
+
+    With `state_path` the balance lives in a locked file, so all processes
+    using the same path share one budget.
+    """
+
+    def __init__(self,
+                 capacity: float,
+                 period: float = 60.0,
+                 state_path: str = None):
+        self.capacity = float(max(1, capacity))
+        self.rate = self.capacity / period
+        if state_path:
+            self.state = _FileState(state_path)
+        else:
+            self.state = _LocalState()
+
+    def _refill(self, holder, now: float) -> float:
+        if holder[0] is None:
+            holder[0] = [self.capacity, now]
+        tokens, updated = holder[0]
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+        return tokens
+
+    def reserve(self, amount: float) -> Reservation:
+        now = time.time()
+        with self.state.transaction() as holder:
+            tokens = self._refill(holder, now) - amount
+            holder[0] = [tokens, now]
+        delay = -tokens / self.rate if tokens < 0 else 0.0
+        return Reservation(bucket=self, amount=amount, delay=delay)
+
+    def refund(self, amount: float):
+        """Give back unused tokens, negative amount charges extra usage."""
+        now = time.time()
+        with self.state.transaction() as holder:
+            tokens = self._refill(holder, now) + amount
+            holder[0] = [min(self.capacity, tokens), now]
+
+    def available(self) -> float:
+        """Current balance, negative means queued reservations."""
+        now = time.time()
+        with self.state.transaction() as holder:
+            tokens = self._refill(holder, now)
+            holder[0] = [tokens, now]
+        return tokens
+
 
 class RPM:
 
-    def __init__(self, rpm: int = 1000):
+    def __init__(self, rpm: int = 1000, state_path: str = None):
         self.rpm = rpm
-        self.record = {'rpm_slot': self.get_minute_slot(), 'counter': 0}
+        self.bucket = TokenBucket(capacity=rpm, state_path=state_path)
 
-    def get_minute_slot(self):
-        current_time = time.time()
-        dt_object = datetime.fromtimestamp(current_time)
-        total_minutes_since_midnight = dt_object.hour * 60 + dt_object.minute
-        return total_minutes_since_midnight
+    def reserve(self) -> Reservation:
+        return self.bucket.reserve(1)
 
     async def wait(self, silent=False):
-        current = time.time()
-        dt_object = datetime.fromtimestamp(current)
-        minute_slot = self.get_minute_slot()
-
-        if self.record['rpm_slot'] == minute_slot:
-            # check RPM exceed
-            if self.record['counter'] >= self.rpm:
-                # wait until next minute
-                next_minute = dt_object.replace(
-                    second=0, microsecond=0) + timedelta(minutes=1)
-                _next = next_minute.timestamp()
-                sleep_time = abs(_next - current)
-                if not silent:
-                    logger.info(f'RPM sleep {sleep_time}')
-                await asyncio.sleep(sleep_time)
-
-                self.record = {
-                    'rpm_slot': self.get_minute_slot(),
-                    'counter': 0
-                }
-        else:
-            self.record = {'rpm_slot': self.get_minute_slot(), 'counter': 0}
-        self.record['counter'] += 1
+        reservation = self.reserve()
+        if reservation.delay > 0 and not silent:
+            logger.info(f'RPM sleep {reservation.delay}')
+        await reservation.wait()
 
-        if not silent:
-            logger.debug(self.record)
+    def wait_sync(self, silent=False):
+        """Blocking version for sync callers."""
+        reservation = self.reserve()
+        if reservation.delay > 0:
+            if not silent:
+                logger.info(f'RPM sleep {reservation.delay}')
+            time.sleep(reservation.delay)
 
 
 class TPM:
 
-    def __init__(self, tpm: int = 20000):
+    def __init__(self, tpm: int = 20000, state_path: str = None):
         self.tpm = tpm
-        self.record = {'tpm_slot': self.get_minute_slot(), 'counter': 0}
+        self.bucket = TokenBucket(capacity=tpm, state_path=state_path)
 
-    def get_minute_slot(self):
-        current_time = time.time()
-        dt_object = datetime.fromtimestamp(current_time)
-        total_minutes_since_midnight = dt_object.hour * 60 + dt_object.minute
-        return total_minutes_since_midnight
+    def reserve(self, token_count) -> Reservation:
+        """Reserve input + expected output tokens before the call, `settle`
+        it with the real usage afterwards."""
+        return self.bucket.reserve(token_count)
 
-    async def wait(self, token_count, silent=False):
-        current = time.time()
-        dt_object = datetime.fromtimestamp(current)
-        minute_slot = self.get_minute_slot()
-
-        # get next slot, skip
-        if self.record['tpm_slot'] != minute_slot:
-            self.record = {'tpm_slot': minute_slot, 'counter': token_count}
-            return
+    async def acquire(self, token_count, silent=False) -> Reservation:
+        reservation = self.reserve(token_count)
+        if reservation.delay > 0 and not silent:
+            logger.info(f'TPM sleep {reservation.delay}')
+        await reservation.wait()
+        return reservation
 
-        # check RPM exceed
-        self.record['counter'] += token_count
-        if self.record['counter'] > self.tpm:
-            # wait until next minute
-            next_minute = dt_object.replace(
-                second=0, microsecond=0) + timedelta(minutes=1)
-            _next = next_minute.timestamp()
-            sleep_time = abs(_next - current)
-            logger.info(f'TPM sleep {sleep_time}')
-            await asyncio.sleep(sleep_time)
-
-            self.record = {
-                'tpm_slot': self.get_minute_slot(),
-                'counter': token_count
-            }
-
-        if not silent:
-            logger.debug(self.record)
+    async def wait(self, token_count, silent=False):
+        await self.acquire(token_count=token_count, silent=silent)
+
+    def wait_sync(self, token_count, silent=False):
+        """Blocking version for sync callers."""
+        reservation = self.reserve(token_count)
+        if reservation.delay > 0:
+            if not silent:
+                logger.info(f'TPM sleep {reservation.delay}')
+            time.sleep(reservation.delay)
@@ -5,71 +5,32 @@ import os
 from .limitter import RPM, TPM
 from .utils import always_get_an_event_loop
 import asyncio
+import time
 from typing import Dict, List, Dict, Union, AsyncGenerator
 import pytoml
 from loguru import logger
 from openai import AsyncOpenAI, APIConnectionError, RateLimitError, Timeout, APITimeoutError
-from .token import encode_string, decode_tokens
-from tenacity import (
-    retry,
-    stop_after_attempt,
-    wait_exponential,
-    retry_if_exception_type,
-)
-from functools import wraps
-import sqlite3
-import uuid
-import hashlib
-
-from .db import DB
-
-class ChatCache:
-    def __init__(self, file_path: str = '.cache_llm'):
-        self.file_path = file_path
-        with DB(self.file_path) as db:
-            db.execute('''
-                CREATE TABLE IF NOT EXISTS chat (
-                    _hash TEXT PRIMARY KEY,
-                    query TEXT,
-                    response TEXT,
-                    backend TEXT
-                )
-            ''')
+from .token import encode_string, decode_tokens, count_tokens
+from contextlib import asynccontextmanager
+import httpx
 
-    def hash(self, content: str) -> str:
-        md5 = hashlib.md5()
-        if type(content) is str:
-            md5.update(content.encode('utf8'))
-        else:
-            md5.update(content)
-        return md5.hexdigest()[0:6]
-
-    def add(self, query: str, response: str, backend:str):
-        _hash = self.hash(query)
-        
-        with DB(self.file_path) as db:
-            db.execute('''
-                INSERT OR IGNORE INTO chat (_hash, query, response, backend)
-                VALUES (?, ?, ?, ?)
-            ''', (_hash, query, response, backend))
-        
-    def get(self, query: str, backend:str) -> Union[str, None]:
-        """Retrieve a chunk by its ID."""
-        if not query:
-            return None
-        _hash = self.hash(query)
-
-        with DB(self.file_path) as db:
-            db.execute(
-                'SELECT response FROM chat WHERE _hash = ? and backend = ?',
-                (_hash, backend))
-            r = db.fetchone()
-            if r:
-                return r[0]
-            return None
+from .cache import LLMCache
+from .scheduler import ConcurrencyScheduler, Priority
+from .router import Router
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
+try:
+    # HTTP/2 multiplexing needs the optional `h2` package
+    import h2  # noqa F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# errors worth trying another backend
+# `openai.Timeout` is the httpx timeout config, not an exception
+FAILOVER_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError)
+
 backend2url = {
     "kimi": "https://api.moonshot.cn/v1",
     "step": "https://api.stepfun.com/v1",
@@ -91,28 +52,6 @@ backend2model = {
 }
 
 
-def limit_async_func_call(max_size: int, waitting_time: float = 0.1):
-    """Add restriction of maximum async calling times for a async func"""
-
-    def final_decro(func):
-        """Not using async.Semaphore to aovid use nest-asyncio"""
-        __current_size = 0
-
-        @wraps(func)
-        async def wait_func(*args, **kwargs):
-            nonlocal __current_size
-            while __current_size >= max_size:
-                await asyncio.sleep(waitting_time)
-            __current_size += 1
-            result = await func(*args, **kwargs)
-            __current_size -= 1
-            return result
-
-        return wait_func
-
-    return final_decro
-
-
 class Backend:
 
     def __init__(self, name: str, data: Dict):
@@ -120,15 +59,101 @@ class Backend:
         self.max_token_size = data.get('max_token_size', 32000) - 4096
         if self.max_token_size < 0:
             raise Exception(f'{self.max_token_size} < 4096')
-        self.rpm = RPM(int(data.get('rpm', 500)))
-        self.tpm = TPM(int(data.get('tpm', 20000)))
         self.name = name
+        # share RPM/TPM budget across processes when `limiter_dir` is set
+        limiter_dir = data.get('limiter_dir', '')
+        self.rpm = RPM(int(data.get('rpm', 500)),
+                       state_path=os.path.join(limiter_dir, f'{name}.rpm')
+                       if limiter_dir else None)
+        self.tpm = TPM(int(data.get('tpm', 20000)),
+                       state_path=os.path.join(limiter_dir, f'{name}.tpm')
+                       if limiter_dir else None)
         self.port = int(data.get('port', 23333))
         self.model = data.get('model', '')
         self.base_url = data.get('base_url', '')
         if not self.base_url and name in backend2url:
             self.base_url = backend2url[name]
 
+        # keep-alive connection pool, shared by all requests of this backend
+        self.max_connections = int(data.get('max_connections', 64))
+        self.max_keepalive_connections = int(
+            data.get('max_keepalive_connections', self.max_connections))
+        self.keepalive_expiry = float(data.get('keepalive_expiry', 30))
+        self.http2 = bool(data.get('http2', True)) and HTTP2_AVAILABLE
+        self._client = None
+        self._client_loop = None
+
+        # max concurrent requests, interactive chat goes first
+        self.scheduler = ConcurrencyScheduler(
+            max_inflight=int(data.get('max_inflight', 16)), name=name)
+
+        # pool saturation metrics
+        self.inflight = 0
+        self.peak_inflight = 0
+        self.total_requests = 0
+        self.saturated_requests = 0
+
+    def client(self, timeout: float = None) -> AsyncOpenAI:
+        """Return the long-lived client, build it on first use."""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            # httpx connections are bound to the event loop which opened them
+            if self._client is not None:
+                logger.debug(f'{self.name} event loop changed, rebuild client')
+            http_client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                    keepalive_expiry=self.keepalive_expiry))
+            self._client = AsyncOpenAI(base_url=self.base_url,
+                                       api_key=self.api_key,
+                                       http_client=http_client)
+            self._client_loop = loop
+
+        if timeout is None:
+            return self._client
+        # `with_options` shares the underlying connection pool
+        return self._client.with_options(timeout=timeout)
+
+    @asynccontextmanager
+    async def track(self):
+        """Count in-flight requests to measure connection pool saturation."""
+        self.inflight += 1
+        self.total_requests += 1
+        if self.inflight > self.max_connections:
+            # this request waits for a free connection
+            self.saturated_requests += 1
+        self.peak_inflight = max(self.peak_inflight, self.inflight)
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+
+    def pool_stats(self) -> Dict:
+        return {
+            'backend': self.name,
+            'http2': self.http2,
+            'max_connections': self.max_connections,
+            'inflight': self.inflight,
+            'peak_inflight': self.peak_inflight,
+            'total_requests': self.total_requests,
+            'saturated_requests': self.saturated_requests,
+            'saturation': self.inflight / max(1, self.max_connections),
+            'scheduler': self.scheduler.stats()
+        }
+
+    async def aclose(self):
+        """Close keep-alive connections."""
+        if self._client is None:
+            return
+        try:
+            await self._client.close()
+        except Exception as e:
+            logger.warning(f'close {self.name} client failed {e}')
+        self._client = None
+        self._client_loop = None
+
     def jsonify(self):
         return {"api_key": self.name, "model": self.model}
 
@@ -150,7 +175,18 @@ class LLM:
 
             for key, value in self.llm_config.items():
                 self.backends[key] = Backend(name=key, data=value)
-        self.cache = ChatCache()
+            cache_config = config.get('llm_cache', {})
+            router_config = config.get('llm_router', {})
+        self.cache = LLMCache(
+            file_path=cache_config.get('file_path', '.cache_llm_v2'),
+            max_memory_items=int(cache_config.get('max_memory_items', 4096)),
+            max_disk_items=int(cache_config.get('max_disk_items', 200000)),
+            ttl=float(cache_config.get('ttl', 7 * 24 * 3600)))
+        self.router = Router(
+            backends=self.backends,
+            enable=bool(router_config.get('enable', True)),
+            cooldown=float(router_config.get('cooldown', 60)),
+            hedge_delay=float(router_config.get('hedge_delay', 2.0)))
 
     def choose_model(self, backend: Backend, token_size: int) -> str:
         if backend.model != None and len(backend.model) > 0:
@@ -181,51 +217,23 @@ class LLM:
             model = backend2model[backend.name]
         return model
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=30, max=60),
-        retry=retry_if_exception_type(
-            (RateLimitError, APIConnectionError, Timeout, APITimeoutError)),
-    )
-    @limit_async_func_call(16)
-    async def chat(self,
-                   prompt: str,
-                   backend: str = 'default',
-                   system_prompt=None,
-                   history=[],
-                   allow_truncate=False,
-                   max_tokens=1024,
-                   timeout=600,
-                   enable_cache:bool=True) -> str:
-        
-        # choose backend
-        # if user not specify model, use first one
-        if backend == 'default':
-            backend = list(self.backends.keys())[0]
-        
-        if enable_cache:
-            r = self.cache.get(query=prompt, backend=backend)
-            if r is not None:
-                logger.info('LLM cache hit')
-                return r
-        
-        instance = self.backends[backend]
-
+    def _prepare(self, instance: Backend, prompt: str, system_prompt,
+                 history: List, allow_truncate: bool, max_tokens):
+        """Truncate prompt for `instance`, return request kwargs and input
+        token size."""
         # try truncate input prompt
-        input_tokens = encode_string(content=prompt)
-        input_token_size = len(input_tokens)
+        input_token_size = count_tokens(prompt)
         if input_token_size > instance.max_token_size:
             if not allow_truncate:
                 raise Exception(
                     f'input token size {input_token_size}, max {instance.max_token_size}'
                 )
 
+            input_tokens = encode_string(content=prompt)
             tokens = input_tokens[0:instance.max_token_size - input_token_size]
             prompt = decode_tokens(tokens=tokens)
             input_token_size = len(tokens)
 
-        await instance.tpm.wait(token_count=input_token_size)
-
         # build messages
         messages = []
         if system_prompt:
@@ -233,15 +241,8 @@ class LLM:
         messages.extend(history)
         messages.append({"role": "user", "content": prompt})
 
-        content = ''
-        # try:
         model = self.choose_model(backend=instance,
                                   token_size=input_token_size)
-        openai_async_client = AsyncOpenAI(base_url=instance.base_url,
-                                          api_key=instance.api_key,
-                                          timeout=timeout)
-        # response = await openai_async_client.chat.completions.create(model=model, messages=messages, max_tokens=8192, temperature=0.7, top_p=0.7, extra_body={'repetition_penalty': 1.05})
-
         kwargs = {
             "model": model,
             "messages": messages,
@@ -250,22 +251,66 @@ class LLM:
         }
         if max_tokens:
             kwargs['max_tokens'] = max_tokens
-
-        response = await openai_async_client.chat.completions.create(**kwargs)
-        if response.choices is None:
-            pass
+        return kwargs, input_token_size
+
+    def _prepare_candidates(self, names: List[str], prompt: str,
+                            system_prompt, history: List,
+                            allow_truncate: bool, max_tokens) -> List:
+        """`(instance, kwargs, input_token_size, cache_key)` of each backend
+        in `names`, skip backends the prompt is too long for."""
+        requests = []
+        for name in names:
+            instance = self.backends[name]
+            try:
+                kwargs, input_token_size = self._prepare(
+                    instance=instance,
+                    prompt=prompt,
+                    system_prompt=system_prompt,
+                    history=history,
+                    allow_truncate=allow_truncate,
+                    max_tokens=max_tokens)
+            except Exception as e:
+                # prompt too long for this backend, skip it
+                if len(names) == 1:
+                    raise e
+                logger.warning(f'skip backend {name}, {e}')
+                continue
+            cache_key = LLMCache.key(backend=name, **kwargs)
+            requests.append((instance, kwargs, input_token_size, cache_key))
+        if not requests:
+            raise Exception(f'no backend accepts this prompt, tried {names}')
+        return requests
+
+    async def _chat_once(self, instance: Backend, kwargs: Dict,
+                         input_token_size: int, cache_key: str, timeout,
+                         priority: Priority) -> str:
+        """Send one request to one backend."""
+        async with instance.scheduler.slot(priority):
+            # reserve input and expected output tokens before the call
+            await instance.rpm.wait()
+            reservation = await instance.tpm.acquire(
+                token_count=input_token_size + (kwargs.get('max_tokens') or 1024))
+            openai_async_client = instance.client(timeout=timeout)
+            start = time.time()
+            try:
+                async with instance.track():
+                    response = await openai_async_client.chat.completions.create(
+                        **kwargs)
+            except (Exception, asyncio.CancelledError) as e:
+                # cancelled hedge or failed call only costs the input
+                reservation.settle(input_token_size)
+                if isinstance(e, FAILOVER_ERRORS):
+                    self.router.record_failure(instance.name, e)
+                raise e
+        self.router.record_success(instance.name, time.time() - start)
         logger.info(response.choices[0].message.content)
 
         content = response.choices[0].message.content
-        self.cache.add(query=prompt, response=content, backend=backend)
-        
-        # except Exception as e:
-        #     logger.error( str(e) +' input len {}'.format(len(str(messages))))
-        #     raise e
-        content_token_size = len(encode_string(content=content))
+        self.cache.add(cache_key, response=content, backend=instance.name)
+        content_token_size = count_tokens(content)
 
         if False:
-            dump_json = {"messages": messages, "reply": content}
+            dump_json = {"messages": kwargs['messages'], "reply": content}
             dump_json_str = json.dumps(dump_json, ensure_ascii=False)
             with open('llm.jsonl', 'w') as f:
                 f.write(dump_json_str)
@@ -274,16 +319,98 @@ class LLM:
         self.sum_input_token_size += input_token_size
         self.sum_output_token_size += content_token_size
 
-        await instance.tpm.wait(token_count=content_token_size)
-        await instance.rpm.wait()
+        reservation.settle(input_token_size + content_token_size)
         return content
 
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=30, max=60),
-        retry=retry_if_exception_type(
-            (RateLimitError, APIConnectionError, Timeout, APITimeoutError)),
-    )
+    async def _hedged(self, primary, secondary, hedge_after: float):
+        """Start `secondary` if `primary` is still running after
+        `hedge_after` seconds, return the first success and cancel the
+        other."""
+        tasks = [asyncio.ensure_future(primary())]
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if done and tasks[0].exception() is None:
+            return tasks[0].result()
+        # slow or failed, ask the other backend
+        logger.info(f'send hedged request after {hedge_after}s')
+        tasks.append(asyncio.ensure_future(secondary()))
+
+        error = None
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def chat(self,
+                   prompt: str,
+                   backend: str = 'default',
+                   system_prompt=None,
+                   history=[],
+                   allow_truncate=False,
+                   max_tokens=1024,
+                   timeout=600,
+                   enable_cache:bool=True,
+                   priority: Priority = Priority.INTERACTIVE,
+                   hedge: bool = False) -> str:
+        """Chat with explicit `backend`, or route 'default' to the fastest
+        backend with budget left and fail over on rate limit or timeout.
+
+        `hedge` sends a duplicate request to the next backend if the first
+        one is slow, for latency critical stages. If every candidate fails,
+        the last rate limit or timeout error is raised without sleeping, the
+        router cools the backend down for the next call.
+        """
+        names = self.router.candidates(
+            backend, token_count=count_tokens(prompt))
+        requests = self._prepare_candidates(names=names,
+                                            prompt=prompt,
+                                            system_prompt=system_prompt,
+                                            history=history,
+                                            allow_truncate=allow_truncate,
+                                            max_tokens=max_tokens)
+        if enable_cache:
+            for _, _, _, cache_key in requests:
+                r = self.cache.get(cache_key)
+                if r is not None:
+                    logger.info('LLM cache hit')
+                    return r
+
+        def build(index: int):
+            instance, kwargs, input_token_size, cache_key = requests[index]
+            return lambda: self._chat_once(instance=instance,
+                                           kwargs=kwargs,
+                                           input_token_size=input_token_size,
+                                           cache_key=cache_key,
+                                           timeout=timeout,
+                                           priority=priority)
+
+        if hedge and len(requests) > 1:
+            try:
+                return await self._hedged(
+                    primary=build(0),
+                    secondary=build(1),
+                    hedge_after=self.router.hedge_after(names[0]))
+            except FAILOVER_ERRORS as e:
+                requests = requests[2:]
+                if not requests:
+                    raise e
+
+        for index in range(len(requests)):
+            try:
+                return await build(index)()
+            except FAILOVER_ERRORS as e:
+                if index == len(requests) - 1:
+                    raise e
+
     async def chat_stream(self,
                           prompt: str,
                           backend: str = 'default',
@@ -292,80 +419,67 @@ class LLM:
                           allow_truncate=False,
                           max_tokens=1024,
                           timeout=600,
-                          enable_cache:bool=True) -> AsyncGenerator[str, None]:
-    
-        if enable_cache:
-            r = self.cache.get(query=prompt, backend=backend)
-            if r is not None:
-                for char in r:
-                    yield char
-                return
-            
-        # choose backend
-        # if user not specify model, use first one
-        if backend == 'default':
-            backend = list(self.backends.keys())[0]
-        instance = self.backends[backend]
-
-        # try truncate input prompt
-        input_tokens = encode_string(content=prompt)
-        input_token_size = len(input_tokens)
-        if input_token_size > instance.max_token_size:
-            if not allow_truncate:
-                raise Exception(
-                    f'input token size {input_token_size}, max {instance.max_token_size}'
-                )
-
-            tokens = input_tokens[0:instance.max_token_size - input_token_size]
-            prompt = decode_tokens(tokens=tokens)
-            input_token_size = len(tokens)
-
-        await instance.tpm.wait(token_count=input_token_size)
-
-        # build messages
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        messages.extend(history)
-        messages.append({"role": "user", "content": prompt})
-
-        content = ''
-        try:
-            model = self.choose_model(backend=instance,
-                                      token_size=input_token_size)
-            openai_async_client = AsyncOpenAI(base_url=instance.base_url,
-                                              api_key=instance.api_key,
-                                              timeout=timeout)
-
-            print(messages)
-            stream = await openai_async_client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=0.7,
-                top_p=0.7,
-                max_tokens=max_tokens,
-                stream=True)
-
-            async for chunk in stream:
-                if chunk.choices is None:
-                    raise Exception(str(chunk))
-                delta = chunk.choices[0].delta
-                if delta.content:
-                    content += delta.content
-                    yield delta.content
-
-        except Exception as e:
-            logger.error(str(e) + ' input len {}'.format(len(str(messages))))
-            raise e
-        content_token_size = len(encode_string(content=content))
-        self.cache.add(query=prompt, response=content, backend=backend)
-
-        self.sum_input_token_size += input_token_size
-        self.sum_output_token_size += content_token_size
-
-        await instance.tpm.wait(token_count=content_token_size)
-        await instance.rpm.wait()
-        return
+                          enable_cache:bool=True,
+                          priority: Priority = Priority.INTERACTIVE) -> AsyncGenerator[str, None]:
+        """Stream version of `chat`, fail over only before the first token."""
+        names = self.router.candidates(
+            backend, token_count=count_tokens(prompt))
+        requests = self._prepare_candidates(names=names,
+                                            prompt=prompt,
+                                            system_prompt=system_prompt,
+                                            history=history,
+                                            allow_truncate=allow_truncate,
+                                            max_tokens=max_tokens)
+
+        for index, (instance, kwargs, input_token_size,
+                    cache_key) in enumerate(requests):
+            name = instance.name
+            # same key as `chat`, so both share cached answers
+            if enable_cache:
+                r = self.cache.get(cache_key)
+                if r is not None:
+                    for char in r:
+                        yield char
+                    return
+
+            content = ''
+            async with instance.scheduler.slot(priority):
+                await instance.rpm.wait()
+                reservation = await instance.tpm.acquire(
+                    token_count=input_token_size + (max_tokens or 1024))
+                start = time.time()
+                try:
+                    openai_async_client = instance.client(timeout=timeout)
+
+                    async with instance.track():
+                        stream = await openai_async_client.chat.completions.create(
+                            **kwargs, stream=True)
+
+                        async for chunk in stream:
+                            if chunk.choices is None:
+                                raise Exception(str(chunk))
+                            delta = chunk.choices[0].delta
+                            if delta.content:
+                                content += delta.content
+                                yield delta.content
+
+                except (Exception, asyncio.CancelledError) as e:
+                    logger.error(str(e) + ' input len {}'.format(len(str(kwargs['messages']))))
+                    reservation.settle(input_token_size)
+                    if isinstance(e, FAILOVER_ERRORS):
+                        self.router.record_failure(name, e)
+                        if not content and index < len(requests) - 1:
+                            continue
+                    raise e
+            self.router.record_success(name, time.time() - start)
+            content_token_size = count_tokens(content)
+            self.cache.add(cache_key, response=content, backend=name)
+
+            self.sum_input_token_size += input_token_size
+            self.sum_output_token_size += content_token_size
+
+            reservation.settle(input_token_size + content_token_size)
+            return
 
     def chat_sync(self,
                   prompt: str,
@@ -379,6 +493,23 @@ class LLM:
                       system_prompt=system_prompt,
                       history=history))
 
+    def cache_stats(self) -> Dict:
+        """Response cache hit/miss/latency counters."""
+        return self.cache.stats()
+
+    def router_stats(self) -> List[Dict]:
+        """Observed latency and failover count of every backend."""
+        return self.router.stats()
+
+    def pool_stats(self) -> List[Dict]:
+        """Connection pool metrics of every backend."""
+        return [instance.pool_stats() for instance in self.backends.values()]
+
+    async def aclose(self):
+        """Graceful shutdown, release keep-alive connections."""
+        for instance in self.backends.values():
+            await instance.aclose()
+
     def default_model_info(self):
         backend = list(self.backends.keys())[0]
         instance = self.backends[backend]
@@ -9,15 +9,22 @@ from loguru import logger
 from .chunk import Chunk
 from .embedder import Embedder
 from .limitter import RPM
+from .inference import InferencePool, HTTPSessionPool
 
 
 class Reranker:
+    """Rerank chunks, `arerank` runs off the event loop."""
 
     def __init__(self, model_config: dict, topn: int = 10):
 
         model_name_or_path = model_config['reranker_model_path']
         self._type = self.model_type(model_path=model_name_or_path)
         self.topn = topn
+        self.pool = InferencePool(
+            max_workers=int(model_config.get('inference_workers', 1)),
+            max_queue=int(model_config.get('inference_queue', 64)),
+            name='reranker')
+        self.http = HTTPSessionPool()
 
         if 'bge' in self._type:
             import torch
@@ -134,32 +141,47 @@ class Reranker:
                 pairs, show_progress_bar=False)
             scores = np.array(scores_list)
         else:
-            self.client['api_rpm'].wait(silent=True)
-
-            url = "https://api.siliconflow.cn/v1/rerank"
-            payload = {
-                "model": "netease-youdao/bce-reranker-base_v1",
-                "query": query,
-                "documents": texts,
-                "return_documents": False,
-                "max_chunks_per_doc": 832,
-                "overlap_tokens": 32
-            }
-            headers = {
-                "accept": "application/json",
-                "content-type": "application/json",
-                "authorization": self.client['api_token']
-            }
+            self.client['api_rpm'].wait_sync(silent=True)
+
+            url, payload, headers = self._remote_request(texts, query)
             response = requests.post(url, json=payload, headers=headers)
-            json_obj = json.loads(response.text)
-            results = json_obj['results']
-            indexes_list = [round(item['index']) for item in results]
-            indexes = np.array(indexes_list).astype(np.int32)
-            return indexes[0:self.topn]
+            return self._parse_remote(json.loads(response.text))
 
         # get descending order
         return scores.argsort()[::-1][0:self.topn]
 
+    def _remote_request(self, texts: List[str], query: str):
+        url = "https://api.siliconflow.cn/v1/rerank"
+        payload = {
+            "model": "netease-youdao/bce-reranker-base_v1",
+            "query": query,
+            "documents": texts,
+            "return_documents": False,
+            "max_chunks_per_doc": 832,
+            "overlap_tokens": 32
+        }
+        headers = {
+            "accept": "application/json",
+            "content-type": "application/json",
+            "authorization": self.client['api_token']
+        }
+        return url, payload, headers
+
+    def _parse_remote(self, json_obj: dict) -> np.array:
+        results = json_obj['results']
+        indexes_list = [round(item['index']) for item in results]
+        indexes = np.array(indexes_list).astype(np.int32)
+        return indexes[0:self.topn]
+
+    async def _asort(self, texts: List[str], query: str) -> np.array:
+        """Async `_sort`."""
+        if 'siliconcloud' in self._type:
+            await self.client['api_rpm'].wait(silent=True)
+            url, payload, headers = self._remote_request(texts, query)
+            json_obj = await self.http.post_json(url, payload, headers)
+            return self._parse_remote(json_obj)
+        return await self.pool.run(self._sort, texts, query)
+
     def rerank(self, query: str, chunks: List[Chunk]):
         """Rerank faiss search results."""
         if not chunks:
@@ -171,7 +193,13 @@ class Reranker:
 
         # During reranking, we just take image path as text
         indexes = self._sort(texts=texts, query=query)
-        if len(indexes) > 10:
-            import pdb
-            pdb.set_trace()
+        return [chunks[i] for i in indexes]
+
+    async def arerank(self, query: str, chunks: List[Chunk]):
+        """Async `rerank`."""
+        if not chunks:
+            return []
+
+        texts = [chunk.content_or_path for chunk in chunks]
+        indexes = await self._asort(texts=texts, query=query)
         return [chunks[i] for i in indexes]
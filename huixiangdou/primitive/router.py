@@ -0,0 +1,106 @@
+"""Route LLM requests across configured backends."""
+import time
+from typing import Dict, List
+
+from loguru import logger
+
+
+class BackendHealth:
+    """Observed latency and failures of one backend."""
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+        self.latency = None
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.success = 0
+        self.failover = 0
+
+    def record_success(self, seconds: float):
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency = self.alpha * seconds + (1 -
+                                                   self.alpha) * self.latency
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.success += 1
+
+    def record_failure(self, max_cooldown: float):
+        self.failures += 1
+        self.failover += 1
+        cooldown = min(max_cooldown, 2**self.failures)
+        self.cooldown_until = time.time() + cooldown
+
+    def cooling(self) -> bool:
+        return time.time() < self.cooldown_until
+
+
+class Router:
+    """Rank backends by expected completion time.
+
+    The estimate is EWMA latency scaled by scheduler load, plus the time the
+    RPM/TPM buckets need to admit this request. Backends never observed rank
+    first so each one gets measured, backends which just failed cool down and
+    rank last.
+    """
+
+    def __init__(self,
+                 backends: Dict,
+                 enable: bool = True,
+                 cooldown: float = 60,
+                 hedge_delay: float = 2.0):
+        self.backends = backends
+        self.enable = enable
+        self.cooldown = cooldown
+        self.hedge_delay = hedge_delay
+        self.health = {name: BackendHealth() for name in backends}
+
+    def expected_seconds(self, name: str, token_count: int) -> float:
+        instance = self.backends[name]
+        health = self.health[name]
+        latency = health.latency or 0.0
+        load = instance.scheduler.inflight / instance.scheduler.max_inflight
+        rpm_wait = max(0.0, 1 - instance.rpm.bucket.available()
+                       ) / instance.rpm.bucket.rate
+        tpm_wait = max(0.0, token_count - instance.tpm.bucket.available()
+                       ) / instance.tpm.bucket.rate
+        return latency * (1 + load) + max(rpm_wait, tpm_wait)
+
+    def candidates(self, backend: str, token_count: int = 0) -> List[str]:
+        """Backend names to try in order."""
+        if backend != 'default':
+            return [backend]
+        names = list(self.backends.keys())
+        if not self.enable or len(names) < 2:
+            return names[0:1]
+        return sorted(names,
+                      key=lambda name: (self.health[name].cooling(),
+                                        self.expected_seconds(
+                                            name, token_count)))
+
+    def hedge_after(self, name: str) -> float:
+        """Seconds to wait before sending a duplicate request."""
+        latency = self.health[name].latency
+        if latency is None:
+            return self.hedge_delay
+        return min(self.hedge_delay, max(0.5, 2 * latency))
+
+    def record_success(self, name: str, seconds: float):
+        self.health[name].record_success(seconds)
+
+    def record_failure(self, name: str, error: Exception):
+        logger.warning(f'backend {name} failed, cool down. {error}')
+        self.health[name].record_failure(max_cooldown=self.cooldown)
+
+    def stats(self) -> List[Dict]:
+        ret = []
+        for name, health in self.health.items():
+            ret.append({
+                'backend': name,
+                'latency': health.latency,
+                'success': health.success,
+                'failover': health.failover,
+                'cooling': health.cooling()
+            })
+        return ret
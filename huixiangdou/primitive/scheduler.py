@@ -0,0 +1,97 @@
+"""Priority concurrency scheduler for async LLM calls."""
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import Dict
+
+
+class Priority(IntEnum):
+    """Smaller value is served first."""
+    INTERACTIVE = 0  # user chat
+    BUILD = 1  # knowledge graph extraction
+    EVALUATION = 2  # offline scoring scripts
+
+
+class ConcurrencyScheduler:
+    """Limit in-flight calls to `max_inflight`.
+
+    Waiters sleep on a future instead of polling, and a released slot is handed
+    to the waiter with the highest priority (FIFO inside one priority). The
+    slot is always released in `finally`, so failed calls never leak it.
+    """
+
+    def __init__(self, max_inflight: int = 16, name: str = ''):
+        self.max_inflight = max(1, max_inflight)
+        self.name = name
+        self.inflight = 0
+        self.waiters = []
+        self.counter = itertools.count()
+
+        # metrics
+        self.peak_queue_depth = 0
+        self.served = {p.name: 0 for p in Priority}
+        self.wait_seconds = {p.name: 0.0 for p in Priority}
+
+    def queue_depth(self) -> Dict[str, int]:
+        depth = {p.name: 0 for p in Priority}
+        for priority, _, future in self.waiters:
+            if not future.done():
+                depth[Priority(priority).name] += 1
+        return depth
+
+    async def acquire(self, priority: Priority = Priority.INTERACTIVE):
+        priority = Priority(priority)
+        start = time.perf_counter()
+        if self.inflight < self.max_inflight and not self.waiters:
+            self.inflight += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            entry = (int(priority), next(self.counter), future)
+            heapq.heappush(self.waiters, entry)
+            self.peak_queue_depth = max(self.peak_queue_depth,
+                                        len(self.waiters))
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # slot was handed over right before cancel, pass it on
+                    self.release()
+                elif entry in self.waiters:
+                    self.waiters.remove(entry)
+                    heapq.heapify(self.waiters)
+                raise
+        self.served[priority.name] += 1
+        self.wait_seconds[priority.name] += time.perf_counter() - start
+
+    def release(self):
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                # hand the slot over, `inflight` stays the same
+                future.set_result(True)
+                return
+        self.inflight = max(0, self.inflight - 1)
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority = Priority.INTERACTIVE):
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict:
+        return {
+            'max_inflight': self.max_inflight,
+            'inflight': self.inflight,
+            'queue_depth': self.queue_depth(),
+            'peak_queue_depth': self.peak_queue_depth,
+            'served': dict(self.served),
+            'avg_wait_ms': {
+                k: 1000 * self.wait_seconds[k] / max(1, v)
+                for k, v in self.served.items()
+            }
+        }
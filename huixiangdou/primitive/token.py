@@ -1,7 +1,14 @@
 import tiktoken
 import re
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List
+from loguru import logger
 
 ENCODER = None
+# set when tiktoken can not load its BPE file, e.g. offline first use
+ENCODER_ERROR = None
 
 
 # modified from https://github.com/HKUDS/LightRAG
@@ -14,6 +21,127 @@ def encode_string(content: str, model_name: str = "gpt-4o"):
     return tokens
 
 
+def _get_encoder(model_name: str = "gpt-4o"):
+    """tiktoken encoder, None if it can not be loaded."""
+    global ENCODER, ENCODER_ERROR
+    if ENCODER is None and ENCODER_ERROR is None:
+        try:
+            encode_string(content='', model_name=model_name)
+        except Exception as e:
+            ENCODER_ERROR = e
+            logger.warning(
+                f'tiktoken unavailable, estimate token length by characters. {e}'
+            )
+    return ENCODER
+
+
+def encoder_available() -> bool:
+    """Whether token lengths are exact rather than estimated."""
+    return _get_encoder() is not None
+
+
+CJK_CHAR_PATTERN = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+
+
+def estimate_tokens(content: str) -> int:
+    """Rough token length without tiktoken, one token per CJK character and
+    per 4 other characters."""
+    cjk_count = len(CJK_CHAR_PATTERN.findall(content))
+    return cjk_count + (len(content) - cjk_count + 3) // 4
+
+
+class TokenCounter:
+    """Token length LRU keyed by content digest, so the same prompt, chunk or
+    entity description is encoded only once."""
+
+    def __init__(self, max_items: int = 65536):
+        self.max_items = max_items
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(content: str) -> bytes:
+        return hashlib.blake2b(content.encode('utf8'), digest_size=16).digest()
+
+    def lookup(self, key: bytes):
+        with self.lock:
+            count = self.cache.get(key)
+            if count is None:
+                self.misses += 1
+                return None
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return count
+
+    def remember(self, key: bytes, count: int):
+        with self.lock:
+            self.cache[key] = count
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_items:
+                self.cache.popitem(last=False)
+
+    def count(self, content: str) -> int:
+        key = self.digest(content)
+        count = self.lookup(key)
+        if count is None:
+            encoder = _get_encoder()
+            if encoder is None:
+                count = estimate_tokens(content)
+            else:
+                count = len(encoder.encode(content))
+            self.remember(key, count)
+        return count
+
+    def count_batch(self, contents: List[str], num_threads: int = 8) -> List[int]:
+        keys = [self.digest(c) for c in contents]
+        counts = [self.lookup(k) for k in keys]
+        miss_index = [i for i, c in enumerate(counts) if c is None]
+        if miss_index:
+            encoder = _get_encoder()
+            if encoder is None:
+                lengths = [estimate_tokens(contents[i]) for i in miss_index]
+            else:
+                # tiktoken encodes the batch on its own thread pool, GIL released
+                tokens_list = encoder.encode_batch(
+                    [contents[i] for i in miss_index], num_threads=num_threads)
+                lengths = [len(tokens) for tokens in tokens_list]
+            for i, length in zip(miss_index, lengths):
+                counts[i] = length
+                self.remember(keys[i], counts[i])
+        return counts
+
+    def prime(self, content: str, count: int):
+        """Register a precomputed length, e.g. loaded from ChunkSQL."""
+        self.remember(self.digest(content), count)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'items': len(self.cache)
+        }
+
+
+TOKEN_COUNTER = TokenCounter()
+
+
+def count_tokens(content: str) -> int:
+    """Cached `len(encode_string(content))`, estimated if tiktoken is
+    unavailable."""
+    return TOKEN_COUNTER.count(content)
+
+
+def count_tokens_batch(contents: List[str], num_threads: int = 8) -> List[int]:
+    """Token length of many strings, misses are encoded in one batch."""
+    return TOKEN_COUNTER.count_batch(contents, num_threads=num_threads)
+
+
+def prime_token_count(content: str, count: int):
+    TOKEN_COUNTER.prime(content, count)
+
+
 def decode_tokens(tokens: list[int], model_name: str = "gpt-4o"):
     global ENCODER
     if ENCODER is None:
@@ -418,6 +418,11 @@ def reinit_assistant():
                                     config_path=configpath)
     
 
+@app.on_event("shutdown")
+async def shutdown():
+    if assistant is not None:
+        await assistant.resource.llm.aclose()
+
 @app.post("/v2/add_files")
 async def add_files(file_list: List[str]):
     global workdir
@@ -5,7 +5,10 @@ from .helper import (ErrorCode, Queue, TaskCode, check_str_useful, histogram,
                      kimi_ocr, multimodal, parse_json_str, is_truth)
 from .retriever import SharedRetrieverPool, Retriever  # noqa E401
 from .retriever import RetrieveReply, Retriever, SharedRetrieverPool, InvertedRetriever, KnowledgeRetriever, WebRetriever, BM25Retriever, RetrieveResource
-from .sql import ChunkSQL, Entity2ChunkSQL
+from .sql import ChunkSQL, Entity2ChunkSQL, ExtractionSQL, DescriptionSQL
 from .graph_store import TuGraphStore, TuGraphConnector, GraphStore
-from .nlu import parse_chunk_to_knowledge
+from .nlu import (parse_chunk_to_knowledge, extract_chunk_knowledge,
+                  extract_packed_knowledge, merge_knowledge, pack_chunks,
+                  ChunkPacker, extraction_prompt_version, extraction_model,
+                  stage_knowledge, flush_knowledge)
 from .prompt import server_prompts
@@ -4,7 +4,7 @@ import pytoml
 import pdb
 from abc import ABC
 from typing import Any, Generator, Iterator, List, Optional, Tuple
-from ..primitive import Direction, Edge, MemoryGraph, Graph, Vertex
+from ..primitive import Direction, Edge, MemoryGraph, Graph, Vertex, FrozenGraph
 from loguru import logger
 """TuGraph Connector."""
 from typing import Dict, Generator, cast
@@ -277,6 +277,7 @@ class TuGraphStore(GraphStore):
     def _format_query_data(self, data, white_prop_list: List[str]):
         nodes_list = []
         rels_list: List[Any] = []
+        rel_keys = set()
         _white_list = white_prop_list
         from neo4j import graph
 
@@ -309,11 +310,8 @@ class TuGraphStore(GraphStore):
                 process_node(node)
             edge_properties = get_filtered_properties(rel._properties,
                                                       _white_list)
-            if not any(
-                    existing_edge.get("name") == name
-                    and existing_edge.get("src_id") == src_id
-                    and existing_edge.get("tgt_id") == tgt_id
-                    for existing_edge in rels_list):
+            if (name, src_id, tgt_id) not in rel_keys:
+                rel_keys.add((name, src_id, tgt_id))
                 rels_list.append({
                     "src_id": src_id,
                     "tgt_id": tgt_id,
@@ -528,10 +526,10 @@ class TuGraphStore(GraphStore):
         return schema
 
     def get_full_graph(self) -> Graph:
-        """Get full graph."""
-        inner_graph = self.query(f"MATCH (n)-[r]-(m) RETURN n,r,m",
-                                 white_list=["community_id"])
-        return inner_graph
+        """Get full graph as a read-only `FrozenGraph`."""
+        result = self.conn.run(query="MATCH (n)-[r]-(m) RETURN n,r,m")
+        graph = self._format_query_data(result, ["community_id"])
+        return FrozenGraph(vertices=graph["nodes"], edges=graph["edges"])
 
     def explore(
         self,
@@ -634,6 +632,94 @@ class TuGraphStore(GraphStore):
     async def edge_degree(self, sid: str, tid: str) -> int:
         return await self.node_degree(sid) + await self.node_degree(tid)
 
+    @staticmethod
+    def _unwind_literal(values: List[Any]) -> str:
+        """Cypher list literal of escaped ids or id pairs for `UNWIND`."""
+        return json.dumps(values, ensure_ascii=False)
+
+    def _direction_pattern(self, direction: Direction) -> str:
+        if direction == Direction.OUT:
+            return f"-[r:{self._edge_type}]->"
+        if direction == Direction.IN:
+            return f"<-[r:{self._edge_type}]-"
+        return f"-[r:{self._edge_type}]-"
+
+    def get_nodes(self, vids: List[str]) -> List[Optional[Vertex]]:
+        """Vertices of many ids with one query, None if not exist."""
+        vids = [escape_quotes(vid) for vid in vids]
+        if not vids:
+            return []
+        query = (f"UNWIND {self._unwind_literal(sorted(set(vids)))} AS vid "
+                 f"MATCH (n:{self._vertex_type}) WHERE n.id = vid RETURN n")
+        memory_graph = self.query(query)
+        return [memory_graph.get_node(vid=vid) for vid in vids]
+
+    async def node_degrees(self, vids: List[str]) -> List[int]:
+        """`node_degree` of many ids with one query."""
+        vids = [escape_quotes(vid) for vid in vids]
+        if not vids:
+            return []
+        query = (
+            f"UNWIND {self._unwind_literal(sorted(set(vids)))} AS vid "
+            f"MATCH (n:{self._vertex_type})-[r:{self._edge_type}]-(m:{self._vertex_type}) "
+            f"WHERE n.id = vid RETURN vid, count(r) AS degree")
+        degrees = {
+            record['vid']: record['degree']
+            for record in self.conn.run(query=query)
+        }
+        return [degrees.get(vid, 0) for vid in vids]
+
+    async def edge_degrees(self, pairs: List[Tuple[str, str]]) -> List[int]:
+        """`edge_degree` of many (sid, tid) with one query."""
+        degrees = await self.node_degrees([vid for p in pairs for vid in p])
+        return [
+            degrees[2 * i] + degrees[2 * i + 1] for i in range(len(pairs))
+        ]
+
+    async def get_neighbor_edges_many(
+        self,
+        vids: List[str],
+        direction: Direction = Direction.BOTH,
+        limit: Optional[int] = None,
+    ) -> List[List[Edge]]:
+        """`get_neighbor_edges` of many ids with one query, edges shared by
+        several ids are the same objects.
+
+        At most `limit` (256 by default, like `explore`) paths per id are
+        fetched, so hub entities do not pull every incident edge.
+        """
+        vids = [escape_quotes(vid) for vid in vids]
+        if not vids:
+            return []
+        if limit is None:
+            limit = 256
+        query = (
+            f"UNWIND {self._unwind_literal(sorted(set(vids)))} AS vid "
+            f"MATCH p=(n:{self._vertex_type}){self._direction_pattern(direction)}(m:{self._vertex_type}) "
+            f"WHERE n.id = vid WITH vid, collect(p)[..{int(limit)}] AS paths "
+            f"UNWIND paths AS p RETURN p")
+        memory_graph = self.query(query)
+        ret = []
+        for vid in vids:
+            edges = await memory_graph.get_neighbor_edges(vid=vid,
+                                                          direction=direction,
+                                                          limit=limit)
+            ret.append(list(edges))
+        return ret
+
+    def get_edges_many(
+            self, pairs: List[Tuple[str, str]]) -> List[Optional[set]]:
+        """`get_edge` of many (sid, tid) with one query."""
+        pairs = [(escape_quotes(sid), escape_quotes(tid)) for sid, tid in pairs]
+        if not pairs:
+            return []
+        query = (
+            f"UNWIND {self._unwind_literal(sorted(set(pairs)))} AS pair "
+            f"MATCH p=(n:{self._vertex_type})-[r:{self._edge_type}]-(m:{self._vertex_type}) "
+            f"WHERE n.id = pair[0] AND m.id = pair[1] RETURN p")
+        memory_graph = self.query(query)
+        return [memory_graph.get_edge(sid=sid, tid=tid) for sid, tid in pairs]
+
     def query(self, query: str, **args) -> MemoryGraph:
         """Execute a query on graph."""
         result = self.conn.run(query=query)
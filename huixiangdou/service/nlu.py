@@ -1,17 +1,22 @@
-from ..primitive import MemoryGraph, Chunk, Faiss, encode_string, judge_language, LLM
+from ..primitive import MemoryGraph, Chunk, Faiss, encode_string, count_tokens, judge_language, LLM, Priority
 from .prompt import graph_prompts as PROMPTS
 from .prompt import GRAPH_FIELD_SEP
 
-from typing import List, Any
+from typing import List, Any, Tuple, Dict
 from collections import defaultdict, Counter
 import asyncio
+import hashlib
+import json
 import re
 import html
 from loguru import logger
 from bs4 import BeautifulSoup
 from .graph_store import TuGraphStore
+from .sql import ExtractionSQL, DescriptionSQL
 
 entity_max_length = 64
+# merged descriptions longer than this are summarized by LLM
+SUMMARY_TOKENS = 500
 
 
 def is_float_regex(value):
@@ -48,7 +53,7 @@ def truncate_list_by_token_size(list_data: list, key: callable,
         return []
     tokens = 0
     for i, data in enumerate(list_data):
-        tokens += len(encode_string(key(data)))
+        tokens += count_tokens(key(data))
         if tokens > max_token_size:
             return list_data[:i]
     return list_data
@@ -141,10 +146,10 @@ async def _handle_entity_relation_summary(
     entity_or_relation_name: str,
     summary: str,
     llm: LLM,
+    max_tokens: int = SUMMARY_TOKENS,
 ) -> str:
     language = judge_language(text=summary)
-    tokens = encode_string(summary)
-    if len(tokens) < 500:  # No need for summary
+    if count_tokens(summary) < max_tokens:  # No need for summary
         return summary
     prompt_template = PROMPTS["summarize_entity"][language]
     context_base = dict(
@@ -153,7 +158,9 @@ async def _handle_entity_relation_summary(
     )
     use_prompt = prompt_template.format(**context_base)
     logger.debug(f"Trigger summary: {entity_or_relation_name}")
-    summary = await llm.chat(prompt=use_prompt, max_tokens=None)
+    summary = await llm.chat(prompt=use_prompt,
+                             max_tokens=None,
+                             priority=Priority.BUILD)
     return summary
 
 
@@ -162,6 +169,7 @@ async def _merge_nodes_then_upsert(
     nodes_data: list[dict],
     knowledge_graph_inst: MemoryGraph,
     llm: LLM,
+    summary_tokens: int = SUMMARY_TOKENS,
 ):
     already_entitiy_types = []
     already_source_ids = []
@@ -188,7 +196,7 @@ async def _merge_nodes_then_upsert(
     source_id = GRAPH_FIELD_SEP.join(
         set([dp["source_id"] for dp in nodes_data] + already_source_ids))
     description = await _handle_entity_relation_summary(
-        entity_name, description, llm)
+        entity_name, description, llm, summary_tokens)
     node_data = dict(
         entity_type=entity_type,
         description=description,
@@ -208,6 +216,7 @@ async def _merge_edges_then_upsert(
     edges_data: list[dict],
     knowledge_graph_inst: MemoryGraph,
     llm: LLM,
+    summary_tokens: int = SUMMARY_TOKENS,
 ):
     already_weights = []
     already_source_ids = []
@@ -249,7 +258,8 @@ async def _merge_edges_then_upsert(
                                                  "entity_type": '"UNKNOWN"',
                                              })
     description = await _handle_entity_relation_summary((src_id, tgt_id),
-                                                        description, llm)
+                                                        description, llm,
+                                                        summary_tokens)
     knowledge_graph_inst.upsert_edge(src_id,
                                      tgt_id,
                                      name=keywords,
@@ -269,104 +279,270 @@ async def _merge_edges_then_upsert(
     return edge_data
 
 
-# modified from LightRAG
-async def parse_chunk_to_knowledge(chunks: List[Chunk], llm: LLM,
-                                   entityDB: Faiss, relationDB: Faiss,
-                                   entityDB_mix: Faiss, relationDB_mix: Faiss,
-                                   graph_store: TuGraphStore) -> None:
-
-    graph = MemoryGraph()
-    entity_extract_prompt = PROMPTS["entity_extraction"]
-    context_base = dict(
+def _extraction_context():
+    return dict(
         tuple_delimiter=PROMPTS["DEFAULT_TUPLE_DELIMITER"],
         record_delimiter=PROMPTS["DEFAULT_RECORD_DELIMITER"],
         completion_delimiter=PROMPTS["DEFAULT_COMPLETION_DELIMITER"],
         entity_types=",".join(PROMPTS["DEFAULT_ENTITY_TYPES"]),
     )
+
+
+def extraction_prompt_version() -> str:
+    """Digest of every prompt the extraction output depends on, see
+    `ExtractionSQL`."""
+    keys = [
+        "entity_extraction", "entiti_continue_extraction",
+        "entiti_if_loop_extraction", "packed_extraction",
+        "DEFAULT_CHUNK_MARKER"
+    ]
+    prompts = dict(context=_extraction_context(),
+                   **{k: PROMPTS[k]
+                      for k in keys})
+    text = json.dumps(prompts, ensure_ascii=False, sort_keys=True)
+    return hashlib.md5(text.encode('utf8')).hexdigest()[0:16]
+
+
+def extraction_model(llm: LLM) -> str:
+    """Configured backends and models which may answer extraction."""
+    return ','.join(
+        sorted(f'{name}/{backend.model}'
+               for name, backend in llm.backends.items()))
+
+
+async def _ask_extraction(input_text: str, language: str,
+                          llm: LLM) -> List[str]:
+    """Extraction prompt plus gleaning, returns every LLM reply."""
+    entity_extract_prompt = PROMPTS["entity_extraction"]
     continue_prompt = PROMPTS["entiti_continue_extraction"]
     if_loop_prompt = PROMPTS["entiti_if_loop_extraction"]
 
-    already_processed = 0
-    already_entities = 0
-    already_relations = 0
+    hint_prompt = entity_extract_prompt[language].format(
+        **_extraction_context(), input_text=input_text)
+    final_result = await llm.chat(prompt=hint_prompt,
+                                  max_tokens=None,
+                                  priority=Priority.BUILD)
+    replies = [final_result]
+
+    history = pack_user_assistant_to_messages(
+        hint_prompt, final_result)  # 重复提取实体词，until LLM 判断为 finished
+    entity_extract_max_gleaning = 1
+
+    try:
+        for now_glean_index in range(entity_extract_max_gleaning):
+            glean_result = await llm.chat(prompt=continue_prompt[language],
+                                          history=history,
+                                          max_tokens=None,
+                                          priority=Priority.BUILD)
+            history += pack_user_assistant_to_messages(
+                continue_prompt[language], glean_result)
+            replies.append(glean_result)
+            if now_glean_index == entity_extract_max_gleaning - 1:
+                break
+
+            if_loop_result: str = await llm.chat(
+                prompt=if_loop_prompt[language],
+                history=history,
+                max_tokens=None,
+                priority=Priority.BUILD)
+            if_loop_result = if_loop_result.strip().strip('"').strip(
+                "'").lower()
+            if "yes" in if_loop_result:
+                break
+    except Exception as e:
+        logger.warning(e)
+    return replies
+
+
+def _split_records(text: str) -> List[List[str]]:
+    """Attributes of each `(...)` record in LLM reply."""
+    context_base = _extraction_context()
+    records = split_string_by_multi_markers(
+        text,
+        [
+            context_base["record_delimiter"],
+            context_base["completion_delimiter"]
+        ],
+    )
+    ret = []
+    for record in records:
+        record = re.search(r"\((.*)\)", record)
+        if record is None:
+            continue
+        ret.append(
+            split_string_by_multi_markers(record.group(1),
+                                          [context_base["tuple_delimiter"]]))
+    return ret
 
-    async def _process_single_content(chunk: Chunk):
-        nonlocal already_processed, already_entities, already_relations
-        content = chunk.content_or_path
-        language = judge_language(text=content)
-        hint_prompt = entity_extract_prompt[language].format(
-            **context_base, input_text=content)
-        final_result = await llm.chat(prompt=hint_prompt, max_tokens=None)
-
-        history = pack_user_assistant_to_messages(
-            hint_prompt, final_result)  # 重复提取实体词，until LLM 判断为 finished
-        entity_extract_max_gleaning = 1
-
-        try:
-            for now_glean_index in range(entity_extract_max_gleaning):
-                glean_result = await llm.chat(prompt=continue_prompt[language],
-                                              history=history,
-                                              max_tokens=None)
-                history += pack_user_assistant_to_messages(
-                    continue_prompt[language], glean_result)
-                final_result += glean_result
-                if now_glean_index == entity_extract_max_gleaning - 1:
-                    break
-
-                if_loop_result: str = await llm.chat(prompt=if_loop_prompt[language],
-                                                     history=history,
-                                                     max_tokens=None)
-                if_loop_result = if_loop_result.strip().strip('"').strip(
-                    "'").lower()
-                if "yes" in if_loop_result:
-                    break
-        except Exception as e:
-            logger.warning(e)
-
-        records = split_string_by_multi_markers(
-            final_result,
-            [
-                context_base["record_delimiter"],
-                context_base["completion_delimiter"]
-            ],
-        )
 
-        maybe_nodes = defaultdict(list)
-        maybe_edges = defaultdict(list)
-        for record in records:
-            record = re.search(r"\((.*)\)", record)
-            if record is None:
-                continue
-            record = record.group(1)
-            record_attributes = split_string_by_multi_markers(
-                record, [context_base["tuple_delimiter"]])
-            if_entities = await _handle_single_entity_extraction(
-                record_attributes, chunk._hash)
-            if if_entities is not None:
-                maybe_nodes[if_entities["entity_name"]].append(if_entities)
-                continue
+async def _collect_record(record_attributes: List[str], chunk_key: str,
+                          maybe_nodes: dict, maybe_edges: dict) -> bool:
+    if_entities = await _handle_single_entity_extraction(
+        record_attributes, chunk_key)
+    if if_entities is not None:
+        maybe_nodes[if_entities["entity_name"]].append(if_entities)
+        return True
 
-            if_relation = await _handle_single_relationship_extraction(
-                record_attributes, chunk._hash)
-            if if_relation is not None:
-                maybe_edges[(if_relation["src_id"],
-                             if_relation["tgt_id"])].append(if_relation)
-        already_processed += 1
-        already_entities += len(maybe_nodes)
-        already_relations += len(maybe_edges)
-        now_ticks = PROMPTS["process_tickers"][already_processed %
-                                               len(PROMPTS["process_tickers"])]
-        print(
-            f"{now_ticks} Processed {already_processed} chunks, {already_entities} entities(duplicated), {already_relations} relations(duplicated)\r",
-            end="",
-            flush=True,
-        )
-        return dict(maybe_nodes), dict(maybe_edges)
+    if_relation = await _handle_single_relationship_extraction(
+        record_attributes, chunk_key)
+    if if_relation is not None:
+        maybe_edges[(if_relation["src_id"],
+                     if_relation["tgt_id"])].append(if_relation)
+        return True
+    return False
 
-    # use_llm_func is wrapped in ascynio.Semaphore, limiting max_async callings
-    results = await asyncio.gather(
-        *[_process_single_content(c) for c in chunks])
-    print()  # clear the progress bar
+
+# modified from LightRAG
+async def extract_chunk_knowledge(chunk: Chunk,
+                                  llm: LLM) -> Tuple[dict, dict]:
+    """Ask LLM for entities and relations of one chunk.
+
+    Returns:
+        nodes by entity name and edges by (src, tgt), not merged yet.
+    """
+    content = chunk.content_or_path
+    language = judge_language(text=content)
+    replies = await _ask_extraction(input_text=content,
+                                    language=language,
+                                    llm=llm)
+
+    maybe_nodes = defaultdict(list)
+    maybe_edges = defaultdict(list)
+    for record_attributes in _split_records(''.join(replies)):
+        await _collect_record(record_attributes, chunk._hash, maybe_nodes,
+                              maybe_edges)
+    return dict(maybe_nodes), dict(maybe_edges)
+
+
+def pack_chunks(chunks: List[Chunk], max_tokens: int,
+                max_count: int) -> List[List[Chunk]]:
+    """Group chunks of the same language into packs for one extraction
+    prompt, each pack has at most `max_count` chunks and `max_tokens` content
+    tokens. A chunk larger than `max_tokens` stays alone."""
+    packer = ChunkPacker(max_tokens=max_tokens, max_count=max_count)
+    packs = []
+    for chunk in chunks:
+        packs += packer.add(chunk)
+    return packs + packer.flush()
+
+
+class ChunkPacker:
+    """Streaming version of `pack_chunks`, keeps one open pack per language."""
+
+    def __init__(self, max_tokens: int, max_count: int):
+        self.max_tokens = max_tokens
+        self.max_count = max(1, max_count)
+        self.pending = dict()
+
+    def add(self, chunk: Chunk) -> List[List[Chunk]]:
+        """Returns packs closed by this chunk."""
+        tokens = count_tokens(chunk.content_or_path)
+        if tokens >= self.max_tokens or self.max_count < 2:
+            return [[chunk]]
+
+        language = judge_language(text=chunk.content_or_path)
+        closed = []
+        pack, used = self.pending.get(language, ([], 0))
+        if pack and used + tokens > self.max_tokens:
+            closed.append(pack)
+            pack, used = [], 0
+        pack.append(chunk)
+        used += tokens
+        if len(pack) >= self.max_count:
+            closed.append(pack)
+            pack, used = [], 0
+        self.pending[language] = (pack, used)
+        return closed
+
+    def flush(self) -> List[List[Chunk]]:
+        packs = [pack for pack, _ in self.pending.values() if pack]
+        self.pending = dict()
+        return packs
+
+
+def _mentions(record_attributes: List[str], content: str) -> bool:
+    """Whether the entity or both relation ends of a record appear in
+    content."""
+    names = record_attributes[1:2]
+    if record_attributes[0].strip('"') == "relationship":
+        names = record_attributes[1:3]
+    names = [clean_str(n).strip('"').lower() for n in names]
+    content = content.lower()
+    return len(names) > 0 and all(n and n in content for n in names)
+
+
+async def extract_packed_knowledge(
+        chunks: List[Chunk], llm: LLM) -> Tuple[List[Tuple[dict, dict]], int]:
+    """Extract several chunks with one prompt, see `pack_chunks`.
+
+    Each chunk is prefixed with `DEFAULT_CHUNK_MARKER` and the LLM is asked
+    to repeat the marker before its records. Records outside any marker fall
+    back to the chunks mentioning their names.
+
+    Returns:
+        (nodes, edges) of each chunk and input tokens saved compared with
+        one prompt per chunk.
+    """
+    if len(chunks) < 2:
+        results = [await extract_chunk_knowledge(c, llm) for c in chunks]
+        return results, 0
+
+    marker = PROMPTS["DEFAULT_CHUNK_MARKER"]
+    language = judge_language(text=chunks[0].content_or_path)
+    packed_text = '\n'.join(
+        marker.format(i + 1) + '\n' + c.content_or_path
+        for i, c in enumerate(chunks))
+    input_text = PROMPTS["packed_extraction"][language].format(
+        chunk_count=len(chunks),
+        first_marker=marker.format(1),
+        second_marker=marker.format(2),
+        packed_text=packed_text)
+    replies = await _ask_extraction(input_text=input_text,
+                                    language=language,
+                                    llm=llm)
+
+    results = [(defaultdict(list), defaultdict(list)) for _ in chunks]
+    contents = [c.content_or_path.lower() for c in chunks]
+    marker_re = re.compile(re.escape(marker).replace(r'\{\}', r'\s*(\d+)\s*'))
+    for reply in replies:
+        # ['before any marker', '1', 'records of chunk 1', '2', ..]
+        pieces = marker_re.split(reply)
+        sections = [(-1, pieces[0])] + [(int(pieces[i]) - 1, pieces[i + 1])
+                                        for i in range(1, len(pieces), 2)]
+        for index, text in sections:
+            for record_attributes in _split_records(text):
+                if 0 <= index < len(chunks):
+                    targets = [index]
+                else:
+                    targets = [
+                        i for i, content in enumerate(contents)
+                        if _mentions(record_attributes, content)
+                    ] or list(range(len(chunks)))
+                for i in targets:
+                    await _collect_record(record_attributes, chunks[i]._hash,
+                                          results[i][0], results[i][1])
+
+    # unpacked mode sends the instruction block once per chunk and reply
+    static_tokens = count_tokens(PROMPTS["entity_extraction"][language].format(
+        **_extraction_context(), input_text=''))
+    packing_tokens = count_tokens(input_text) - sum(
+        count_tokens(c.content_or_path) for c in chunks)
+    saved = len(replies) * (
+        (len(chunks) - 1) * static_tokens - packing_tokens)
+    return [(dict(n), dict(e)) for n, e in results], saved
+
+
+async def merge_knowledge(results: List[Tuple[dict, dict]], llm: LLM,
+                          entityDB: Faiss, relationDB: Faiss,
+                          entityDB_mix: Faiss, relationDB_mix: Faiss,
+                          graph_store: TuGraphStore,
+                          summary_tokens: int = SUMMARY_TOKENS) -> bool:
+    """Merge extraction results of many chunks into graph and vector stores.
+
+    Returns:
+        False if nothing was extracted.
+    """
+    graph = MemoryGraph()
     maybe_nodes = defaultdict(list)
     maybe_edges = defaultdict(list)
     for m_nodes, m_edges in results:
@@ -376,21 +552,21 @@ async def parse_chunk_to_knowledge(chunks: List[Chunk], llm: LLM,
             maybe_edges[tuple(sorted(k))].extend(v)
 
     all_entities_data = await asyncio.gather(*[
-        _merge_nodes_then_upsert(k, v, graph, llm)
+        _merge_nodes_then_upsert(k, v, graph, llm, summary_tokens)
         for k, v in maybe_nodes.items()
     ])
     all_relationships_data = await asyncio.gather(*[
-        _merge_edges_then_upsert(k[0], k[1], v, graph, llm)
+        _merge_edges_then_upsert(k[0], k[1], v, graph, llm, summary_tokens)
         for k, v in maybe_edges.items()
     ])
     if not len(all_entities_data):
         logger.warning(
             "Didn't extract any entities, maybe your LLM is not working")
-        return None
+        return False
     if not len(all_relationships_data):
         logger.warning(
             "Didn't extract any relationships, maybe your LLM is not working")
-        return None
+        return False
 
     if entityDB is not None:
         for dp in all_entities_data:
@@ -426,4 +602,285 @@ async def parse_chunk_to_knowledge(chunks: List[Chunk], llm: LLM,
                       }))
 
     graph_store.insert_graph(graph=graph)
-    return
+    return True
+
+
+def stage_knowledge(results: List[Tuple[dict, dict]],
+                    descriptions: DescriptionSQL) -> bool:
+    """Merge extraction results of many chunks into `descriptions` without
+    calling LLM, `flush_knowledge` publishes them later.
+
+    Returns:
+        False if nothing was extracted.
+    """
+    entities = dict()
+    relations = dict()
+    for m_nodes, m_edges in results:
+        for name, records in m_nodes.items():
+            data = entities.setdefault(
+                name, dict(descriptions=[], source_ids=[],
+                           entity_types=Counter()))
+            for dp in records:
+                data["descriptions"].append(dp["description"])
+                data["source_ids"].append(dp["source_id"])
+                data["entity_types"][dp["entity_type"]] += 1
+        for k, records in m_edges.items():
+            key = json.dumps(sorted(k), ensure_ascii=False)
+            data = relations.setdefault(
+                key, dict(descriptions=[], source_ids=[], keywords=[],
+                          weight=0))
+            for dp in records:
+                data["descriptions"].append(dp["description"])
+                data["source_ids"].append(dp["source_id"])
+                data["keywords"].append(dp["keywords"])
+                data["weight"] += dp["weight"]
+
+    if not entities:
+        logger.warning(
+            "Didn't extract any entities, maybe your LLM is not working")
+        return False
+    descriptions.merge_many("entity", entities)
+    descriptions.merge_many("relation", relations)
+    return True
+
+
+def _summary_digest(name: Any, text: str, llm: LLM) -> str:
+    key = json.dumps(
+        [name, text, PROMPTS["summarize_entity"],
+         extraction_model(llm)],
+        ensure_ascii=False)
+    return hashlib.md5(key.encode('utf8')).hexdigest()
+
+
+async def _summarize_many(items: List[Tuple[Any, str]], llm: LLM,
+                          descriptions: DescriptionSQL,
+                          summary_tokens: int) -> List[str]:
+    """Summary of each (name, merged description), memoized in
+    `descriptions`."""
+    digests = [
+        _summary_digest(name, text, llm)
+        if count_tokens(text) >= summary_tokens else None
+        for name, text in items
+    ]
+    memo = descriptions.get_summaries([d for d in digests if d])
+
+    async def _summarize(name, text, digest):
+        if digest is None:
+            return text
+        if digest in memo:
+            return memo[digest]
+        return await _handle_entity_relation_summary(name, text, llm,
+                                                     summary_tokens)
+
+    summaries = await asyncio.gather(*[
+        _summarize(name, text, digest)
+        for (name, text), digest in zip(items, digests)
+    ])
+    descriptions.put_summaries({
+        digest: summary
+        for digest, summary in zip(digests, summaries)
+        if digest is not None and digest not in memo
+    })
+    return summaries
+
+
+async def flush_knowledge(llm: LLM,
+                          descriptions: DescriptionSQL,
+                          entityDB: Faiss,
+                          relationDB: Faiss,
+                          entityDB_mix: Faiss,
+                          relationDB_mix: Faiss,
+                          graph_store: TuGraphStore,
+                          summary_tokens: int = SUMMARY_TOKENS,
+                          limit: int = -1) -> Dict[str, List[Tuple[str, str]]]:
+    """Summarize and publish up to `limit` entities and relations changed
+    since the last flush into graph and vector stores.
+
+    Old vectors of republished rows are deleted. Callers save the vector
+    stores and then pass the result to `DescriptionSQL.mark_published`, a
+    crash in between only publishes the same rows again.
+
+    Returns:
+        published `(name, value)` of each kind, empty if nothing changed.
+    """
+    entities = descriptions.dirty("entity", limit=limit)
+    relations = descriptions.dirty("relation", limit=limit)
+    if not entities and not relations:
+        return dict()
+
+    relation_ids = [tuple(json.loads(key)) for key, _, _ in relations]
+    summaries = await _summarize_many(
+        [(name, GRAPH_FIELD_SEP.join(data["descriptions"]))
+         for name, data, _ in entities] +
+        [(ids, GRAPH_FIELD_SEP.join(data["descriptions"]))
+         for ids, (_, data, _) in zip(relation_ids, relations)], llm,
+        descriptions, summary_tokens)
+    entity_summaries = summaries[0:len(entities)]
+    relation_summaries = summaries[len(entities):]
+
+    graph = MemoryGraph()
+    published = dict(entity=[], relation=[])
+
+    def _upsert_entity(name: str, data: dict, description: str):
+        types = Counter(data.get("entity_types", {})).most_common(1)
+        graph.upsert_node(name=name,
+                          data=dict(entity_type=types[0][0]
+                                    if types else '"UNKNOWN"',
+                                    description=description,
+                                    source_id=GRAPH_FIELD_SEP.join(
+                                        data.get("source_ids", []))))
+        return graph.get_node(name).props["entity_type"]
+
+    for (name, data, old), description in zip(entities, entity_summaries):
+        entity_type = _upsert_entity(name, data, description)
+        if old is not None:
+            entityDB.delete(Chunk(content_or_path=name))
+            entityDB_mix.delete(Chunk(content_or_path=name + old))
+        entityDB_mix.upsert(
+            Chunk(content_or_path=name + description,
+                  metadata={
+                      "entity_name": name,
+                      "entity_type": entity_type
+                  }))
+        entityDB.upsert(
+            Chunk(content_or_path=name,
+                  metadata={
+                      "entity_name": name,
+                      "entity_type": entity_type,
+                      "description": description
+                  }))
+        published["entity"].append((name, description))
+
+    # keep endpoints published before, insert_graph would blank them
+    endpoints = set(i for ids in relation_ids for i in ids
+                    if i and not graph.has_node(i))
+    known = descriptions.get_many("entity", list(endpoints))
+    for (key, data, old), (src_id, tgt_id), description in zip(
+            relations, relation_ids, relation_summaries):
+        keywords = GRAPH_FIELD_SEP.join(data.get("keywords", []))
+        source_id = GRAPH_FIELD_SEP.join(data.get("source_ids", []))
+        for endpoint in [src_id, tgt_id]:
+            if not endpoint or len(endpoint) > entity_max_length:
+                continue
+            if graph.has_node(endpoint):
+                continue
+            if endpoint in known:
+                e_data, e_published = known[endpoint]
+                _upsert_entity(
+                    endpoint, e_data, e_published
+                    or GRAPH_FIELD_SEP.join(e_data["descriptions"]))
+            else:
+                graph.upsert_node(name=endpoint,
+                                  data={
+                                      "source_id": source_id,
+                                      "description": description,
+                                      "entity_type": '"UNKNOWN"',
+                                  })
+        graph.upsert_edge(src_id,
+                          tgt_id,
+                          name=keywords,
+                          data=dict(
+                              weight=data.get("weight", 0),
+                              description=description,
+                              keywords=keywords,
+                              source_id=source_id,
+                          ))
+        if old is not None:
+            old = json.loads(old)
+            # edges share keyword vectors, only drop the one of this edge
+            stored = relationDB.get(Chunk(content_or_path=old["keywords"]))
+            if stored is not None and (stored.metadata.get("src_id"),
+                                       stored.metadata.get("tgt_id")) == (
+                                           src_id, tgt_id):
+                relationDB.delete(stored)
+            relationDB_mix.delete(
+                Chunk(content_or_path=old["keywords"] + src_id + tgt_id +
+                      old["description"]))
+        relationDB_mix.upsert(
+            Chunk(content_or_path=keywords + src_id + tgt_id + description,
+                  metadata={
+                      "src_id": src_id,
+                      "tgt_id": tgt_id
+                  }))
+        relationDB.upsert(
+            Chunk(content_or_path=keywords,
+                  metadata={
+                      "src_id": src_id,
+                      "tgt_id": tgt_id,
+                      "description": description
+                  }))
+        published["relation"].append(
+            (key,
+             json.dumps(dict(keywords=keywords, description=description),
+                        ensure_ascii=False)))
+
+    graph_store.insert_graph(graph=graph)
+    return published
+
+
+async def parse_chunk_to_knowledge(chunks: List[Chunk],
+                                   llm: LLM,
+                                   entityDB: Faiss,
+                                   relationDB: Faiss,
+                                   entityDB_mix: Faiss,
+                                   relationDB_mix: Faiss,
+                                   graph_store: TuGraphStore,
+                                   pack_tokens: int = 0,
+                                   pack_size: int = 8,
+                                   artifacts: ExtractionSQL = None,
+                                   summary_tokens: int = SUMMARY_TOKENS) -> None:
+    """Extract all chunks concurrently, then merge them at once.
+
+    With `pack_tokens` > 0, small chunks are packed into one prompt, see
+    `pack_chunks`. Chunks already in `artifacts` skip LLM extraction, new
+    extractions are saved into it.
+    """
+    already_processed = 0
+    already_entities = 0
+    already_relations = 0
+    tokens_saved = 0
+
+    async def _process_pack(pack: List[Chunk]):
+        nonlocal already_processed, already_entities, already_relations, tokens_saved
+        results, saved = await extract_packed_knowledge(pack, llm)
+        if artifacts is not None:
+            artifacts.put_many(list(zip(pack, results)))
+        tokens_saved += saved
+        already_processed += len(pack)
+        for maybe_nodes, maybe_edges in results:
+            already_entities += len(maybe_nodes)
+            already_relations += len(maybe_edges)
+        now_ticks = PROMPTS["process_tickers"][already_processed %
+                                               len(PROMPTS["process_tickers"])]
+        print(
+            f"{now_ticks} Processed {already_processed} chunks, {already_entities} entities(duplicated), {already_relations} relations(duplicated)\r",
+            end="",
+            flush=True,
+        )
+        return results
+
+    cached = []
+    if artifacts is not None:
+        found = artifacts.get_many(chunks)
+        cached = [r for r in found if r is not None]
+        chunks = [c for c, r in zip(chunks, found) if r is None]
+    if pack_tokens > 0:
+        packs = pack_chunks(chunks, max_tokens=pack_tokens, max_count=pack_size)
+    else:
+        packs = [[c] for c in chunks]
+    # use_llm_func is wrapped in ascynio.Semaphore, limiting max_async callings
+    pack_results = await asyncio.gather(*[_process_pack(p) for p in packs])
+    print()  # clear the progress bar
+    if pack_tokens > 0:
+        logger.info(
+            f"packed {len(chunks)} chunks into {len(packs)} prompts, saved about {tokens_saved} input tokens"
+        )
+    results = cached + [r for rs in pack_results for r in rs]
+    await merge_knowledge(results=results,
+                          llm=llm,
+                          entityDB=entityDB,
+                          relationDB=relationDB,
+                          entityDB_mix=entityDB_mix,
+                          relationDB_mix=relationDB_mix,
+                          graph_store=graph_store,
+                          summary_tokens=summary_tokens)
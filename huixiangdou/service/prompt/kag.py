@@ -226,6 +226,19 @@ graph_prompts["entiti_if_loop_extraction"] = {
     "zh_cn": """看起来可能还是有一些实体被遗漏了。如果有还需要添加的实体，请回答 YES | NO。"""
 }
 
+graph_prompts["DEFAULT_CHUNK_MARKER"] = "<|CHUNK {}|>"
+
+graph_prompts["packed_extraction"] = {
+    "en":
+    """The text below holds {chunk_count} independent documents, each one starts with its own marker line such as {first_marker} or {second_marker}. Extract every document separately: output its marker line alone before the records of that document, and only relate entities that appear in the same document.
+
+{packed_text}""",
+    "zh_cn":
+    """下面的文本包含 {chunk_count} 篇相互独立的文档，每篇以单独一行的标记开头，例如 {first_marker}、{second_marker}。请逐篇分别提取：先单独输出该文档的标记行，再输出该文档的记录，只在同一篇文档内的实体之间建立关系。
+
+{packed_text}"""
+}
+
 graph_prompts["process_tickers"] = [
     "⠋", "⠙", "⠹", "⠸", "⠼", "⠴", "⠦", "⠧", "⠇", "⠏"
 ]
@@ -110,12 +110,7 @@ class Retriever(ABC):
         pass
 
     @staticmethod
-    def fuse(resource: RetrieveResource, query: Query,
-             replies: List[RetrieveReply]) -> RetrieveReply:
-        # rerank 重排倒排/bm25/web 等的结果，防止越过最大 token 限制
-        if len(replies) == 1:
-            return replies[0]
-
+    def _collect(replies: List[RetrieveReply]):
         chunks = []
         nodes = []
         relations = []
@@ -128,7 +123,16 @@ class Retriever(ABC):
             chunks += r.sources
             nodes += r.nodes
             relations += r.relations
+        return chunks, nodes, relations
+
+    @staticmethod
+    def fuse(resource: RetrieveResource, query: Query,
+             replies: List[RetrieveReply]) -> RetrieveReply:
+        # rerank 重排倒排/bm25/web 等的结果，防止越过最大 token 限制
+        if len(replies) == 1:
+            return replies[0]
 
+        chunks, nodes, relations = Retriever._collect(replies)
         rchunks = resource.reranker.rerank(query=query.text, chunks=chunks)
         rchunks = truncate_list_by_token_size(
             list_data=rchunks,
@@ -137,6 +141,23 @@ class Retriever(ABC):
         r = RetrieveReply(nodes=nodes, relations=relations, sources=rchunks)
         return r
 
+    @staticmethod
+    async def afuse(resource: RetrieveResource, query: Query,
+                    replies: List[RetrieveReply]) -> RetrieveReply:
+        """Async `fuse`, rerank runs off the event loop."""
+        if len(replies) == 1:
+            return replies[0]
+
+        chunks, nodes, relations = Retriever._collect(replies)
+        rchunks = await resource.reranker.arerank(query=query.text,
+                                                  chunks=chunks)
+        rchunks = truncate_list_by_token_size(
+            list_data=rchunks,
+            key=lambda x: x.content_or_path,
+            max_token_size=query.max_token_for_text_unit)
+        r = RetrieveReply(nodes=nodes, relations=relations, sources=rchunks)
+        return r
+
 
 # for reasoning
 class LogicNode:
@@ -177,7 +198,7 @@ def graph_elems_to_chunks(items: List[Tuple[Edge, Vertex]], chunkDB: ChunkSQL):
         chunk_ids += item.props.get('source_id').split(GRAPH_FIELD_SEP)
     unique_chunk_ids = list(set(chunk_ids))
 
-    chunks = [chunkDB.get(_hash=chunk_id) for chunk_id in unique_chunk_ids]
+    chunks = chunkDB.get_many(unique_chunk_ids)
     return chunks
 
 
@@ -241,9 +262,7 @@ class OpSession:
             for ids in target_chunk_ids.values():
                 chunk_ids |= ids
 
-            for chunk_id in chunk_ids:
-                c = chunkDB.get(_hash=chunk_id)
-                r.sources.append(c)
+            r.sources += chunkDB.get_many(list(chunk_ids))
         return r
 
 
@@ -1,4 +1,5 @@
 from ...primitive import Query, BM25Okapi
+from ..sql import ChunkSQL
 from .base import Retriever, RetrieveResource, RetrieveReply
 
 import os
@@ -13,7 +14,9 @@ class BM25Retriever(Retriever):
 
         db_code_path = os.path.join(work_dir, 'db_code')
         if os.path.exists(db_code_path):
-            self.bm25.load(db_code_path)
+            # index is memory-mapped, chunk bodies are read on demand
+            self.bm25.load(db_code_path,
+                           chunk_store=ChunkSQL(file_dir=db_code_path))
             self.inited = True
         else:
             self.inited = False
@@ -29,9 +32,8 @@ class BM25Retriever(Retriever):
         if type(query) is str:
             query = Query(text=query)
 
-        chunks = self.retriever.bm25.get_top_n(query=query.text)
+        chunks = self.bm25.get_top_n(query=query.text)
 
         for c in chunks:
-            r.text_units.append([c._hash, c.content_or_path])
             r.add_source(c)
         return r
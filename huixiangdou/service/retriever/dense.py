@@ -16,11 +16,12 @@ class DenseRetriever(Retriever):
 
     async def explore(self, query: Query) -> RetrieveReply:
         """Retrieve chunks by named entity."""
-        chunks = self.faiss.similarity_search(embedder=self.resource.embedder,
-                                              query=query)
+        chunks = await self.faiss.asimilarity_search(
+            embedder=self.resource.embedder, query=query)
         # (self, embedder: Embedder, query: Query, threshold: float = -1):
 
-        chunks = self.resource.reranker.rerank(query=query.text, chunks=chunks)
+        chunks = await self.resource.reranker.arerank(query=query.text,
+                                                      chunks=chunks)
         chunks = truncate_list_by_token_size(
             list_data=chunks,
             key=lambda x: x.content_or_path,
@@ -28,8 +28,9 @@ class InvertedRetriever(Retriever):
 
         r = RetrieveReply()
         if len(chunk_id_score_list) >= 1:
-            for chunk_id, ref_count in chunk_id_score_list:
-                c = self.chunkDB.get(_hash=chunk_id)
+            chunk_ids = [chunk_id for chunk_id, _ in chunk_id_score_list]
+            chunks = self.chunkDB.get_many(chunk_ids)
+            for chunk_id, c in zip(chunk_ids, chunks):
                 if c is None:
                     raise ValueError(f'{chunk_id} not exist')
                 r.add_source(c)
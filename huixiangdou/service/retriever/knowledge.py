@@ -22,9 +22,9 @@ class KnowledgeRetriever(Retriever):
         self.embedder = resource.embedder
         self.llm = resource.llm
         self.work_dir = work_dir
-        self.entityDB = Faiss.load_local(
+        self.entityDB = Faiss.load(
             os.path.join(work_dir, 'db_kag_entity_mix'))
-        self.relationDB = Faiss.load_local(
+        self.relationDB = Faiss.load(
             os.path.join(work_dir, 'db_kag_relation_mix'))
 
         # self.entityDB_mix = Faiss.load_local(os.path.join(work_dir, 'db_kag_entity_mix'))
@@ -96,19 +96,16 @@ class KnowledgeRetriever(Retriever):
             split_string_by_multi_markers(dp["source_id"], [GRAPH_FIELD_SEP])
             for dp in node_datas
         ]
-        edges = await asyncio.gather(*[
-            knowledge_graph_inst.get_neighbor_edges(dp["entity_name"])
-            for dp in node_datas
-        ])
+        edges = await knowledge_graph_inst.get_neighbor_edges_many(
+            [dp["entity_name"] for dp in node_datas])
         all_one_hop_nodes = set()
         for this_edges in edges:
             if not this_edges:
                 continue
             all_one_hop_nodes.update([e._tid for e in this_edges])
         all_one_hop_nodes = list(all_one_hop_nodes)
-        all_one_hop_nodes_data = [
-            knowledge_graph_inst.get_node(e) for e in all_one_hop_nodes
-        ]
+        all_one_hop_nodes_data = knowledge_graph_inst.get_nodes(
+            all_one_hop_nodes)
 
         all_one_hop_text_units_lookup = {
             k: set(
@@ -129,17 +126,20 @@ class KnowledgeRetriever(Retriever):
                             and c_id in all_one_hop_text_units_lookup[e._tid]):
                         relation_counts += 1
                 all_text_units_lookup[c_id] = {
-                    "data": text_chunks_db.get(_hash=c_id),
                     "order": index,
                     "relation_counts": relation_counts,
                 }
-        if any([v is None for v in all_text_units_lookup.values()]):
+        # fetch all chunks in one round-trip
+        chunk_ids = list(all_text_units_lookup.keys())
+        for c_id, chunk in zip(chunk_ids, text_chunks_db.get_many(chunk_ids)):
+            all_text_units_lookup[c_id]["data"] = chunk
+        if any([v["data"] is None for v in all_text_units_lookup.values()]):
             logger.warning(
                 "Text chunks are missing, maybe the storage is damaged")
         all_text_units = [{
             "id": k,
             **v
-        } for k, v in all_text_units_lookup.items() if v is not None]
+        } for k, v in all_text_units_lookup.items() if v["data"] is not None]
         all_text_units = sorted(all_text_units,
                                 key=lambda x:
                                 (x["order"], -x["relation_counts"]))
@@ -157,28 +157,25 @@ class KnowledgeRetriever(Retriever):
         query_param: Query,
         knowledge_graph_inst: MemoryGraph,
     ):
-        all_related_edges = await asyncio.gather(*[
-            knowledge_graph_inst.get_neighbor_edges(dp["entity_name"],
-                                                    direction=Direction.BOTH)
-            for dp in node_datas
-        ])
+        all_related_edges = await knowledge_graph_inst.get_neighbor_edges_many(
+            [dp["entity_name"] for dp in node_datas], direction=Direction.BOTH)
         all_edges = set()
         for this_edges in all_related_edges:
             for e in this_edges:
                 all_edges.add(e)
         all_edges = list(all_edges)
+        pairs = [(e._sid, e._tid) for e in all_edges]
+        all_edges_pack = knowledge_graph_inst.get_edges_many(pairs)
         all_edges_pack = [
-            knowledge_graph_inst.get_edge(e._sid, e._tid) for e in all_edges
+            next(iter(edge_data)) if edge_data else None
+            for edge_data in all_edges_pack
         ]
-        all_edges_pack = [list(edge_data)[0] for edge_data in all_edges_pack]
 
         # all_edges_pack = await asyncio.gather(
         #     *[knowledge_graph_inst.get_edge(e._sid, e._tid) for e in all_edges]
         # )
 
-        all_edges_degree = await asyncio.gather(*[
-            knowledge_graph_inst.edge_degree(e._sid, e._tid) for e in all_edges
-        ])
+        all_edges_degree = await knowledge_graph_inst.edge_degrees(pairs)
         all_edges_data = [{
             "src_tgt": k,
             "rank": d,
@@ -244,19 +241,14 @@ class KnowledgeRetriever(Retriever):
         if not chunks:
             return RetrieveReply()
 
-        node_datas = [
-            knowledge_graph_inst.get_node(c.metadata["entity_name"])
-            for c in chunks
-        ]
+        entity_names = [c.metadata["entity_name"] for c in chunks]
+        node_datas = knowledge_graph_inst.get_nodes(entity_names)
 
         if not all([n is not None for n in node_datas]):
             logger.warning(
                 "Some nodes are missing, maybe the storage is damaged")
 
-        node_degrees = await asyncio.gather(*[
-            knowledge_graph_inst.node_degree(c.metadata["entity_name"])
-            for c in chunks
-        ])
+        node_degrees = await knowledge_graph_inst.node_degrees(entity_names)
 
         node_datas = [{
             **n.props, "entity_name": k.metadata["entity_name"],
@@ -309,20 +301,15 @@ class KnowledgeRetriever(Retriever):
         for e in edge_datas:
             entity_names.add(e["src_id"])
             entity_names.add(e["tgt_id"])
+        entity_names = list(entity_names)
 
-        node_datas = [
-            knowledge_graph_inst.get_node(entity_name)
-            for entity_name in entity_names
-        ]
-
-        node_degrees = await asyncio.gather(*[
-            knowledge_graph_inst.node_degree(entity_name)
-            for entity_name in entity_names
-        ])
+        node_datas = knowledge_graph_inst.get_nodes(entity_names)
+        node_degrees = await knowledge_graph_inst.node_degrees(entity_names)
         node_datas = [{
             **n.props, "entity_name": k,
             "rank": d
-        } for k, n, d in zip(entity_names, node_datas, node_degrees)]
+        } for k, n, d in zip(entity_names, node_datas, node_degrees)
+                      if n is not None]
 
         node_datas = truncate_list_by_token_size(
             node_datas,
@@ -350,16 +337,19 @@ class KnowledgeRetriever(Retriever):
             for c_id in unit_list:
                 if c_id not in all_text_units_lookup:
                     all_text_units_lookup[c_id] = {
-                        "data": text_chunks_db.get(c_id),
                         "order": index,
                     }
-        if any([v is None for v in all_text_units_lookup.values()]):
+        # fetch all chunks in one round-trip
+        chunk_ids = list(all_text_units_lookup.keys())
+        for c_id, chunk in zip(chunk_ids, text_chunks_db.get_many(chunk_ids)):
+            all_text_units_lookup[c_id]["data"] = chunk
+        if any([v["data"] is None for v in all_text_units_lookup.values()]):
             logger.warning(
                 "Text chunks are missing, maybe the storage is damaged")
         all_text_units = [{
             "id": k,
             **v
-        } for k, v in all_text_units_lookup.items() if v is not None]
+        } for k, v in all_text_units_lookup.items() if v["data"] is not None]
         all_text_units = sorted(all_text_units, key=lambda x: x["order"])
         all_text_units = truncate_list_by_token_size(
             all_text_units,
@@ -376,10 +366,8 @@ class KnowledgeRetriever(Retriever):
         if not chunks:
             return RetrieveReply()
 
-        edge_datas = [
-            knowledge_graph_inst.get_edge(c.metadata["src_id"],
-                                          c.metadata["tgt_id"]) for c in chunks
-        ]
+        pairs = [(c.metadata["src_id"], c.metadata["tgt_id"]) for c in chunks]
+        edge_datas = knowledge_graph_inst.get_edges_many(pairs)
 
         # edge_datas = await asyncio.gather(
         #     *[knowledge_graph_inst.get_edge(r.metadata["src_id"], r.metadata["tgt_id"]) for r in results]
@@ -389,11 +377,11 @@ class KnowledgeRetriever(Retriever):
             logger.warning(
                 "Some edges are missing, maybe the storage is damaged")
 
-        edge_datas = [list(edge_data)[0] for edge_data in edge_datas]
-        edge_degree = await asyncio.gather(*[
-            knowledge_graph_inst.edge_degree(
-                c.metadata["src_id"], c.metadata["tgt_id"]) for c in chunks
-        ])
+        edge_datas = [
+            next(iter(edge_data)) if edge_data else None
+            for edge_data in edge_datas
+        ]
+        edge_degree = await knowledge_graph_inst.edge_degrees(pairs)
         edge_datas = [{
             "src_id": v.sid,
             "tgt_id": v.tid,
@@ -485,11 +473,20 @@ class KnowledgeRetriever(Retriever):
         low_level_context = RetrieveReply()
         high_level_context = RetrieveReply()
 
+        async def search(db, keywords: str):
+            if not keywords:
+                return []
+            return await db.asimilarity_search(embedder=self.embedder,
+                                               query=query,
+                                               threshold=self.DENSE_THRESHOLD)
+
+        # needed stores are searched concurrently with the same query embedding
+        entity_results, relation_results = await asyncio.gather(
+            search(self.entityDB, ll_keywords),
+            search(self.relationDB, hl_keywords))
+
         if ll_keywords:
-            results = self.entityDB.similarity_search(
-                embedder=self.embedder,
-                query=query,
-                threshold=self.DENSE_THRESHOLD)
+            results = entity_results
             if results:
                 chunks = [r[0] for r in results[0:self.LOWLEVEL_DENSE_TOPK]]
                 low_level_context = await self._build_local_query_context(
@@ -500,10 +497,7 @@ class KnowledgeRetriever(Retriever):
                     chunks=chunks)
 
         if hl_keywords:
-            results = self.relationDB.similarity_search(
-                embedder=self.embedder,
-                query=query,
-                threshold=self.DENSE_THRESHOLD)
+            results = relation_results
             if results:
                 chunks = [r[0] for r in results[0:self.HIGHLEVEL_DENSE_TOPK]]
                 high_level_context = await self._build_global_query_context(
@@ -526,15 +520,18 @@ class KnowledgeRetriever(Retriever):
 
         hl_keywords, ll_keywords = await self.decompose_to_keywords(query=query
                                                                     )
-
-        entity_pairs = self.entityDB.similarity_search(
-            self.embedder, query=Query(text=ll_keywords), threshold=0.0)
+        # both embeddings share one forward pass
+        entity_pairs, relation_pairs = await asyncio.gather(
+            self.entityDB.asimilarity_search(self.embedder,
+                                             query=Query(text=ll_keywords),
+                                             threshold=0.0),
+            self.relationDB.asimilarity_search(self.embedder,
+                                               query=Query(text=hl_keywords),
+                                               threshold=0.0))
         entity_max_score = 0.0
         if len(entity_pairs) > 0:
             entity_max_score = entity_pairs[0][1]
 
-        relation_pairs = self.relationDB.similarity_search(
-            self.embedder, query=Query(text=hl_keywords), threshold=0.0)
         relation_max_score = 0.0
         if len(relation_pairs) > 0:
             relation_max_score = relation_pairs[0][1]
@@ -8,6 +8,7 @@ from loguru import logger
 from typing import List
 from functools import partial
 from typing import Iterator
+import asyncio
 import pdb
 import json
 import os
@@ -19,17 +20,17 @@ class GraphExecutor(OpExecutor):
                  chunkDB: ChunkSQL):
         super().__init__(resource)
         self.DENSE_THRESHOLD = 0.2
-        self.entityDB = Faiss.load_local(
+        self.entityDB = Faiss.load(
             os.path.join(work_dir, 'db_kag_entity'))
-        self.relationDB = Faiss.load_local(
+        self.relationDB = Faiss.load(
             os.path.join(work_dir, 'db_kag_relation'))
         self.chunkDB = chunkDB
 
     def is_this_op(self, logic_node: LogicNode) -> bool:
         return isinstance(logic_node, GetSPONode)
 
-    def similar_entity(self, entity: str):
-        results = self.entityDB.similarity_search(
+    async def similar_entity(self, entity: str):
+        results = await self.entityDB.asimilarity_search(
             embedder=self.resource.embedder,
             query=Query(text=entity),
             threshold=self.DENSE_THRESHOLD)
@@ -38,8 +39,21 @@ class GraphExecutor(OpExecutor):
             return results[0][0].metadata['entity_name']
         raise Exception(f'similarity search entity fail {entity}')
 
-    def similar_relation(self, relation: str):
-        results = self.relationDB.similarity_search(
+    async def similar_entities(self, entities: List[str]) -> List[str]:
+        """Resolve all entity mentions with one search."""
+        batch = await self.entityDB.asimilarity_search_batch(
+            embedder=self.resource.embedder,
+            queries=[Query(text=entity) for entity in entities],
+            threshold=self.DENSE_THRESHOLD)
+        names = []
+        for entity, results in zip(entities, batch):
+            if not results:
+                raise Exception(f'similarity search entity fail {entity}')
+            names.append(results[0][0].metadata['entity_name'])
+        return names
+
+    async def similar_relation(self, relation: str):
+        results = await self.relationDB.asimilarity_search(
             embedder=self.resource.embedder,
             query=Query(text=relation),
             threshold=self.DENSE_THRESHOLD)
@@ -47,8 +61,8 @@ class GraphExecutor(OpExecutor):
             return results[0][0].content_or_path
         raise Exception(f'similarity search relation fail {relation}')
 
-    def filter_edges(self, keyword: str,
-                     edge_iter: Iterator[Edge]) -> List[Edge]:
+    async def filter_edges(self, keyword: str,
+                           edge_iter: Iterator[Edge]) -> List[Edge]:
         texts = []
         edges = []
         for edge in edge_iter:
@@ -60,13 +74,15 @@ class GraphExecutor(OpExecutor):
         if not texts:
             return []
 
-        rerank_indexes = self.resource.reranker._sort(texts=texts,
-                                                      query=keyword).tolist()
+        rerank_indexes, scores = await asyncio.gather(
+            self.resource.reranker._asort(texts=texts, query=keyword),
+            # one forward pass for keyword and all edges
+            self.resource.embedder.adistance_many(keyword, texts))
+        rerank_indexes = rerank_indexes.tolist()
         keep_edges = []
 
         for index in rerank_indexes:
-            score = self.resource.embedder.distance(keyword, texts[index])
-            if score < self.DENSE_THRESHOLD:
+            if scores[index] < self.DENSE_THRESHOLD:
                 break
             keep_edges.append(edges[index])
         return keep_edges
@@ -135,16 +151,15 @@ class GraphExecutor(OpExecutor):
         if s_entity and o_entity:
             # only relation
             # fetch subjective and objective and assign
-            s_sim = self.similar_entity(entity=s_entity)
-            o_sim = self.similar_entity(entity=o_entity)
+            s_sim, o_sim = await self.similar_entities([s_entity, o_entity])
             edge_iter = await graph.get_connections(sid=s_sim, tid=o_sim)
 
-            edges = self.filter_edges(keyword=p_type, edge_iter=edge_iter)
+            edges = await self.filter_edges(keyword=p_type, edge_iter=edge_iter)
             if not p_type:
                 upsert(alias=p_alias, refs=edges)
 
         if not s_entity and not o_entity and p_type:
-            rel_sim = self.similar_relation(relation=p_type)
+            rel_sim = await self.similar_relation(relation=p_type)
             if not rel_sim:
                 return None
 
@@ -162,10 +177,10 @@ class GraphExecutor(OpExecutor):
         elif o_entity:
             node_name = o_entity
 
-        node_sim = self.similar_entity(entity=node_name)
+        node_sim = await self.similar_entity(entity=node_name)
         edge_iter = await graph.get_neighbor_edges(vid=node_sim,
                                                    direction=Direction.BOTH)
-        edges = self.filter_edges(keyword=p_type, edge_iter=edge_iter)
+        edges = await self.filter_edges(keyword=p_type, edge_iter=edge_iter)
 
         # update params
         alias = s_alias if not s_entity else o_alias
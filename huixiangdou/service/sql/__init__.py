@@ -1,2 +1,4 @@
 from .chunk_sql import ChunkSQL
-from .entity2chunk_sql import Entity2ChunkSQL
\ No newline at end of file
+from .entity2chunk_sql import Entity2ChunkSQL
+from .extraction_sql import ExtractionSQL
+from .description_sql import DescriptionSQL
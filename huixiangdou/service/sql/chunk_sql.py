@@ -1,26 +1,65 @@
 import sqlite3
 import os
+import threading
+from collections import OrderedDict
 from dataclasses import asdict
-from ...primitive import Chunk
-from typing import List, Optional, Union
+from ...primitive import (Chunk, count_tokens_batch, prime_token_count,
+                          encoder_available, select_in)
+from typing import List, Optional, Set, Union
 import json
-from ...primitive import DB
+
 
 class ChunkSQL:
+    """Chunk storage on a persistent WAL-mode sqlite connection.
+
+    The connection is shared by threads under a lock, hot chunks are kept in
+    an in-memory LRU, and `get_many`/`exist_many` resolve a list of hashes
+    with batched `IN (...)` queries.
+    """
 
-    def __init__(self, file_dir: str):
+    def __init__(self, file_dir: str, max_cache_items: int = 4096):
         os.makedirs(file_dir, exist_ok=True)
         self.file_dir = file_dir
         self.file_name = os.path.join(self.file_dir, 'chunks.sql')
-        with DB(self.file_name) as db:
-            db.execute('''
-                CREATE TABLE IF NOT EXISTS chunks (
-                    _hash TEXT PRIMARY KEY,
-                    content TEXT,
-                    metadata TEXT,
-                    modal TEXT
-                )
-            ''')
+        self.max_cache_items = max_cache_items
+        self.cache = OrderedDict()
+        self.lock = threading.RLock()
+
+        self.conn = sqlite3.connect(self.file_name, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS chunks (
+                _hash TEXT PRIMARY KEY,
+                content TEXT,
+                metadata TEXT,
+                modal TEXT,
+                token_size INTEGER
+            )
+        ''')
+        # migrate tables created before `token_size`
+        columns = [
+            r[1] for r in self.conn.execute('PRAGMA table_info(chunks)')
+        ]
+        if 'token_size' not in columns:
+            self.conn.execute('ALTER TABLE chunks ADD COLUMN token_size INTEGER')
+        self.conn.commit()
+
+    def _remember(self, chunk: Chunk):
+        self.cache[chunk._hash] = chunk
+        self.cache.move_to_end(chunk._hash)
+        while len(self.cache) > self.max_cache_items:
+            self.cache.popitem(last=False)
+
+    @staticmethod
+    def _to_chunk(r) -> Chunk:
+        c = Chunk(_hash=r[0],
+                  content_or_path=r[1],
+                  metadata=json.loads(r[2]),
+                  modal=r[3])
+        if r[4] is not None:
+            prime_token_count(content=r[1], count=r[4])
+        return c
 
     def add(self, chunk: Union[List[Chunk], Chunk]):
         """Add a new chunk to the database."""
@@ -29,54 +68,91 @@ class ChunkSQL:
         else:
             chunks = chunk
 
-        with DB(self.file_name) as db:
-            for c in chunks:
-                db.execute(
-                    '''
-                    INSERT OR IGNORE INTO chunks (_hash, content, metadata, modal)
-                    VALUES (?, ?, ?, ?)
-                ''', (c._hash, c.content_or_path,
-                    json.dumps(c.metadata, ensure_ascii=False), c.modal))
+        # precompute token length, retrieval truncates without re-encoding.
+        # Left NULL if tiktoken is unavailable, estimates are never stored
+        if encoder_available():
+            token_sizes = count_tokens_batch(
+                [c.content_or_path for c in chunks])
+        else:
+            token_sizes = [None] * len(chunks)
+        rows = [(c._hash, c.content_or_path,
+                 json.dumps(c.metadata, ensure_ascii=False), c.modal,
+                 token_size) for c, token_size in zip(chunks, token_sizes)]
+        with self.lock:
+            self.conn.executemany(
+                '''
+                INSERT OR IGNORE INTO chunks (_hash, content, metadata, modal, token_size)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+            self.conn.commit()
 
     def get(self, _hash: str) -> Optional[Chunk]:
         """Retrieve a chunk by its ID."""
-        
-        with DB(self.file_name) as db:
-            db.execute(
-            'SELECT _hash, content, metadata, modal FROM chunks WHERE _hash = ?',
-            (_hash, ))
-            r = db.fetchone()
-            if r:
-                c = Chunk(_hash=r[0],
-                        content_or_path=r[1],
-                        metadata=json.loads(r[2]),
-                        modal=r[3])
-                return c
-        return None
+        return self.get_many([_hash])[0]
+
+    def get_many(self, hashes: List[str]) -> List[Optional[Chunk]]:
+        """Retrieve chunks by IDs, keep input order, None if not exist."""
+        found = dict()
+        with self.lock:
+            missing = []
+            for _hash in set(hashes):
+                if _hash in self.cache:
+                    self.cache.move_to_end(_hash)
+                    found[_hash] = self.cache[_hash]
+                else:
+                    missing.append(_hash)
+
+            for r in select_in(
+                    self.conn,
+                    'SELECT _hash, content, metadata, modal, token_size FROM chunks WHERE _hash IN ({})',
+                    missing):
+                c = self._to_chunk(r)
+                self._remember(c)
+                found[c._hash] = c
+        return [found.get(_hash) for _hash in hashes]
 
     def exist(self, chunk: Chunk) -> bool:
-        # hash `chunk.content_or_path` for faster `SELECT`
-        with DB(self.file_name) as db:
-            db.execute('SELECT count(*) FROM chunks WHERE _hash = ?',
-                            (chunk._hash, ))
-            r = db.fetchone()
-            try:
-                count = int(r[0])
-                if count > 0:
-                    return True
-                return False
-            except Exception as e:
-                raise RuntimeError(e)
-        return False
+        return chunk._hash in self.exist_many([chunk._hash])
+
+    def exist_many(self, hashes: List[str]) -> Set[str]:
+        """Return the subset of `hashes` already stored."""
+        existed = set()
+        with self.lock:
+            missing = []
+            for _hash in set(hashes):
+                if _hash in self.cache:
+                    existed.add(_hash)
+                else:
+                    missing.append(_hash)
+
+            rows = select_in(self.conn,
+                             'SELECT _hash FROM chunks WHERE _hash IN ({})',
+                             missing)
+            existed.update(r[0] for r in rows)
+        return existed
 
     def delete(self, _hash: str):
         """Delete a chunk by its ID."""
-        with DB(self.file_name) as db:
-            db.execute('DELETE FROM chunks WHERE _hash = ?', (_hash, ))
+        with self.lock:
+            self.cache.pop(_hash, None)
+            self.conn.execute('DELETE FROM chunks WHERE _hash = ?', (_hash, ))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
 
 # Example usage:
-# chunk_manager = ChunkSQLManager('path_to_your_database_directory')
+# chunk_manager = ChunkSQL('path_to_your_database_directory')
 # new_chunk = Chunk(content_or_path="Hello, world!", metadata={"source": "https://example.com"})
-# chunk_manager.add_chunk(new_chunk)
-# retrieved_chunk = chunk_manager.get_chunk(new_chunk._hash)
+# chunk_manager.add(new_chunk)
+# retrieved_chunk = chunk_manager.get(new_chunk._hash)
 # print(retrieved_chunk)
@@ -0,0 +1,154 @@
+import sqlite3
+import os
+import threading
+import json
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from ...primitive import select_in
+
+
+class DescriptionSQL:
+    """Merged descriptions of knowledge graph entities and relations.
+
+    Each checkpoint of a build merges extracted records here and marks them
+    dirty. A flush at the end summarizes and publishes only dirty rows into
+    graph and vector stores. LLM summaries are memoized by a digest of
+    their input and survive `clear`.
+
+    Row data is a dict with `descriptions`, `source_ids`, `entity_types`
+    (counts) for entities and `keywords`, `weight` for relations.
+    """
+
+    def __init__(self, file_dir: str):
+        os.makedirs(file_dir, exist_ok=True)
+        self.file_dir = file_dir
+        self.file_name = os.path.join(self.file_dir, 'description.sql')
+        self.lock = threading.RLock()
+
+        self.conn = sqlite3.connect(self.file_name, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS descriptions (
+                kind TEXT,
+                name TEXT,
+                data TEXT,
+                dirty INTEGER DEFAULT 1,
+                published TEXT,
+                PRIMARY KEY (kind, name)
+            )
+        ''')
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS descriptions_dirty ON descriptions (dirty)'
+        )
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS summaries (
+                digest TEXT PRIMARY KEY,
+                summary TEXT
+            )
+        ''')
+        self.conn.commit()
+
+    @staticmethod
+    def _merge(old: Optional[dict], new: dict) -> dict:
+        if old is None:
+            old = dict()
+        ret = dict()
+        for key in ['descriptions', 'source_ids', 'keywords']:
+            values = set(old.get(key, [])) | set(new.get(key, []))
+            if values:
+                ret[key] = sorted(values)
+        types = Counter(old.get('entity_types', {}))
+        types.update(new.get('entity_types', {}))
+        if types:
+            ret['entity_types'] = dict(types)
+        if 'weight' in old or 'weight' in new:
+            ret['weight'] = old.get('weight', 0) + new.get('weight', 0)
+        return ret
+
+    def _get(self, kind: str, names: List[str]) -> Dict[str, tuple]:
+        rows = select_in(
+            self.conn,
+            'SELECT name, data, published FROM descriptions WHERE kind = ? AND name IN ({})',
+            names,
+            params=[kind])
+        return {
+            name: (json.loads(data), published)
+            for name, data, published in rows
+        }
+
+    def merge_many(self, kind: str, items: Dict[str, dict]):
+        """Merge data of many names into their rows and mark them dirty."""
+        with self.lock:
+            found = self._get(kind, list(items.keys()))
+            rows = []
+            for name, data in items.items():
+                old, published = found.get(name, (None, None))
+                merged = self._merge(old, data)
+                if merged == old:
+                    continue
+                rows.append((kind, name, json.dumps(merged,
+                                                    ensure_ascii=False),
+                             published))
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO descriptions (kind, name, data, dirty, published) VALUES (?, ?, ?, 1, ?)',
+                rows)
+            self.conn.commit()
+
+    def dirty(self,
+              kind: str,
+              limit: int = -1) -> List[Tuple[str, dict, Optional[str]]]:
+        """(name, data, last published value) of changed rows."""
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT name, data, published FROM descriptions WHERE kind = ? AND dirty = 1 LIMIT ?',
+                (kind, limit)).fetchall()
+        return [(name, json.loads(data), published)
+                for name, data, published in rows]
+
+    def mark_published(self, kind: str, items: List[Tuple[str, str]]):
+        """Record what `(name, value)` pairs published and clear dirty."""
+        with self.lock:
+            self.conn.executemany(
+                'UPDATE descriptions SET dirty = 0, published = ? WHERE kind = ? AND name = ?',
+                [(value, kind, name) for name, value in items])
+            self.conn.commit()
+
+    def get_many(self, kind: str,
+                 names: List[str]) -> Dict[str, Tuple[dict, Optional[str]]]:
+        """(data, last published value) of existing names."""
+        with self.lock:
+            return self._get(kind, names)
+
+    def get_summaries(self, digests: List[str]) -> Dict[str, str]:
+        with self.lock:
+            return dict(
+                select_in(
+                    self.conn,
+                    'SELECT digest, summary FROM summaries WHERE digest IN ({})',
+                    digests))
+
+    def put_summaries(self, items: Dict[str, str]):
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO summaries (digest, summary) VALUES (?, ?)',
+                list(items.items()))
+            self.conn.commit()
+
+    def clear(self):
+        """Forget merged descriptions, keep memoized summaries."""
+        with self.lock:
+            self.conn.execute('DELETE FROM descriptions')
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
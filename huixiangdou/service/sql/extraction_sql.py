@@ -0,0 +1,122 @@
+import sqlite3
+import os
+import threading
+import time
+import json
+from typing import List, Optional, Tuple
+from loguru import logger
+from ...primitive import Chunk, EmbeddingStore, select_in
+
+
+class ExtractionSQL:
+    """Parsed LLM extraction of each chunk, keyed by (content digest, prompt
+    version, model).
+
+    Values are the `(nodes, edges)` returned by `extract_chunk_knowledge`
+    before merging, so a dropped graph and its faiss stores can be rebuilt
+    without asking LLM again. Changing the prompts or the model misses the
+    old rows instead of reusing them. Rows are keyed by the full content
+    digest, `Chunk._hash` is too short to be unique and is only stored.
+    """
+
+    def __init__(self, file_dir: str, prompt_version: str, model: str):
+        os.makedirs(file_dir, exist_ok=True)
+        self.file_dir = file_dir
+        self.file_name = os.path.join(self.file_dir, 'extraction.sql')
+        self.prompt_version = prompt_version
+        self.model = model
+        self.lock = threading.RLock()
+
+        self.conn = sqlite3.connect(self.file_name, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        columns = [
+            r[1] for r in self.conn.execute('PRAGMA table_info(extractions)')
+        ]
+        if columns and 'digest' not in columns:
+            # rows keyed by `_hash` alone may belong to another chunk
+            logger.warning(f'drop extractions keyed by chunk hash in {file_dir}')
+            self.conn.execute('DROP TABLE extractions')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS extractions (
+                digest TEXT,
+                prompt_version TEXT,
+                model TEXT,
+                _hash TEXT,
+                nodes TEXT,
+                edges TEXT,
+                created REAL,
+                PRIMARY KEY (digest, prompt_version, model)
+            )
+        ''')
+        self.conn.commit()
+
+    @staticmethod
+    def dumps(result: Tuple[dict, dict]) -> Tuple[str, str]:
+        nodes, edges = result
+        # json keys can not be tuples
+        edges = [[src, tgt, v] for (src, tgt), v in edges.items()]
+        return json.dumps(nodes, ensure_ascii=False), json.dumps(
+            edges, ensure_ascii=False)
+
+    @staticmethod
+    def loads(nodes: str, edges: str) -> Tuple[dict, dict]:
+        return json.loads(nodes), {(src, tgt): v
+                                   for src, tgt, v in json.loads(edges)}
+
+    def put_many(self, items: List[Tuple[Chunk, Tuple[dict, dict]]]):
+        """Save `(chunk, (nodes, edges))` pairs."""
+        now = time.time()
+        rows = [(EmbeddingStore.content_hash(c), self.prompt_version,
+                 self.model, c._hash, *self.dumps(result), now)
+                for c, result in items]
+        with self.lock:
+            self.conn.executemany(
+                '''
+                INSERT OR REPLACE INTO extractions (digest, prompt_version, model, _hash, nodes, edges, created)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            self.conn.commit()
+
+    def get_many(self,
+                 chunks: List[Chunk]) -> List[Optional[Tuple[dict, dict]]]:
+        """Extraction of each chunk, keep input order, None if not exist."""
+        digests = [EmbeddingStore.content_hash(c) for c in chunks]
+        with self.lock:
+            rows = select_in(
+                self.conn,
+                'SELECT digest, nodes, edges FROM extractions WHERE prompt_version = ? AND model = ? AND digest IN ({})',
+                digests,
+                params=[self.prompt_version, self.model])
+        found = {
+            digest: self.loads(nodes, edges)
+            for digest, nodes, edges in rows
+        }
+        return [found.get(digest) for digest in digests]
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute(
+                'SELECT COUNT(*) FROM extractions WHERE prompt_version = ? AND model = ?',
+                (self.prompt_version, self.model)).fetchone()[0]
+
+    def prune(self) -> int:
+        """Drop rows of other prompt versions or models, returns the count."""
+        with self.lock:
+            cursor = self.conn.execute(
+                'DELETE FROM extractions WHERE prompt_version != ? OR model != ?',
+                (self.prompt_version, self.model))
+            self.conn.commit()
+            return cursor.rowcount
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from huixiangdou.primitive import Embedder
+
+
+class FakeEncoder:
+    """Stands in for a local embedding model, features are character
+    counts."""
+
+    def __init__(self):
+        self.calls = []
+        self.count = 0
+
+    def encode(self, texts, **kwargs):
+        self.calls.append(list(texts))
+        self.count += len(texts)
+        return np.array([[len(t), t.count('a'), t.count('b')]
+                         for t in texts])
+
+
+@pytest.fixture
+def api_embedder():
+    """API embedder with a fake endpoint, patch `requests.post` to use it."""
+    return Embedder({
+        'embedding_model_path': 'https://fake',
+        'api_token': 'fake',
+        'api_rpm': 1000,
+        'api_tpm': 40000
+    })
+
+
+@pytest.fixture
+def fake_embedder(api_embedder):
+    """Embedder backed by `FakeEncoder`, no model weights or network."""
+    api_embedder._type = 'bce'
+    api_embedder.client = FakeEncoder()
+    return api_embedder
@@ -0,0 +1,92 @@
+import asyncio
+import os
+import shutil
+from types import SimpleNamespace
+
+from huixiangdou.pipeline.store import FeatureStore
+from huixiangdou.primitive import Faiss, FileName
+from huixiangdou.service import ChunkSQL
+
+
+class ExtractLLM:
+    """Answers each extraction prompt with one entity, counts the calls."""
+
+    def __init__(self):
+        self.extractions = 0
+        self.backends = dict()
+        self.sum_input_token_size = 0
+        self.sum_output_token_size = 0
+
+    async def chat(self, prompt: str, history=[], **kwargs):
+        if history:
+            # gleaning
+            return '<|COMPLETE|>'
+        self.extractions += 1
+        return f'("entity"<|>"Entity{self.extractions}"<|>"thing"<|>"entity number {self.extractions}")##<|COMPLETE|>'
+
+
+class FakeGraphStore:
+
+    def __init__(self):
+        self.inserted = []
+
+    def insert_graph(self, graph):
+        self.inserted.append(graph)
+
+    def drop(self):
+        self.inserted = []
+
+
+def build_store(work_dir: str, embedder) -> FeatureStore:
+    config_path = os.path.join(work_dir, 'config.ini')
+    with open(config_path, 'w', encoding='utf8') as f:
+        f.write('''
+[store]
+build_concurrency = 2
+build_merge_batch = 2
+''')
+    resource = SimpleNamespace(embedder=embedder,
+                               llm=ExtractLLM(),
+                               graph_store=FakeGraphStore(),
+                               config_path=config_path)
+    return FeatureStore(resource=resource,
+                        language='en',
+                        chunk_size=64,
+                        work_dir=os.path.join(work_dir, 'workdir'))
+
+
+def test_build_knowledge_resume(fake_embedder):
+    work_dir = '/tmp/test_build_knowledge'
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    files = []
+    for i in range(3):
+        with open(os.path.join(work_dir, f'doc{i}.md'), 'w') as f:
+            f.write(f'# doc {i}\n\n' + f'paragraph {i} of some text. ' * 8)
+        files.append(FileName(root=work_dir, filename=f'doc{i}.md', _type='md'))
+
+    store = build_store(work_dir, fake_embedder)
+    asyncio.run(store.build_knowledge(files))
+    chunk_count = store.llm.extractions
+    assert chunk_count > 3
+    # every extracted chunk is checkpointed and its entity published
+    chunkDB = ChunkSQL(os.path.join(store.work_dir, 'db_chunk'))
+    assert chunkDB.conn.execute(
+        'SELECT COUNT(*) FROM chunks').fetchone()[0] == chunk_count
+    entityDB = Faiss.load_local(os.path.join(store.work_dir, 'db_kag_entity'))
+    assert len(entityDB) == chunk_count
+    assert store.graph_store.inserted
+
+    # checkpointed chunks are skipped
+    store.llm.extractions = 0
+    asyncio.run(store.build_knowledge(files))
+    assert store.llm.extractions == 0
+
+    # without chunkDB, saved extractions are merged again without LLM
+    chunkDB.close()
+    shutil.rmtree(os.path.join(store.work_dir, 'db_chunk'))
+    asyncio.run(store.build_knowledge(files))
+    assert store.llm.extractions == 0
+    chunkDB = ChunkSQL(os.path.join(store.work_dir, 'db_chunk'))
+    assert chunkDB.conn.execute(
+        'SELECT COUNT(*) FROM chunks').fetchone()[0] == chunk_count
@@ -1,4 +1,6 @@
 from huixiangdou.primitive import BM25Okapi, Chunk
+import math
+import numpy as np
 import pdb
 
 
@@ -28,6 +30,78 @@ def test_bm25_load():
     print(res)
 
 
+def test_bm25_sparse_scores():
+    corpus = ['a b c', 'a a d', 'c d e f', 'g']
+    chunks = [Chunk(content_or_path=content) for content in corpus]
+    bm25 = BM25Okapi()
+    bm25.tokenizer = None
+    bm25.save(chunks, '/tmp/test_bm25_sparse')
+
+    # brute force
+    docs = [content.split(' ') for content in corpus]
+    avgdl = sum(len(d) for d in docs) / len(docs)
+    idf = dict()
+    for word in set(w for d in docs for w in d):
+        df = sum(word in d for d in docs)
+        idf[word] = math.log(len(docs) - df + 0.5) - math.log(df + 0.5)
+    average_idf = sum(idf.values()) / len(idf)
+    for word, value in idf.items():
+        if value < 0:
+            idf[word] = bm25.epsilon * average_idf
+
+    query = ['a', 'd', 'x']
+    expect = np.zeros(len(corpus))
+    for q in query:
+        for i, d in enumerate(docs):
+            tf = d.count(q)
+            norm = bm25.k1 * (1 - bm25.b + bm25.b * len(d) / avgdl)
+            expect[i] += idf.get(q, 0) * tf * (bm25.k1 + 1) / (tf + norm)
+    assert np.allclose(bm25.get_scores(query), expect, atol=1e-5)
+
+    doc_ids, scores = bm25.top_k(query, k=2)
+    assert list(doc_ids) == list(np.argsort(-expect)[:2])
+    assert math.isclose(scores[0], expect.max(), rel_tol=1e-5)
+    assert bm25.get_top_n(['x']) == []
+
+
+def test_bm25_mmap_format():
+    corpus = ['hello world', 'world peace', '你好 世界']
+    chunks = [Chunk(content_or_path=content) for content in corpus]
+    BM25Okapi().save(chunks, '/tmp/test_bm25_mmap')
+
+    bm25 = BM25Okapi()
+    bm25.load('/tmp/test_bm25_mmap', tokenizer=str.split)
+    assert isinstance(bm25.indices, np.memmap)
+    assert bm25._term_id('世界') is not None
+    assert bm25._term_id('missing') is None
+    # chunk bodies are read on demand
+    assert bm25.pending_chunks == []
+    res = bm25.get_top_n('peace', n=1)
+    assert res[0].content_or_path == 'world peace'
+
+
+def test_bm25_incremental():
+    corpus = ['a b c', 'a a d', 'c d e f', 'g h']
+    chunks = [Chunk(content_or_path=content) for content in corpus]
+
+    bm25 = BM25Okapi()
+    bm25.tokenizer = None
+    bm25.save(chunks[0:2], '/tmp/test_bm25_incremental')
+    bm25.append(chunks[1:])
+    bm25.delete([chunks[0]._hash])
+    bm25.flush()
+    assert bm25.num_docs == 3
+    assert list(bm25.lookup([chunks[0]._hash, chunks[3]._hash]))[0] == -1
+
+    expect = BM25Okapi()
+    expect.tokenizer = None
+    expect.save(chunks[1:], '/tmp/test_bm25_rebuild')
+    query = ['a', 'd', 'h']
+    assert np.allclose(np.sort(bm25.get_scores(query)),
+                       np.sort(expect.get_scores(query)),
+                       atol=1e-5)
+
+
 if __name__ == '__main__':
     test_bm25_dump()
     test_bm25_load()
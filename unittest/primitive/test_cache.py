@@ -0,0 +1,62 @@
+import os
+import time
+
+from huixiangdou.primitive import LLMCache
+
+
+def build_cache(**kwargs):
+    file_path = '/tmp/test_llm_cache.sql'
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(file_path + suffix):
+            os.remove(file_path + suffix)
+    return LLMCache(file_path=file_path, **kwargs)
+
+
+def test_key_covers_whole_request():
+    messages = [{'role': 'user', 'content': 'hi'}]
+    k0 = LLMCache.key(backend='kimi', model='a', messages=messages)
+    k1 = LLMCache.key(backend='kimi', model='b', messages=messages)
+    k2 = LLMCache.key(backend='kimi',
+                      model='a',
+                      messages=[{
+                          'role': 'system',
+                          'content': 'x'
+                      }] + messages)
+    k3 = LLMCache.key(messages=messages, model='a', backend='kimi')
+    assert len({k0, k1, k2}) == 3
+    assert k0 == k3
+    assert len(k0) == 64
+
+
+def test_memory_and_disk_tier():
+    cache = build_cache(max_memory_items=1)
+    cache.add('a', 'A', backend='kimi')
+    cache.add('b', 'B', backend='kimi')
+    assert cache.get('b') == 'B'
+    # evicted from LRU, served by sqlite
+    assert cache.get('a') == 'A'
+    assert cache.get('c') is None
+
+    stats = cache.stats()
+    assert stats['memory_hits'] == 1
+    assert stats['disk_hits'] == 1
+    assert stats['misses'] == 1
+    cache.close()
+
+    # persistent
+    cache = LLMCache(file_path='/tmp/test_llm_cache.sql')
+    assert cache.get('b') == 'B'
+
+
+def test_eviction():
+    cache = build_cache(ttl=0.05, max_disk_items=2, evict_interval=1)
+    cache.add('a', 'A', backend='kimi')
+    time.sleep(0.1)
+    assert cache.get('a') is None
+
+    cache = build_cache(max_disk_items=2, evict_interval=1)
+    for key in ['a', 'b', 'c']:
+        cache.add(key, key.upper(), backend='kimi')
+        time.sleep(0.01)
+    count = cache.conn.execute('SELECT count(*) FROM chat').fetchone()[0]
+    assert count == 2
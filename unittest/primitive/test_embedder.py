@@ -1,6 +1,12 @@
+import asyncio
+import json
 import pdb
+import time
+from unittest.mock import patch
 
-from huixiangdou.primitive import Embedder
+import numpy as np
+
+from huixiangdou.primitive import Chunk, Embedder
 
 
 def test_embedder():
@@ -21,5 +27,81 @@ def test_embedder():
     assert sim2.item() >= 0.4
 
 
+def test_embedder_cache_and_batch(fake_embedder):
+    emb = fake_embedder
+
+    assert emb.embed_query(text='abc').shape == (1, 3)
+    emb.embed_query(text='abc')
+    assert emb.client.calls == [['abc']]
+
+    distances = emb.distance_many('abc', ['abc', 'aaaa', 'aaaa'])
+    assert emb.client.calls[-1] == ['aaaa']
+    assert np.allclose(distances, [0, np.sqrt(11), np.sqrt(11)])
+
+    async def concurrent():
+        return await asyncio.gather(
+            *[emb.aembed_query(text=t) for t in ['x', 'yy', 'zzz']])
+
+    features = asyncio.run(concurrent())
+    assert emb.client.calls[-1] == ['x', 'yy', 'zzz']
+    assert [f[0][0] for f in features] == [1, 2, 3]
+
+
+def test_embedder_not_block_loop(fake_embedder):
+    emb = fake_embedder
+    slow_encode = emb.client.encode
+
+    def encode(texts, **kwargs):
+        time.sleep(0.3)
+        return slow_encode(texts, **kwargs)
+
+    emb.client.encode = encode
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.ensure_future(ticker())
+        distances = await emb.adistance_many('abc', ['abc', 'aaaa'])
+        task.cancel()
+        return ticks, distances
+
+    ticks, distances = asyncio.run(main())
+    assert ticks > 10
+    assert np.allclose(distances, [0, np.sqrt(11)])
+
+
+class FakeResponse:
+
+    def __init__(self, texts):
+        data = [{
+            'index': i,
+            'embedding': [len(t)]
+        } for i, t in enumerate(texts)]
+        # API may return items out of order
+        self.text = json.dumps({'data': data[::-1]})
+
+
+def test_embedder_batch_sort_by_length(api_embedder):
+    emb = api_embedder
+    batches = []
+
+    def post(url, json, headers):
+        batches.append(json['input'])
+        return FakeResponse(json['input'])
+
+    texts = ['a', 'abcd', 'ab', 'abcde', 'abc']
+    with patch('requests.post', side_effect=post):
+        features = emb.embed_query_batch_text(
+            chunks=[Chunk(content_or_path=t) for t in texts], batch_size=2)
+    assert features.reshape(-1).tolist() == [1, 4, 2, 5, 3]
+    assert batches == [['abcde', 'abcd'], ['abc', 'ab'], ['a']]
+
+
 if __name__ == '__main__':
     test_embedder()
@@ -0,0 +1,43 @@
+import shutil
+
+import numpy as np
+
+from huixiangdou.primitive import Chunk, EmbeddingStore, Faiss
+
+
+def test_embedding_store():
+    work_dir = '/tmp/test_embedding_store'
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    store = EmbeddingStore(work_dir, model_id='bce@fake')
+    keys = [EmbeddingStore.content_hash(Chunk(content_or_path=t))
+            for t in ['a', 'b', 'c']]
+    store.put_many(keys[0:2], np.array([[1, 2], [3, 4]]))
+    store.put_many(keys[1:3], np.array([[0, 0], [5, 6]]))
+    store.close()
+
+    store = EmbeddingStore(work_dir, model_id='bce@fake')
+    assert len(store) == 3
+    features = store.get_many(keys + ['missing'])
+    assert features[1].tolist() == [3, 4]
+    assert features[2].tolist() == [5, 6]
+    assert features[3] is None
+
+    other = EmbeddingStore(work_dir, model_id='bge@fake')
+    assert other.get_many(keys) == [None] * 3
+
+
+def test_save_local_reuse_embedding(fake_embedder):
+    work_dir = '/tmp/test_embedding_reuse'
+    shutil.rmtree(work_dir, ignore_errors=True)
+    emb = fake_embedder
+    emb.use_store(work_dir + '/db_embedding')
+
+    chunks = [Chunk(content_or_path='a' * i) for i in range(1, 20)]
+    Faiss.save_local(work_dir + '/db1', chunks=chunks, embedder=emb)
+    assert emb.client.count == len(chunks)
+
+    chunks.append(Chunk(content_or_path='new'))
+    Faiss.save_local(work_dir + '/db2', chunks=chunks, embedder=emb)
+    assert emb.client.count == len(chunks)
+    assert Faiss.load_local(work_dir + '/db2').index.ntotal == len(chunks)
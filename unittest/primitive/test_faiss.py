@@ -1,7 +1,15 @@
+import json
 import os
 import pdb
+import pickle
+import shutil
 
-from huixiangdou.primitive import Chunk, Embedder, Faiss, Query
+import faiss
+import numpy as np
+
+from huixiangdou.primitive import Chunk, DistanceStrategy, Embedder, Faiss, Query
+# `Chunk` below is a test double without content hashing
+from huixiangdou.primitive import Chunk as HashedChunk
 import random
 from dataclasses import dataclass, field
 import uuid
@@ -46,7 +54,7 @@ def test_faiss():
     embedder = Embedder(model_config)
 
     Faiss.save_local(folder_path=save_path, chunks=chunks, embedder=embedder)
-    assert os.path.exists(os.path.join(save_path, 'embedding.faiss'))
+    assert os.path.exists(os.path.join(save_path, 'meta.json'))
 
     g = Faiss.load_local(save_path)
     for idx, c in enumerate(g.chunks):
@@ -67,5 +75,208 @@ def test_faiss():
     assert score >= 0.9999
 
 
+def test_faiss_index_types():
+    features = np.random.default_rng(0).standard_normal(
+        (2000, 32)).astype(np.float32)
+    assert Faiss.choose_index_type(1000, 768, 2 << 30) == 'flat'
+    assert Faiss.choose_index_type(200000, 768, 2 << 30) == 'hnsw'
+    assert Faiss.choose_index_type(5000000, 768, 2 << 30) == 'opq'
+
+    for index_type in ['flat', 'hnsw', 'ivf_flat', 'ivf_pq']:
+        index = Faiss.build_index(features,
+                                  DistanceStrategy.EUCLIDEAN_DISTANCE,
+                                  index_type=index_type)
+        index.add(features)
+        report = Faiss.benchmark_index(index, features,
+                                       DistanceStrategy.EUCLIDEAN_DISTANCE)
+        assert report['runs']
+        if index_type in ['flat', 'hnsw']:
+            assert report['runs'][-1]['recall'] >= 0.95
+
+    # search params override the default per query
+    params = Faiss.search_params(index, nprobe=index.nlist)
+    _, exact = index.search(features[0:1], 5, params=params)
+    assert exact[0][0] == 0
+
+
+def test_faiss_search_batch():
+    features = np.random.default_rng(0).standard_normal(
+        (100, 16)).astype(np.float32)
+    chunks = [
+        Chunk(content_or_path=str(i), metadata={}, modal='text')
+        for i in range(100)
+    ]
+    index = Faiss.build_index(features,
+                              DistanceStrategy.EUCLIDEAN_DISTANCE,
+                              index_type='flat')
+    index.add(features)
+    g = Faiss(index=index, chunks=chunks, k=5)
+
+    batch = g.search_batch(features[0:3])
+    assert len(batch) == 3
+    for i, pairs in enumerate(batch):
+        assert pairs[0][0].content_or_path == str(i)
+        assert pairs == g.search(features[i:i + 1])
+        scores = [score for _, score in pairs]
+        assert scores == sorted(scores, reverse=True)
+
+
+def test_faiss_incremental(fake_embedder):
+    work_dir = '/tmp/test_faiss_incremental'
+    shutil.rmtree(work_dir, ignore_errors=True)
+    emb = fake_embedder
+
+    g = Faiss()
+    for i in range(1, 50):
+        g.upsert(HashedChunk(content_or_path='a' * i))
+    g.save(work_dir, emb)
+    assert emb.client.count == 49
+
+    # only new chunks are embedded, into a delta segment
+    g = Faiss.load_local(work_dir)
+    g.upsert(HashedChunk(content_or_path='a' * 10))
+    g.upsert(HashedChunk(content_or_path='b' * 5))
+    assert g.delete(HashedChunk(content_or_path='a' * 3))
+    g.save(work_dir, emb)
+    assert emb.client.count == 50
+    assert len(g.segments) == 2
+
+    g = Faiss.load_local(work_dir)
+    assert len(g.chunks) == 49
+    assert g.tombstones
+    query = emb.embed_query(text='aaa')
+    pairs = g.search(query)
+    assert all(c.content_or_path != 'aaa' for c, _ in pairs)
+    assert pairs[0][0].content_or_path in ('aa', 'aaaa')
+    pairs = g.search(emb.embed_query(text='bbbbb'))
+    assert pairs[0][0].content_or_path == 'bbbbb'
+    assert pairs[0][1] >= 0.9999
+
+    # legacy pickle folder loads and migrates on save
+    legacy_dir = work_dir + '_legacy'
+    shutil.rmtree(legacy_dir, ignore_errors=True)
+    os.makedirs(legacy_dir)
+    chunks = [HashedChunk(content_or_path='a' * i) for i in range(1, 10)]
+    features = np.vstack([emb.embed_query(text=c.content_or_path)
+                          for c in chunks]).astype(np.float32)
+    index = faiss.IndexFlatL2(features.shape[1])
+    index.add(features)
+    faiss.write_index(index, os.path.join(legacy_dir, 'embedding.faiss'))
+    with open(os.path.join(legacy_dir, 'chunks_and_strategy.pkl'), 'wb') as f:
+        pickle.dump({'chunks': chunks, 'strategy': str(emb.distance_strategy)}, f)
+
+    g = Faiss.load_local(legacy_dir)
+    assert g.search(features[4:5])[0][0].content_or_path == 'a' * 5
+    g.upsert(HashedChunk(content_or_path='b'))
+    g.save(legacy_dir, emb)
+    assert not os.path.exists(os.path.join(legacy_dir, 'chunks_and_strategy.pkl'))
+    g = Faiss.load_local(legacy_dir)
+    assert len(g.chunks) == 10
+    assert g.search(features[4:5])[0][0].content_or_path == 'a' * 5
+
+
+def test_faiss_hash_collision(fake_embedder):
+    work_dir = '/tmp/test_faiss_hash_collision'
+    shutil.rmtree(work_dir, ignore_errors=True)
+    # different contents, same 6 hex `_hash`
+    a = HashedChunk(content_or_path='chunk 2726')
+    b = HashedChunk(content_or_path='chunk 4934')
+    assert a._hash == b._hash
+
+    g = Faiss()
+    g.upsert(a)
+    g.upsert(b)
+    g.upsert(HashedChunk(content_or_path='chunk 2726'))
+    g.save(work_dir, fake_embedder)
+    assert len(g) == 2
+
+    g = Faiss.load_local(work_dir)
+    assert g.delete(b)
+    assert not g.delete(b)
+    g.save(work_dir, fake_embedder)
+    g = Faiss.load_local(work_dir)
+    assert [c.content_or_path for c in g.chunks] == ['chunk 2726']
+
+
+def test_faiss_lazy_load():
+    work_dir = '/tmp/test_faiss_lazy_load'
+    shutil.rmtree(work_dir, ignore_errors=True)
+    features = np.random.default_rng(0).standard_normal(
+        (100, 16)).astype(np.float32)
+    chunks = [
+        HashedChunk(content_or_path=str(i), metadata={'i': i}) for i in range(100)
+    ]
+    index = Faiss.build_index(features,
+                              DistanceStrategy.EUCLIDEAN_DISTANCE,
+                              index_type='flat')
+    index.add(features)
+    g = Faiss(index=index, chunks=chunks, k=5)
+
+    class FakeEmbedder:
+        distance_strategy = DistanceStrategy.EUCLIDEAN_DISTANCE
+
+    g.save(work_dir, FakeEmbedder())
+    # recall report is opt-in
+    assert not os.path.exists(os.path.join(work_dir, 'index_report.json'))
+
+    g = Faiss.load_local(work_dir)
+    assert g.segments[0].mmap
+    assert len(g) == 100 and not g.id2chunk
+    pairs = g.search(features[7:8])
+    assert pairs[0][0].content_or_path == '7'
+    assert pairs[0][0].metadata == {'i': 7}
+    assert len(g.id2chunk) == g.k
+
+    # retrievers of one folder share an instance
+    assert Faiss.load(work_dir) is Faiss.load(work_dir + '/')
+    assert Faiss.load(work_dir) is not g
+
+
+def test_faiss_quantization():
+    features = np.random.default_rng(0).standard_normal(
+        (2000, 32)).astype(np.float32)
+    assert Faiss.estimate_memory('flat', 2000, 32, 'int8') * 4 == \
+        Faiss.estimate_memory('flat', 2000, 32)
+    for quantization in ['fp16', 'int8']:
+        index = Faiss.build_index(features,
+                                  DistanceStrategy.EUCLIDEAN_DISTANCE,
+                                  index_type='hnsw',
+                                  quantization=quantization)
+        index.add(features)
+        report = Faiss.benchmark_index(index, features,
+                                       DistanceStrategy.EUCLIDEAN_DISTANCE)
+        assert report['runs'][-1]['recall'] >= 0.95
+
+    # tombstones are skipped through the re-ranking index
+    class FakeEmbedder:
+        distance_strategy = DistanceStrategy.EUCLIDEAN_DISTANCE
+
+        def embed_chunks(self, chunks, batch_size):
+            return [features[int(c.content_or_path):int(c.content_or_path) + 1]
+                    for c in chunks]
+
+    work_dir = '/tmp/test_faiss_quantization'
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.environ['HUIXIANGDOU_INDEX_QUANT'] = 'int8'
+    os.environ['HUIXIANGDOU_INDEX_REPORT'] = '1'
+    try:
+        g = Faiss()
+        for i in range(100):
+            g.upsert(HashedChunk(content_or_path=str(i)))
+        g.save(work_dir, FakeEmbedder())
+    finally:
+        del os.environ['HUIXIANGDOU_INDEX_QUANT']
+        del os.environ['HUIXIANGDOU_INDEX_REPORT']
+    with open(os.path.join(work_dir, 'index_report.json')) as f:
+        assert json.load(f)['runs'][-1]['recall'] >= 0.95
+    g = Faiss.load_local(work_dir)
+    assert Faiss._refine(g.index) is not None
+    assert g.search(features[7:8])[0][0].content_or_path == '7'
+    g.delete(HashedChunk(content_or_path='7'))
+    pairs = g.search(features[7:8])
+    assert len(pairs) == g.k
+    assert all(c.content_or_path != '7' for c, _ in pairs)
+
+
 if __name__ == '__main__':
     test_faiss()
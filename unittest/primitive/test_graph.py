@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 from huixiangdou.primitive import MemoryGraph, Vertex, Edge, Direction
 
@@ -104,6 +105,54 @@ def test_graph_viz():
         f.write(vis_content)
 
 
+def build_graph():
+    g = MemoryGraph()
+    for i in range(1, 5):
+        g.upsert_vertex(Vertex(str(i), name=f"TestVertex{i}", rank=i))
+    g.append_edge(Edge("1", "2", "LIKES", weight=1))
+    g.append_edge(Edge("1", "2", "KNOWS", weight=2))
+    g.append_edge(Edge("2", "3", "LIKES"))
+    g.append_edge(Edge("3", "1", "LIKES"))
+    g.append_edge(Edge("4", "5", "LIKES"))
+    return g
+
+
+def test_frozen_graph():
+    """测试只读压缩图与 MemoryGraph 一致"""
+    g = build_graph()
+    f = g.freeze()
+    assert f.vertex_count == g.vertex_count == 5
+    assert f.edge_count == g.edge_count == 5
+    assert f.get_vertex("2").props == {"rank": 2}
+    assert f.get_vertex("5").props == {}
+    assert {e.name for e in f.get_edge("1", "2")} == {"LIKES", "KNOWS"}
+    assert f.get_edge("2", "1") is None
+    assert f.format().count("\n") == g.format().count("\n")
+
+    for vid in ["1", "2", "3", "4", "5", "x"]:
+        assert asyncio.run(f.node_degree(vid)) == asyncio.run(
+            g.node_degree(vid))
+        for direction in [Direction.OUT, Direction.IN, Direction.BOTH]:
+            frozen = asyncio.run(f.get_neighbor_edges(vid, direction))
+            memory = asyncio.run(g.get_neighbor_edges(vid, direction))
+            assert sorted(str(e) for e in frozen) == sorted(
+                str(e) for e in memory)
+
+    # edges keep identity while referenced
+    edges = list(asyncio.run(f.get_neighbor_edges("1", Direction.BOTH)))
+    again = list(asyncio.run(f.get_neighbor_edges("1", Direction.BOTH)))
+    assert set(edges) == set(again)
+
+    assert sorted(f.expand(["1"], Direction.OUT)) == ["2"]
+    assert sorted(f.expand(["1"], Direction.BOTH, depth=2)) == ["2", "3"]
+    subgraph = asyncio.run(f.search(["1"], direct=Direction.OUT, depth=2))
+    assert subgraph.vertex_count == 3
+
+    with pytest.raises(TypeError):
+        f.upsert_vertex(Vertex("6"))
+    assert f.thaw().edge_count == 5
+
+
 # 运行 pytest 测试
 if __name__ == "__main__":
     pytest.main()
@@ -1,77 +1,82 @@
-import pytest
+import os
+import time
+import shutil
 import asyncio
-from huixiangdou.primitive import RPM, TPM  # 替换 your_module 为你的模块名
-from datetime import datetime, timedelta
-from loguru import logger
+from huixiangdou.primitive import RPM, TPM
+from huixiangdou.primitive.limitter import TokenBucket
 
 
-# 测试 RPM 类
-@pytest.mark.asyncio
-async def test_rpm():
-    rpm_instance = RPM(rpm=1)
-    await rpm_instance.wait()
-    assert rpm_instance.record['counter'] == 1
+def test_bucket_burst_then_delay():
+    bucket = TokenBucket(capacity=60, period=60)
+    # full bucket serves a burst without sleeping
+    assert bucket.reserve(60).delay == 0
+    # 1 token per second afterwards
+    r = bucket.reserve(1)
+    assert 0.9 < r.delay <= 1.0
 
 
-# 测试 RPM 类的速率限制
-@pytest.mark.asyncio
-async def test_rpm_rate_limit():
-    rpm_instance = RPM(rpm=1)
-    await rpm_instance.wait()
-    # 立即再次调用 wait 应该会导致等待下一分钟后才增加计数
-    start_time = datetime.now()
-    await rpm_instance.wait()
-    end_time = datetime.now()
-    assert (end_time - start_time) <= timedelta(minutes=1)
-    assert rpm_instance.record['counter'] == 1
+def test_bucket_fifo():
+    bucket = TokenBucket(capacity=10, period=1)
+    bucket.reserve(10)
+    delays = [bucket.reserve(1).delay for _ in range(5)]
+    # waiters wake one by one in call order
+    assert delays == sorted(delays)
+    assert 0.45 < delays[-1] <= 0.5
 
 
-# 测试 TPM 类
-@pytest.mark.asyncio
-async def test_tpm():
-    tpm_instance = TPM(tpm=2)
-    await tpm_instance.wait(1)
-    await tpm_instance.wait(1)
-    assert tpm_instance.record['counter'] <= 2
-    await tpm_instance.wait(1)
-    assert tpm_instance.record['counter'] == 1
+def test_reservation_settle_refund():
+    bucket = TokenBucket(capacity=100, period=60)
+    r = bucket.reserve(80)
+    assert bucket.available() < 21
+    r.settle(30)
+    assert 69 < bucket.available() < 71
+    # settle only once
+    r.settle(0)
+    assert bucket.available() < 72
 
 
-# 测试 TPM 类的速率限制
-@pytest.mark.asyncio
-async def test_tpm_rate_limit():
-    tpm_instance = TPM(tpm=1)
-    # 立即再次调用 wait 应该会导致等待直到计数重置
-    start_time = datetime.now()
-    await tpm_instance.wait(1)
-    end_time = datetime.now()
-    assert (end_time - start_time) <= timedelta(minutes=1)
-    assert tpm_instance.record['counter'] == 1
+def test_rpm_tpm():
+    rpm = RPM(rpm=120)
+    start = time.time()
+    for _ in range(120):
+        asyncio.run(rpm.wait(silent=True))
+    # 0.5 second per request once the bucket is empty
+    asyncio.run(rpm.wait(silent=True))
+    assert 0.4 < time.time() - start < 1.0
 
+    tpm = TPM(tpm=600)
+    reservation = asyncio.run(tpm.acquire(token_count=500))
+    reservation.settle(100)
+    start = time.time()
+    tpm.wait_sync(token_count=500, silent=True)
+    assert time.time() - start < 0.1
 
-# 测试 TPM 类的 token_count 参数
-@pytest.mark.asyncio
-async def test_tpm_token_count():
-    tpm_instance = TPM(tpm=10)
-    await tpm_instance.wait(5)
-    assert tpm_instance.record['counter'] == 5
-    await tpm_instance.wait(6)  # 这应该超过限制并等待
-    assert tpm_instance.record['counter'] == 6
 
+def test_shared_state():
+    state_dir = '/tmp/test_limitter'
+    if os.path.exists(state_dir):
+        shutil.rmtree(state_dir)
+    path = os.path.join(state_dir, 'kimi.tpm')
+    a = TokenBucket(capacity=100, state_path=path)
+    b = TokenBucket(capacity=100, state_path=path)
+    a.reserve(60)
+    assert b.available() < 41
+    assert b.reserve(60).delay > 0
 
-def always_get_an_event_loop() -> asyncio.AbstractEventLoop:
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    return loop
 
+def test_cancelled_wait_refund():
+    tpm = TPM(tpm=600)
+    asyncio.run(tpm.acquire(token_count=600))
 
-if __name__ == '__main__':
-    loop = always_get_an_event_loop()
-    # loop.run_until_complete(test_rpm())
-    # loop.run_until_complete(test_rpm_rate_limit())
-    loop.run_until_complete(test_tpm())
-    loop.run_until_complete(test_tpm_rate_limit())
-    loop.run_until_complete(test_tpm_token_count())
+    async def cancel_waiting():
+        task = asyncio.ensure_future(tpm.acquire(token_count=300))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(cancel_waiting())
+    # the cancelled reservation is given back, only the first one is queued
+    assert tpm.bucket.available() > -1
@@ -70,6 +70,28 @@ class TestLLM(unittest.TestCase):
             await self.llm.chat('Test prompt', 'kimi')
 
 
+def test_backend_client_pool():
+    backend = Backend(name='local', data={'max_connections': 2})
+
+    async def run():
+        client = backend.client()
+        # long-lived, shared by every call on the same loop
+        assert backend.client() is client
+        assert backend.client(timeout=10)._client is client._client
+        async with backend.track():
+            async with backend.track():
+                async with backend.track():
+                    assert backend.inflight == 3
+        stats = backend.pool_stats()
+        assert stats['peak_inflight'] == 3
+        assert stats['saturated_requests'] == 1
+        assert stats['inflight'] == 0
+        await backend.aclose()
+        assert backend._client is None
+
+    asyncio.run(run())
+
+
 def always_get_an_event_loop() -> asyncio.AbstractEventLoop:
     try:
         loop = asyncio.get_running_loop()
@@ -0,0 +1,215 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from openai import APIConnectionError, RateLimitError
+
+from huixiangdou.primitive import LLM
+
+
+def build_llm(hedge_delay: float = 2.0):
+    config_path = '/tmp/test_router_config.ini'
+    with open(config_path, 'w', encoding='utf8') as f:
+        f.write(f'''
+[llm_cache]
+file_path = "/tmp/test_router_cache"
+
+[llm_router]
+hedge_delay = {hedge_delay}
+
+[llm.kimi]
+api_key = "EMPTY"
+model = "a"
+
+[llm.step]
+api_key = "EMPTY"
+model = "b"
+''')
+    llm = LLM(config_path)
+    return llm
+
+
+class FakeCompletions:
+    """`chat.completions` of one backend, answers with `behavior()`."""
+
+    def __init__(self, name: str, behavior, called: list):
+        self.name = name
+        self.behavior = behavior
+        self.called = called
+
+    async def create(self, stream: bool = False, **kwargs):
+        self.called.append(self.name)
+        content = await self.behavior()
+        if stream:
+            return self.stream(content)
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    @staticmethod
+    async def stream(content: str):
+        for char in content:
+            delta = SimpleNamespace(content=char)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+def fake_backends(llm, behaviors):
+    """Replace the openai client of each backend, scheduler, limiter and
+    router still run."""
+    called = []
+    for name, behavior in behaviors.items():
+        completions = FakeCompletions(name, behavior, called)
+        client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        llm.backends[name].client = lambda timeout=None, client=client: client
+    return called
+
+
+def connection_error():
+    return APIConnectionError(
+        request=httpx.Request('POST', 'http://localhost'))
+
+
+def rate_limit_error():
+    request = httpx.Request('POST', 'http://localhost')
+    return RateLimitError('rate limited',
+                          response=httpx.Response(429, request=request),
+                          body=None)
+
+
+def assert_settled(llm):
+    """No request in flight, no TPM reservation left behind."""
+    for instance in llm.backends.values():
+        assert instance.scheduler.inflight == 0
+        assert instance.tpm.bucket.available() > instance.tpm.tpm - 100
+
+
+def test_rank_by_latency_and_cooldown():
+    llm = build_llm()
+    llm.router.record_success('kimi', 3.0)
+    llm.router.record_success('step', 0.5)
+    assert llm.router.candidates('default') == ['step', 'kimi']
+    # explicit backend is never routed
+    assert llm.router.candidates('kimi') == ['kimi']
+
+    llm.router.record_failure('step', connection_error())
+    assert llm.router.candidates('default') == ['kimi', 'step']
+    # first failure cools down 2 seconds, doubled until `cooldown`
+    assert 1 < llm.router.health['step'].cooldown_until - time.time() <= 2
+
+
+def test_failover():
+    llm = build_llm()
+    llm.router.record_success('kimi', 0.1)
+    llm.router.record_success('step', 0.2)
+
+    async def fail():
+        raise connection_error()
+
+    async def ok():
+        return 'from step'
+
+    called = fake_backends(llm, {'kimi': fail, 'step': ok})
+    start = time.time()
+    r = asyncio.run(llm.chat('hi', enable_cache=False))
+    assert r == 'from step'
+    assert called == ['kimi', 'step']
+    # no tenacity sleep
+    assert time.time() - start < 5
+    assert llm.router.health['kimi'].cooling()
+    assert llm.router.health['step'].success == 2
+    assert_settled(llm)
+
+
+def test_hedge():
+    llm = build_llm(hedge_delay=0.05)
+    llm.router.record_success('kimi', 0.01)
+    llm.router.record_success('step', 0.02)
+
+    async def slow():
+        await asyncio.sleep(2)
+        return 'slow'
+
+    async def fast():
+        return 'fast'
+
+    called = fake_backends(llm, {'kimi': slow, 'step': fast})
+    start = time.time()
+    r = asyncio.run(llm.chat('hi', enable_cache=False, hedge=True))
+    assert r == 'fast'
+    assert called == ['kimi', 'step']
+    assert time.time() - start < 1
+    # the cancelled request released its slot and reservation
+    assert_settled(llm)
+
+
+def test_stream_failover():
+    llm = build_llm()
+    llm.router.record_success('kimi', 0.1)
+    llm.router.record_success('step', 0.2)
+
+    async def fail():
+        raise connection_error()
+
+    async def ok():
+        return 'from step'
+
+    called = fake_backends(llm, {'kimi': fail, 'step': ok})
+
+    async def collect():
+        return ''.join([
+            c async for c in llm.chat_stream('hi stream', enable_cache=False)
+        ])
+
+    assert asyncio.run(collect()) == 'from step'
+    assert called == ['kimi', 'step']
+    assert_settled(llm)
+
+
+def test_skip_too_long_backend():
+    llm = build_llm()
+    llm.router.record_success('kimi', 0.1)
+    llm.router.record_success('step', 0.2)
+    llm.backends['kimi'].max_token_size = 1
+
+    async def ok():
+        return 'short enough'
+
+    called = fake_backends(llm, {'kimi': ok, 'step': ok})
+    prompt = 'a prompt longer than one token'
+    assert asyncio.run(llm.chat(prompt, enable_cache=False)) == 'short enough'
+
+    async def collect():
+        return ''.join(
+            [c async for c in llm.chat_stream(prompt, enable_cache=False)])
+
+    assert asyncio.run(collect()) == 'short enough'
+    assert called == ['step', 'step']
+
+
+def test_single_backend_rate_limit():
+    llm = build_llm()
+
+    async def limited():
+        raise rate_limit_error()
+
+    called = fake_backends(llm, {'kimi': limited, 'step': limited})
+
+    async def collect():
+        return ''.join([
+            c async for c in llm.chat_stream(
+                'hi stream', backend='kimi', enable_cache=False)
+        ])
+
+    for call in [
+            lambda: llm.chat('hi', backend='kimi', enable_cache=False),
+            collect
+    ]:
+        start = time.time()
+        with pytest.raises(RateLimitError):
+            asyncio.run(call())
+        # raised at once, no 30s sleep before retrying
+        assert time.time() - start < 5
+    assert called == ['kimi', 'kimi']
+    assert llm.router.health['kimi'].cooling()
+    assert_settled(llm)
@@ -0,0 +1,66 @@
+import asyncio
+
+from huixiangdou.primitive import ConcurrencyScheduler, Priority
+
+
+def test_priority_order():
+
+    async def run():
+        scheduler = ConcurrencyScheduler(max_inflight=1)
+        order = []
+
+        async def job(name, priority):
+            async with scheduler.slot(priority):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        # occupy the only slot, then queue lower priorities first
+        first = asyncio.create_task(job('first', Priority.BUILD))
+        await asyncio.sleep(0)
+        tasks = [
+            asyncio.create_task(job('eval', Priority.EVALUATION)),
+            asyncio.create_task(job('build', Priority.BUILD)),
+            asyncio.create_task(job('chat', Priority.INTERACTIVE))
+        ]
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth()['INTERACTIVE'] == 1
+        await asyncio.gather(first, *tasks)
+        return order, scheduler.stats()
+
+    order, stats = asyncio.run(run())
+    assert order == ['first', 'chat', 'build', 'eval']
+    assert stats['inflight'] == 0
+    assert stats['peak_queue_depth'] == 3
+
+
+def test_release_on_exception_and_cancel():
+
+    async def run():
+        scheduler = ConcurrencyScheduler(max_inflight=2)
+
+        async def fail():
+            async with scheduler.slot():
+                raise ValueError('failed')
+
+        for _ in range(5):
+            try:
+                await fail()
+            except ValueError:
+                pass
+        assert scheduler.inflight == 0
+
+        async def hold():
+            async with scheduler.slot():
+                await asyncio.sleep(1)
+
+        tasks = [asyncio.create_task(hold()) for _ in range(4)]
+        await asyncio.sleep(0.01)
+        assert scheduler.inflight == 2
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert scheduler.inflight == 0
+    assert not scheduler.waiters
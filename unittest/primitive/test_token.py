@@ -0,0 +1,33 @@
+import pytest
+from huixiangdou.primitive import (count_tokens, count_tokens_batch,
+                                   encode_string, encoder_available,
+                                   prime_token_count)
+from huixiangdou.primitive.token import TOKEN_COUNTER, estimate_tokens
+
+
+def test_count_tokens():
+    texts = ['hello world', '你好，世界', 'hello world', '']
+    counts = count_tokens_batch(texts)
+    assert counts[0] == counts[2]
+    assert counts[3] == 0
+    hits = TOKEN_COUNTER.hits
+    assert count_tokens('hello world') == counts[0]
+    assert TOKEN_COUNTER.hits == hits + 1
+
+
+def test_count_tokens_exact():
+    if not encoder_available():
+        pytest.skip('tiktoken BPE file can not be loaded')
+    texts = ['exact hello world', '精确的你好，世界']
+    assert count_tokens_batch(texts) == [len(encode_string(t)) for t in texts]
+
+
+def test_estimate_tokens():
+    assert estimate_tokens('') == 0
+    assert estimate_tokens('hello world') == 3
+    assert estimate_tokens('你好，世界') == 5
+
+
+def test_prime():
+    prime_token_count('some chunk loaded from ChunkSQL', 42)
+    assert count_tokens('some chunk loaded from ChunkSQL') == 42
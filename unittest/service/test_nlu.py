@@ -1,9 +1,12 @@
 from huixiangdou.service.nlu import is_float_regex, clean_str, split_string_by_multi_markers, pack_user_assistant_to_messages, _handle_single_entity_extraction, _handle_single_relationship_extraction
 from huixiangdou.service.nlu import _handle_entity_relation_summary, _merge_nodes_then_upsert, _merge_edges_then_upsert
-from huixiangdou.service.nlu import parse_chunk_to_knowledge
+from huixiangdou.service.nlu import parse_chunk_to_knowledge, pack_chunks, extract_packed_knowledge, flush_knowledge
+from huixiangdou.service.sql import DescriptionSQL
 from huixiangdou.primitive import MemoryGraph, Chunk, Faiss, encode_string, LLM
 import unittest
 import json
+import os
+import shutil
 import pytoml
 import asyncio
 from loguru import logger
@@ -203,3 +206,110 @@ def test_async_funcs():
     loop.run_until_complete(inst.test_merge_nodes_then_upsert())
     loop.run_until_complete(inst.test_merge_edges_then_upsert())
     loop.run_until_complete(inst.test_parse_chunk_to_knowledge())
+
+
+class PackedLLM:
+    """Replies with records of two packed chunks, one of them unmarked."""
+
+    def __init__(self):
+        self.prompts = []
+
+    async def chat(self, prompt: str, **kwargs):
+        self.prompts.append(prompt)
+        if len(self.prompts) > 1:
+            return '("entity"<|>"Bob"<|>"person"<|>"Bob plays chess")##<|COMPLETE|>'
+        return """<|CHUNK 1|>
+("entity"<|>"Alice"<|>"person"<|>"Alice lives in Paris")##
+("entity"<|>"Paris"<|>"geo"<|>"capital of France")##
+("relationship"<|>"Alice"<|>"Paris"<|>"Alice lives in Paris"<|>"live"<|>8)##
+<|CHUNK 2|>
+("entity"<|>"Chess"<|>"game"<|>"a board game")##
+<|COMPLETE|>"""
+
+
+def test_pack_chunks():
+    chunks = [
+        Chunk(content_or_path='Alice lives in Paris.'),
+        Chunk(content_or_path='Bob plays chess.'),
+        Chunk(content_or_path='Carol reads books.'),
+        Chunk(content_or_path='百草园是我的乐园。')
+    ]
+    packs = pack_chunks(chunks, max_tokens=1024, max_count=2)
+    assert [len(p) for p in packs] == [2, 1, 1]
+    assert packs[0][1] is chunks[1]
+    assert packs[-1][0] is chunks[-1]
+    # oversize chunks stay alone
+    assert [len(p) for p in pack_chunks(chunks, max_tokens=1, max_count=8)
+            ] == [1, 1, 1, 1]
+
+
+def test_extract_packed_knowledge():
+    chunks = [
+        Chunk(content_or_path='Alice lives in Paris.'),
+        Chunk(content_or_path='Bob plays chess.')
+    ]
+    llm = PackedLLM()
+    loop = always_get_an_event_loop()
+    results, saved = loop.run_until_complete(
+        extract_packed_knowledge(chunks, llm))
+    assert '<|CHUNK 2|>' in llm.prompts[0]
+    assert saved > 0
+    (nodes0, edges0), (nodes1, edges1) = results
+    assert set(nodes0) == {'ALICE', 'PARIS'}
+    assert set(edges0) == {('ALICE', 'PARIS')}
+    assert nodes0['ALICE'][0]['source_id'] == chunks[0]._hash
+    # unmarked gleaning record goes to the chunk mentioning it
+    assert set(nodes1) == {'CHESS', 'BOB'}
+    assert nodes1['BOB'][0]['source_id'] == chunks[1]._hash
+
+
+class FakeGraphStore:
+
+    def insert_graph(self, graph):
+        self.graph = graph
+
+
+def test_flush_shared_keywords(fake_embedder):
+    work_dir = '/tmp/test_flush_shared_keywords'
+    shutil.rmtree(work_dir, ignore_errors=True)
+    descriptions = DescriptionSQL(work_dir)
+    stores = dict(entityDB=Faiss(),
+                  relationDB=Faiss(),
+                  entityDB_mix=Faiss(),
+                  relationDB_mix=Faiss())
+
+    def flush(relations: dict):
+        descriptions.merge_many(
+            'relation', {
+                json.dumps(ids): dict(descriptions=[text],
+                                      keywords=['uses'],
+                                      source_ids=['c0'],
+                                      weight=1)
+                for ids, text in relations.items()
+            })
+        published = always_get_an_event_loop().run_until_complete(
+            flush_knowledge(llm=None,
+                            descriptions=descriptions,
+                            graph_store=FakeGraphStore(),
+                            **stores))
+        for name, store in stores.items():
+            store.save(os.path.join(work_dir, name), fake_embedder)
+        descriptions.mark_published('relation', published['relation'])
+
+    flush({('A', 'B'): 'A uses B', ('C', 'D'): 'C uses D'})
+    relationDB = stores['relationDB']
+    assert relationDB.get(Chunk(content_or_path='uses')).metadata['src_id'] == 'A'
+
+    # republish the edge which does not own the shared keyword vector
+    flush({('C', 'D'): 'C uses D again'})
+    stored = relationDB.get(Chunk(content_or_path='uses'))
+    assert (stored.metadata['src_id'], stored.metadata['tgt_id']) == ('A', 'B')
+    assert len(relationDB) == 1
+
+    # the owner replaces its own vector
+    flush({('A', 'B'): 'A uses B again'})
+    stored = relationDB.get(Chunk(content_or_path='uses'))
+    assert stored.metadata['src_id'] == 'A'
+    assert 'again' in stored.metadata['description']
+    assert len(relationDB) == 1
+    shutil.rmtree(work_dir)
@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 from huixiangdou.primitive import MemoryGraph, Vertex, Edge, Direction
 from huixiangdou.service import TuGraphStore
@@ -20,3 +21,77 @@ def test_graph_search():
     store = TuGraphStore(config_path='config.ini')
     store.insert_graph(g)
     store.drop()
+
+
+def test_batched_queries():
+    """测试批量查询与单个查询一致"""
+    g = MemoryGraph()
+    for i in range(1, 5):
+        g.upsert_node(name=str(i),
+                      data=dict(description=f"desc{i}",
+                                source_id="h1",
+                                entity_type="T"))
+    g.upsert_edge("1", "2", name="LIKES", data=dict(weight=1, description="a", source_id="h1"))
+    g.upsert_edge("2", "3", name="KNOWS", data=dict(weight=2, description="b", source_id="h1"))
+
+    store = TuGraphStore(config_path='config.ini')
+    store.insert_graph(g)
+    loop = asyncio.new_event_loop()
+    try:
+        vids = ["1", "2", "3", "4", "missing"]
+        nodes = store.get_nodes(vids)
+        assert [n.vid if n else None for n in nodes] == ["1", "2", "3", "4", None]
+
+        degrees = loop.run_until_complete(store.node_degrees(vids))
+        for vid, degree in zip(vids, degrees):
+            assert degree == loop.run_until_complete(store.node_degree(vid))
+
+        neighbors = loop.run_until_complete(
+            store.get_neighbor_edges_many(["2", "4"]))
+        assert sorted(e.name for e in neighbors[0]) == ["KNOWS", "LIKES"]
+        assert neighbors[1] == []
+
+        edges = store.get_edges_many([("1", "2"), ("2", "3")])
+        assert [next(iter(e)).name for e in edges] == ["LIKES", "KNOWS"]
+        assert loop.run_until_complete(store.edge_degrees([("1", "2")
+                                                           ])) == [3]
+    finally:
+        loop.close()
+        store.drop()
+
+
+def test_neighbor_edges_cap():
+    """测试热点节点的邻边数量在查询中截断"""
+    g = MemoryGraph()
+    g.upsert_node(name="hub", data=dict(description="hub", source_id="h1", entity_type="T"))
+    for i in range(300):
+        g.upsert_node(name=f"leaf{i}", data=dict(description=f"desc{i}", source_id="h1", entity_type="T"))
+        g.upsert_edge("hub", f"leaf{i}", name="LINKS", data=dict(weight=1, description="c", source_id="h1"))
+
+    store = TuGraphStore(config_path='config.ini')
+    store.insert_graph(g)
+    fetched = []
+    query = store.query
+
+    def counting_query(*args, **kwargs):
+        memory_graph = query(*args, **kwargs)
+        fetched.append(memory_graph.edge_count)
+        return memory_graph
+
+    store.query = counting_query
+    loop = asyncio.new_event_loop()
+    try:
+        neighbors = loop.run_until_complete(
+            store.get_neighbor_edges_many(["hub", "leaf0"]))
+        assert len(neighbors[0]) == 256
+        assert len(neighbors[1]) == 1
+        # bounded by the query, not after transfer
+        assert fetched[-1] <= 256 + 1
+
+        neighbors = loop.run_until_complete(
+            store.get_neighbor_edges_many(["hub"], limit=8))
+        assert len(neighbors[0]) == 8
+        assert fetched[-1] == 8
+    finally:
+        loop.close()
+        store.drop()
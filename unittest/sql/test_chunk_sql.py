@@ -1,7 +1,7 @@
 import unittest
 from unittest.mock import patch, mock_open
 from huixiangdou.service import ChunkSQL
-from huixiangdou.primitive import Chunk
+from huixiangdou.primitive import Chunk, encoder_available
 import sqlite3
 import os
 import shutil
@@ -45,6 +45,46 @@ class TestChunkSQL(unittest.TestCase):
         self.chunksql.delete(self.chunk._hash)
         self.assertIsNone(self.chunksql.get(self.chunk._hash))
 
+    def test_get_many_exist_many(self):
+        chunks = [Chunk(content_or_path=f'content {i}') for i in range(3)]
+        self.chunksql.add(chunks[0:2])
+        hashes = [c._hash for c in chunks]
+        # keep input order, None for missing
+        retrieved = self.chunksql.get_many(hashes + [hashes[0]])
+        self.assertEqual(retrieved[0].content_or_path, 'content 0')
+        self.assertEqual(retrieved[1].content_or_path, 'content 1')
+        self.assertIsNone(retrieved[2])
+        self.assertEqual(retrieved[3]._hash, hashes[0])
+        # served by LRU
+        self.assertIn(hashes[0], self.chunksql.cache)
+        self.assertEqual(self.chunksql.exist_many(hashes), set(hashes[0:2]))
+
+    def test_exist_many_batches(self):
+        # more hashes than one `IN (...)` query binds, half in the LRU
+        chunks = [Chunk(content_or_path=f'batch {i}') for i in range(1200)]
+        self.chunksql.add(chunks)
+        for c in chunks[0:600]:
+            self.chunksql._remember(c)
+        hashes = [c._hash for c in chunks] + ['non_existent_hash']
+        self.assertEqual(self.chunksql.exist_many(hashes), set(hashes[0:-1]))
+        self.chunksql.cache.clear()
+        retrieved = self.chunksql.get_many(hashes)
+        self.assertEqual([c.content_or_path for c in retrieved[0:-1]],
+                         [c.content_or_path for c in chunks])
+        self.assertIsNone(retrieved[-1])
+
+    def test_token_size(self):
+        chunk = Chunk(content_or_path='token size content')
+        self.chunksql.add(chunk)
+        token_size = self.chunksql.conn.execute(
+            'SELECT token_size FROM chunks WHERE _hash = ?',
+            (chunk._hash, )).fetchone()[0]
+        # never store a character estimate
+        if encoder_available():
+            self.assertGreater(token_size, 0)
+        else:
+            self.assertIsNone(token_size)
+
     def tearDown(self):
         # 清理测试数据库和目录
         self.chunksql.__del__()
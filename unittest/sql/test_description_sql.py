@@ -0,0 +1,63 @@
+import unittest
+import shutil
+from huixiangdou.service import DescriptionSQL
+
+
+class TestDescriptionSQL(unittest.TestCase):
+
+    def setUp(self):
+        self.file_dir = '/tmp/description'
+        shutil.rmtree(self.file_dir, ignore_errors=True)
+        self.db = DescriptionSQL(self.file_dir)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.file_dir, ignore_errors=True)
+
+    def test_merge_dirty(self):
+        self.db.merge_many(
+            'entity', {
+                'ALICE':
+                dict(descriptions=['a person'],
+                     source_ids=['h1'],
+                     entity_types={'person': 1})
+            })
+        self.db.merge_many(
+            'entity', {
+                'ALICE':
+                dict(descriptions=['lives in Paris'],
+                     source_ids=['h2'],
+                     entity_types={'person': 1})
+            })
+        [(name, data, published)] = self.db.dirty('entity')
+        self.assertEqual(name, 'ALICE')
+        self.assertEqual(data['descriptions'], ['a person', 'lives in Paris'])
+        self.assertEqual(data['entity_types'], {'person': 2})
+        self.assertIsNone(published)
+
+        self.db.mark_published('entity', [('ALICE', 'summary')])
+        self.assertEqual(self.db.dirty('entity'), [])
+        # same descriptions again do not dirty the row
+        self.db.merge_many('entity',
+                           {'ALICE': dict(descriptions=['a person'])})
+        self.assertEqual(self.db.dirty('entity'), [])
+        self.db.merge_many('entity', {'ALICE': dict(descriptions=['new'])})
+        self.assertEqual(self.db.dirty('entity')[0][2], 'summary')
+
+    def test_relation_weight(self):
+        for _ in range(2):
+            self.db.merge_many(
+                'relation',
+                {'["A", "B"]': dict(descriptions=['rel'], weight=2.0)})
+        self.assertEqual(self.db.dirty('relation')[0][1]['weight'], 4.0)
+
+    def test_summaries(self):
+        self.db.put_summaries({'d1': 'short'})
+        self.db.merge_many('entity', {'ALICE': dict(descriptions=['x'])})
+        self.db.clear()
+        self.assertEqual(self.db.dirty('entity'), [])
+        self.assertEqual(self.db.get_summaries(['d1', 'd2']), {'d1': 'short'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import shutil
+import sqlite3
+import os
+from huixiangdou.service import ExtractionSQL
+from huixiangdou.primitive import Chunk
+
+
+class TestExtractionSQL(unittest.TestCase):
+
+    def setUp(self):
+        self.file_dir = '/tmp/extraction'
+        shutil.rmtree(self.file_dir, ignore_errors=True)
+        self.db = ExtractionSQL(self.file_dir, prompt_version='v1', model='kimi/')
+        self.chunk = Chunk(content_or_path='Alice lives in Paris.')
+        self.result = ({
+            'ALICE': [{
+                'entity_name': 'ALICE',
+                'source_id': self.chunk._hash
+            }]
+        }, {
+            ('ALICE', 'PARIS'): [{
+                'src_id': 'ALICE',
+                'tgt_id': 'PARIS',
+                'weight': 8.0
+            }]
+        })
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.file_dir, ignore_errors=True)
+
+    def test_put_get(self):
+        self.db.put_many([(self.chunk, self.result)])
+        missing = Chunk(content_or_path='Bob plays chess.')
+        self.assertEqual(self.db.get_many([missing, self.chunk]),
+                         [None, self.result])
+        self.assertEqual(len(self.db), 1)
+
+        # reopen keeps rows
+        self.db.close()
+        self.db = ExtractionSQL(self.file_dir, prompt_version='v1', model='kimi/')
+        self.assertEqual(self.db.get_many([self.chunk])[0], self.result)
+
+    def test_hash_collision(self):
+        # different contents, same 6 hex `_hash`
+        a = Chunk(content_or_path='chunk 2726')
+        b = Chunk(content_or_path='chunk 4934')
+        self.assertEqual(a._hash, b._hash)
+        self.db.put_many([(a, self.result)])
+        self.assertEqual(self.db.get_many([a, b]), [self.result, None])
+
+    def test_version_miss(self):
+        self.db.put_many([(self.chunk, self.result)])
+        other = ExtractionSQL(self.file_dir, prompt_version='v2', model='kimi/')
+        self.assertEqual(other.get_many([self.chunk]), [None])
+        self.assertEqual(other.prune(), 1)
+        self.assertEqual(self.db.get_many([self.chunk]), [None])
+        other.close()
+
+    def test_drop_hash_keyed_rows(self):
+        self.db.close()
+        shutil.rmtree(self.file_dir)
+        os.makedirs(self.file_dir)
+        conn = sqlite3.connect(os.path.join(self.file_dir, 'extraction.sql'))
+        conn.execute(
+            'CREATE TABLE extractions (_hash TEXT, prompt_version TEXT, model TEXT, nodes TEXT, edges TEXT, created REAL, PRIMARY KEY (_hash, prompt_version, model))'
+        )
+        conn.execute(
+            "INSERT INTO extractions VALUES (?, 'v1', 'kimi/', '{}', '[]', 0)",
+            (self.chunk._hash, ))
+        conn.commit()
+        conn.close()
+        self.db = ExtractionSQL(self.file_dir, prompt_version='v1', model='kimi/')
+        self.assertEqual(len(self.db), 0)
+        self.db.put_many([(self.chunk, self.result)])
+        self.assertEqual(self.db.get_many([self.chunk])[0], self.result)
+
+
+if __name__ == '__main__':
+    unittest.main()